@@ -1,6 +1,6 @@
 // src/components/EditScriptContent.js
 
-import React, { useState, useMemo } from "react";
+import React, { useState, useMemo, useEffect } from "react";
 import { useParams } from "react-router-dom";
 import { useSelector, useDispatch } from "react-redux";
 import {
@@ -13,13 +13,14 @@ import {
   Upload,
   message,
   Modal,
+  Alert,
 } from "antd";
 import {
   DownloadOutlined,
   UploadOutlined,
   SaveOutlined,
 } from "@ant-design/icons";
-import { editScript } from "../slices/dataSlice";
+import { editScript, fetchScriptIntegrity } from "../slices/dataSlice";
 
 const { Title, Paragraph } = Typography;
 const { Option } = Select;
@@ -31,6 +32,12 @@ const EditScriptContent = () => {
     state.data.scripts.find((s) => s.consent_id === script_id)
   );
 
+  const integrity = useSelector((state) => state.data.scriptIntegrity[script_id]);
+
+  useEffect(() => {
+    if (script_id) dispatch(fetchScriptIntegrity(script_id));
+  }, [dispatch, script_id]);
+
   const [form] = Form.useForm();
   const [uploadModalVisible, setUploadModalVisible] = useState(false);
   const [editableScriptMap, setEditableScriptMap] = useState(
@@ -129,6 +136,7 @@ const EditScriptContent = () => {
     try {
       await dispatch(editScript({ id: script_id, script: editableScriptMap })).unwrap();
       message.success("Script saved successfully!");
+      dispatch(fetchScriptIntegrity(script_id));
     } catch (err) {
       message.error(err || "Failed to save script.");
     }
@@ -146,6 +154,28 @@ const EditScriptContent = () => {
         {scriptMeta.description} (Version {scriptMeta.version_number})
       </Paragraph>
 
+      {integrity && (
+        <Alert
+          style={{ marginBottom: 20 }}
+          type={integrity.ok ? "success" : "warning"}
+          showIcon
+          message={
+            integrity.ok
+              ? `No integrity issues in ${integrity.node_count} nodes.`
+              : `${integrity.errors.length} integrity issues in ${integrity.node_count} nodes`
+          }
+          description={
+            !integrity.ok && (
+              <ul style={{ margin: 0, paddingLeft: 20 }}>
+                {integrity.errors.slice(0, 10).map((err, i) => (
+                  <li key={i}>{err}</li>
+                ))}
+              </ul>
+            )
+          }
+        />
+      )}
+
       <div style={{ marginBottom: 20 }}>
         <Button
           icon={<DownloadOutlined />}
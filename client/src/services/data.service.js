@@ -61,13 +61,14 @@ const generateInviteLink = async (username) => {
 };
 
 // ✅ Submit Consent Form
-const submitConsentForm = async ({invite_id, form_type, node_id, form_responses} ) => {
+const submitConsentForm = async ({invite_id, form_type, node_id, form_responses, since_turn} ) => {
   console.log("Service: ", invite_id, form_type, node_id, form_responses)
   const response = await API.post(`consentbot/consent-response/`, {
     invite_id,
     form_type,
     node_id,
     form_responses,
+    since_turn,
   },
   {
     headers: {
@@ -80,9 +81,9 @@ const submitConsentForm = async ({invite_id, form_type, node_id, form_responses}
 };
 
 // ✅ Submit Consent Response
-const submitConsentResponse = async (invite_id, node_id ) => {
+const submitConsentResponse = async (invite_id, node_id, since_turn ) => {
   const response = await API.get(`consentbot/consent-response/${invite_id}/`, 
-    {params: {"node_id": node_id}
+    {params: {"node_id": node_id, "since_turn": since_turn}
   });
   return response.data;
 };
@@ -147,6 +148,12 @@ const getScripts = async () => {
   const deleteScript = async (id) => {
     await API.delete(`/consentbot/scripts/${id}/`, { headers: getAuthHeaders() });
   };
+
+  // ✅ Fetch the stored integrity report of a script
+  const getScriptIntegrity = async (id) => {
+    const response = await API.get(`/consentbot/scripts/${id}/integrity/`, { headers: getAuthHeaders() });
+    return response.data;
+  };
   
 export const dataService = {
   getUsers,
@@ -164,5 +171,6 @@ export const dataService = {
   getScripts,
   addScript,
   editScript,
-  deleteScript
+  deleteScript,
+  getScriptIntegrity
 };
@@ -11,10 +11,15 @@ const initialState = {
   chat: [],
   consent: {},
   scripts: [],
+  scriptIntegrity: {},
   loading: false,
   error: null,
 };
 
+// Chat responses carry only the turns from `turn_index` on
+const mergeChat = (chat, { chat: turns, turn_index }) =>
+  typeof turn_index === "number" ? [...chat.slice(0, turn_index), ...turns] : turns;
+
 // --- Users ---
 
 export const fetchUsers = createAsyncThunk("data/fetchUsers", async (_, thunkAPI) => {
@@ -120,7 +125,8 @@ export const submitConsentResponse = createAsyncThunk(
   "data/submitConsentResponse",
   async ({ invite_id, node_id }, thunkAPI) => {
     try {
-      const response = await dataService.submitConsentResponse(invite_id, node_id);
+      const since_turn = thunkAPI.getState().data.chat.length;
+      const response = await dataService.submitConsentResponse(invite_id, node_id, since_turn);
       return response;
     } catch (error) {
       return thunkAPI.rejectWithValue(error?.response?.data || error.message);
@@ -130,7 +136,7 @@ export const submitConsentResponse = createAsyncThunk(
 
 export const submitConsentForm = createAsyncThunk(
   "data/submitConsentForm",
-  async ({ invite_id, form_type, node_id, form_responses }, { rejectWithValue }) => {
+  async ({ invite_id, form_type, node_id, form_responses }, { getState, rejectWithValue }) => {
     try {
       console.log("SLice: ", invite_id, form_type, node_id, form_responses )
       const response = await dataService.submitConsentForm({
@@ -138,6 +144,7 @@ export const submitConsentForm = createAsyncThunk(
         form_type,
         node_id,
         form_responses,
+        since_turn: getState().data.chat.length,
       });
       return response;
     } catch (error) {
@@ -213,6 +220,14 @@ export const editScript = createAsyncThunk("data/editScript", async ({ id, ...up
   }
 });
 
+export const fetchScriptIntegrity = createAsyncThunk("data/fetchScriptIntegrity", async (id, thunkAPI) => {
+  try {
+    return await dataService.getScriptIntegrity(id);
+  } catch (error) {
+    return thunkAPI.rejectWithValue(error.message);
+  }
+});
+
 export const deleteScript = createAsyncThunk("data/deleteScript", async (id, thunkAPI) => {
   try {
     await dataService.deleteScript(id);
@@ -314,9 +329,9 @@ const dataSlice = createSlice({
       .addCase(submitConsentResponse.fulfilled, (state, action) => {
         console.log("New chat from response:", action.payload.chat);
       
-        // Replace the full chat history with updated array from backend
+        // Splice the new turns in after the ones we already have
         if (Array.isArray(action.payload?.chat)) {
-          state.chat = action.payload.chat;
+          state.chat = mergeChat(state.chat, action.payload);
         }
       
         state.loading = false;
@@ -334,7 +349,7 @@ const dataSlice = createSlice({
         console.log("submitConsentForm.fulfilled", action.payload)
         state.loading = false;
         if (Array.isArray(action.payload?.chat)) {
-          state.chat = action.payload.chat;
+          state.chat = mergeChat(state.chat, action.payload);
         }
         state.error = null;
         message.success("Form submitted!");
@@ -416,6 +431,9 @@ const dataSlice = createSlice({
         state.scripts = state.scripts.map((s) =>
           s.consent_id === action.payload.consent_id ? action.payload : s
         );
+      })
+      .addCase(fetchScriptIntegrity.fulfilled, (state, action) => {
+        state.scriptIntegrity[action.payload.script_id] = action.payload.report;
       });
   },
 });
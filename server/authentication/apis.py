@@ -2,6 +2,7 @@
 # authentication/apis.py
 
 from django.db import IntegrityError
+from django.db.models import Prefetch, Q
 from django.contrib.auth import get_user_model
 from django.http import JsonResponse
 from django.shortcuts import get_object_or_404
@@ -28,6 +29,9 @@ from authentication.services import (
     FollowUpOutputSerializer
     )
 from authentication.models import FollowUp
+from authentication.selectors import get_participants_queryset
+from consentbot.models import ConsentScript
+from utils.listing import ListQueryInputSerializer, list_objects
 
 User = get_user_model()
 
@@ -144,15 +148,26 @@ class UserViewSet(viewsets.ViewSet):
     # permission_classes = [permissions.IsAuthenticated]
 
     @swagger_auto_schema(
-        operation_description="Retrieve all users",
+        operation_description="Retrieve users; with limit or cursor, one page at a time",
+        query_serializer=ListQueryInputSerializer,
         responses={200: UserOutputSerializer(many=True)},
         tags=["Account Management"]
     )
     def list(self, request):
-        """Retrieve all users (returns only safe fields)."""
-        users = User.objects.all()
-        serializer = UserOutputSerializer(users, many=True)
-        return Response(serializer.data)
+        """Retrieve users (returns only safe fields), ordered by date joined."""
+        params = ListQueryInputSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        return Response(list_objects(
+            get_participants_queryset(),
+            UserOutputSerializer,
+            params.validated_data,
+            created_field="date_joined",
+            summary_counts={
+                "staff": Q(is_staff=True),
+                "consent_complete": Q(consent_complete=True),
+                "declined_consent": Q(declined_consent=True),
+            },
+        ))
 
     @swagger_auto_schema(
         operation_description="Create a new user",
@@ -221,17 +236,27 @@ class FollowUpVieWSet(viewsets.ViewSet):
     #     return [permissions.IsAuthenticated()]
     
     @swagger_auto_schema(
-        operation_description="Retrieve all follow ups",
+        operation_description="Retrieve follow ups; with limit or cursor, one page at a time",
+        query_serializer=ListQueryInputSerializer,
         # responses={200: UserOutputSerializer(many=True)},
         tags=["Follow Ups"]
     )
 
     def list(slef, request):
-        """Retrieve all Follow up instances
+        """Retrieve Follow up instances
         """
-        follow_ups = FollowUp.objects.all()
-        serializer = FollowUpOutputSerializer(follow_ups, many=True)
-        return Response(serializer.data)
+        params = ListQueryInputSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        follow_ups = FollowUp.objects.select_related("user").prefetch_related(
+            # Only the script's name and version are shown
+            Prefetch("user__consent_script", queryset=ConsentScript.objects.only("script_id", "name", "version_number"))
+        )
+        return Response(list_objects(
+            follow_ups,
+            FollowUpOutputSerializer,
+            params.validated_data,
+            summary_counts={"resolved": Q(resolved=True)},
+        ))
     
     @swagger_auto_schema(
         operation_description="Create a new follow-up entry",
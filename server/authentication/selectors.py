@@ -1,7 +1,9 @@
 #!/usr/bin/env python
 # authentication/selectors.py
 
-from consentbot.models import ConsentUrl, ConsentScript
+from django.contrib.auth import get_user_model
+from django.db.models import Count, Exists, OuterRef, Q, Subquery
+from consentbot.models import Consent, ConsentUrl, ConsentScript
 from utils.cache import (
     get_user_consent_history,
     get_user_workflow,
@@ -35,14 +37,41 @@ def get_max_version_number(consent_id):
     )
 
 
-def get_first_test_score(user):
-    tests = user.user_tests.filter(test_try_num=1)
-    total = tests.count()
-    correct = tests.filter(answer_correct=True).count()
+def format_test_score(correct, total):
     if total == 0:
         return "NA"
     return f"{(correct / total) * 100:.0f}%"
 
 
+def get_first_test_score(user):
+    tests = user.user_tests.filter(test_try_num=1)
+    return format_test_score(tests.filter(answer_correct=True).count(), tests.count())
+
+
 def get_latest_consent(user):
     return user.user_consents.order_by('-created_at').first()
+
+
+def get_participants_queryset(queryset=None):
+    """
+    Users annotated with everything UserOutputSerializer shows, so that a
+    list of users is serialized without a query per user:
+
+    - latest_consent_name, latest_consent_age_group, latest_consent_created_at:
+      from the user's most recent Consent
+    - first_try_total, first_try_correct: their first-try test answers
+    - has_invite: whether they have a ConsentUrl
+    """
+    if queryset is None:
+        queryset = get_user_model().objects.all()
+    latest_consent = Consent.objects.filter(user=OuterRef("pk")).order_by("-created_at")
+    return queryset.annotate(
+        latest_consent_name=Subquery(latest_consent.values("consent_script__name")[:1]),
+        latest_consent_age_group=Subquery(latest_consent.values("consent_age_group")[:1]),
+        latest_consent_created_at=Subquery(latest_consent.values("created_at")[:1]),
+        first_try_total=Count("user_tests", filter=Q(user_tests__test_try_num=1)),
+        first_try_correct=Count(
+            "user_tests", filter=Q(user_tests__test_try_num=1, user_tests__answer_correct=True)
+        ),
+        has_invite=Exists(ConsentUrl.objects.filter(user=OuterRef("pk"))),
+    )
@@ -11,11 +11,13 @@ from authentication.models import (
     FollowUp
 )
 from authentication.selectors import (
+    format_test_score,
     get_latest_consent,
     get_first_test_score
 )
 from consentbot.models import ConsentScript
 from consentbot.selectors import get_user_from_invite_id
+from utils.listing import SelectableFieldsMixin
 
 User = get_user_model()
 
@@ -74,7 +76,7 @@ class UserInputSerializer(serializers.ModelSerializer):
         return user
     
 
-class UserOutputSerializer(serializers.ModelSerializer):
+class UserOutputSerializer(SelectableFieldsMixin, serializers.ModelSerializer):
     """
     Serializer for User model output.
 
@@ -94,6 +96,9 @@ class UserOutputSerializer(serializers.ModelSerializer):
     for users who may not have completed consent or test participation.
 
     Note: Staff users will not have consent-related fields populated.
+
+    Users from `get_participants_queryset` are serialized from its
+    annotations; other users cost a few queries each.
     """
     username = serializers.CharField(read_only=True)
     first_test_score = serializers.SerializerMethodField()
@@ -102,7 +107,7 @@ class UserOutputSerializer(serializers.ModelSerializer):
     consent_name = serializers.SerializerMethodField()
     consent_age_group = serializers.SerializerMethodField()
     created_at = serializers.SerializerMethodField()
-    script_id = serializers.UUIDField(source='consent_script.consent_id', read_only=True)
+    script_id = serializers.UUIDField(source='consent_script_id', read_only=True)
 
     class Meta:
         model = User
@@ -113,24 +118,34 @@ class UserOutputSerializer(serializers.ModelSerializer):
         ]
 
     def get_first_test_score(self, user):
+        if hasattr(user, 'first_try_total'):
+            return format_test_score(user.first_try_correct, user.first_try_total)
         return get_first_test_score(user)
 
     def get_invite_expired(self, user):
+        if hasattr(user, 'has_invite'):
+            return not user.has_invite
         return not user.consent_urls.exists()
 
     def get_consent_age_group(self, user):
+        if hasattr(user, 'latest_consent_age_group'):
+            return user.latest_consent_age_group or None
         consent = get_latest_consent(user)
         if consent and consent.consent_age_group:
             return consent.consent_age_group  
         return None
 
     def get_consent_name(self, user):
+        if hasattr(user, 'latest_consent_name'):
+            return user.latest_consent_name
         consent = get_latest_consent(user)
         if consent and consent.consent_script:
             return consent.consent_script.name
         return None
 
     def get_created_at(self, user):
+        if hasattr(user, 'latest_consent_created_at'):
+            return user.latest_consent_created_at
         consent = get_latest_consent(user)
         if consent and consent.created_at:
             return consent.created_at
@@ -155,7 +170,12 @@ class FollowUpInputSerializer(serializers.ModelSerializer):
         return follow_up
 
 
-class FollowUpOutputSerializer(serializers.ModelSerializer):
+class FollowUpOutputSerializer(SelectableFieldsMixin, serializers.ModelSerializer):
+    extra_fields = (
+        'user_id', 'first_name', 'last_name', 'email', 'phone',
+        'consent_script_id', 'consent_script_name', 'consent_script_version',
+    )
+
     class Meta: 
         model = FollowUp
         fields = [
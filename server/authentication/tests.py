@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# authentication/tests.py
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from authentication.selectors import get_participants_queryset
+from authentication.services import UserOutputSerializer
+from consentbot.models import Consent, ConsentAgeGroup, ConsentScript, ConsentTest, ConsentUrl
+
+User = get_user_model()
+
+
+class ParticipantListTests(TestCase):
+    """The user list is serialized from annotations, in a constant number of queries."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(email="coordinator@test.tst", is_staff=True))
+        self.script = ConsentScript.objects.create(name="Test Consent", version_number=1, script={})
+        self.count = 0
+
+    def add_participants(self, n):
+        """Users with a consent, first- and second-try test answers and an invite."""
+        for _ in range(n):
+            self.count += 1
+            user = User.objects.create_user(
+                email=f"participant{self.count}@test.tst", consent_script=self.script
+            )
+            Consent.objects.create(user=user, consent_script=self.script, consent_age_group=ConsentAgeGroup.EIGHTEEN_AND_OVER)
+            for correct in (True, True, False):
+                ConsentTest.objects.create(
+                    user=user, consent_script_version=self.script, test_try_num=1,
+                    test_question="Q", user_answer="A", answer_correct=correct,
+                )
+            ConsentTest.objects.create(
+                user=user, consent_script_version=self.script, test_try_num=2,
+                test_question="Q", user_answer="A", answer_correct=True,
+            )
+            ConsentUrl.objects.create(user=user)
+
+    def count_list_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/mia/auth/users/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), User.objects.count())
+        return len(queries)
+
+    def test_list_query_count_is_constant(self):
+        self.add_participants(1)
+        one = self.count_list_queries()
+        self.add_participants(5)
+        self.assertEqual(self.count_list_queries(), one)
+
+    def test_annotated_output_matches_per_user_output(self):
+        self.add_participants(3)
+        # No consent, no tests, no invite
+        User.objects.create_user(email="newcomer@test.tst")
+
+        annotated = UserOutputSerializer(get_participants_queryset().order_by("date_joined"), many=True).data
+        per_user = UserOutputSerializer(User.objects.order_by("date_joined"), many=True).data
+        self.assertEqual(annotated, per_user)
+
+        by_username = {row["username"]: row for row in annotated}
+        self.assertEqual(by_username["participant1"]["first_test_score"], "67%")
+        self.assertEqual(by_username["participant1"]["consent_age_group"], ">=18")
+        self.assertEqual(by_username["participant1"]["invite_expired"], False)
+        self.assertEqual(by_username["newcomer"]["first_test_score"], "NA")
+        self.assertIsNone(by_username["newcomer"]["consent_age_group"])
+        self.assertIsNone(by_username["newcomer"]["consent_name"])
+        self.assertEqual(by_username["newcomer"]["invite_expired"], True)
@@ -49,6 +49,31 @@ STATIC_ROOT=secrets.get("STATIC", "STATIC_ROOT", fallback=f"{BASE_DIR}/static")
 MEDIA_URL = secrets.get("STATIC", "MEDIA_URL", fallback="/media/")
 MEDIA_ROOT=secrets.get("STATIC", "MEDIA_ROOT", fallback=f"{BASE_DIR}/media")
 
+# Per-worker compiled consent script cache
+SCRIPT_CACHE_MAX_ENTRIES = secrets.getint("CACHE", "SCRIPT_CACHE_MAX_ENTRIES", fallback=16)
+SCRIPT_CACHE_MAX_BYTES = secrets.getint("CACHE", "SCRIPT_CACHE_MAX_BYTES", fallback=32 * 1024 * 1024)
+# "compiled", or "lazy" to read uncached scripts node by node from the node table
+SCRIPT_GRAPH_LOADING = secrets.get("CACHE", "SCRIPT_GRAPH_LOADING", fallback="compiled")
+# How long the integrity index of a script revision is kept in the Django cache
+SCRIPT_INTEGRITY_CACHE_TIMEOUT = secrets.getint("CACHE", "SCRIPT_INTEGRITY_CACHE_TIMEOUT", fallback=24 * 60 * 60)
+
+# Chat session state storage, see utils/session_backends.py
+CONSENT_SESSION_BACKEND = secrets.get(
+    "CACHE", "CONSENT_SESSION_BACKEND", fallback="utils.session_backends.DatabaseSessionBackend"
+)
+CONSENT_SESSION_CACHE_ALIAS = secrets.get("CACHE", "CONSENT_SESSION_CACHE_ALIAS", fallback="default")
+CONSENT_SESSION_CACHE_TIMEOUT = secrets.getint("CACHE", "CONSENT_SESSION_CACHE_TIMEOUT", fallback=14 * 24 * 60 * 60)
+CONSENT_SESSION_WRITE_BEHIND_INTERVAL = secrets.getfloat("CACHE", "CONSENT_SESSION_WRITE_BEHIND_INTERVAL", fallback=2.0)
+# Session values and chat turns at least this many bytes long are stored compressed
+CONSENT_CACHE_COMPRESS_MIN_BYTES = secrets.getint("CACHE", "COMPRESS_MIN_BYTES", fallback=1024)
+CONSENT_CACHE_COMPRESS_LEVEL = secrets.getint("CACHE", "COMPRESS_LEVEL", fallback=6)
+
+CACHES = {
+    "default": {
+        "BACKEND": secrets.get("CACHE", "BACKEND", fallback="django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": secrets.get("CACHE", "LOCATION", fallback=""),
+    }
+}
 
 DATABASES = {
     'default': {
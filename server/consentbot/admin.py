@@ -1,14 +1,18 @@
 # consentbot/admin.py
-from django.contrib import admin
+from django.contrib import admin, messages
 from django_json_widget.widgets import JSONEditorWidget
 from django import forms
 from consentbot.models import (
     ConsentScript,
     ConsentCache,
+    ConsentTurn,
     ConsentUrl,
     Consent,
     ConsentTest
 ) 
+from consentbot.services import check_script_integrity
+from utils.script_cache import compile_script, invalidate_script
+from utils.script_nodes import store_script_nodes
 
 class ConsentScriptAdminForm(forms.ModelForm):
     class Meta:
@@ -25,9 +29,35 @@ class ConsentScriptAdmin(admin.ModelAdmin):
     search_fields = ("name",)
     ordering = ("-created_at",)
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        store_script_nodes(obj)
+        compile_script(obj)
+        report = check_script_integrity(obj)
+        if not report["ok"]:
+            errors = report["errors"]
+            shown = "; ".join(errors[:5]) + ("; ..." if len(errors) > 5 else "")
+            self.message_user(request, f"{len(errors)} integrity issues: {shown}", level=messages.WARNING)
+
+    def delete_model(self, request, obj):
+        script_id = obj.pk
+        super().delete_model(request, obj)
+        invalidate_script(script_id)
+
+    def delete_queryset(self, request, queryset):
+        script_ids = list(queryset.values_list("pk", flat=True))
+        super().delete_queryset(request, queryset)
+        for script_id in script_ids:
+            invalidate_script(script_id)
+
 @admin.register(ConsentCache)
 class ConsentCacheAdmin(admin.ModelAdmin):
-    list_display = ["key", "value"]
+    list_display = ["key", "value", "expires_at"]
+
+@admin.register(ConsentTurn)
+class ConsentTurnAdmin(admin.ModelAdmin):
+    list_display = ["invite", "turn_no", "created_at"]
+    ordering = ("invite", "turn_no")
 
 @admin.register(ConsentUrl)
 class ConsentUrlAdmin(admin.ModelAdmin):
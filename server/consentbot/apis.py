@@ -1,14 +1,14 @@
 #!/usr/bin/env python
 # consentbot/apis.py
 
-import os
 import json
 import shortuuid
-from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.http import FileResponse
+from django.db.models import Prefetch, Q
+from django.http import HttpResponseNotModified, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
+from django.utils.http import content_disposition_header, parse_etags, quote_etag
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import viewsets, permissions, status
 from rest_framework.response import Response
@@ -21,7 +21,8 @@ from authentication.services import (
 from consentbot.models import (
     Consent,
     ConsentScript,
-    ConsentUrl
+    ConsentUrl,
+    script_content_hash
 )
 from consentbot.services import (
     ConsentInputSerializer,
@@ -29,8 +30,24 @@ from consentbot.services import (
     ConsentScriptInputSerializer,
     ConsentScriptOutputSerializer,
     ConsentResponseInputSerializer,
+    ConsentUrlBulkInputSerializer,
     ConsentUrlInputSerializer,
     ConsentUrlOutputSerializer,
+    EXPORT_FORMATS,
+    ExportQueryInputSerializer,
+    ScriptNodeCreateInputSerializer,
+    ScriptNodeListInputSerializer,
+    ScriptNodeDeleteInputSerializer,
+    ScriptNodeMoveInputSerializer,
+    ScriptNodePatchInputSerializer,
+    append_chat_history,
+    bulk_create_consent_urls,
+    check_script_integrity,
+    create_script_node,
+    delete_script_node,
+    export_chunks,
+    move_script_node,
+    update_script_node,
     get_or_initialize_consent_history,
     get_or_initialize_user_consent,
     process_consent_sequence,
@@ -47,13 +64,23 @@ from consentbot.services import (
 )
 
 from consentbot.selectors import (
+    EXPORTS,
+    chat_payload,
     get_script_from_invite_id,
     get_consent_start_id,
+    get_script_integrity_report,
+    list_script_nodes,
     get_user_consent_history,
     get_user_label,
+    invite_context,
 
 )
-from utils.cache import set_user_consent_history
+from utils.cache import consent_session
+from utils.script_cache import compile_script, invalidate_script
+from utils.script_integrity import get_integrity_index, store_integrity_index
+from utils.listing import ListQueryInputSerializer, list_objects
+from utils.script_nodes import store_script_nodes, update_script_nodes
+from utils.streaming import json_chunks
 
 User = get_user_model()
 FORM_HANDLER_MAP = {
@@ -68,18 +95,42 @@ FORM_HANDLER_MAP = {
     # "child_contact": handle_child_contact_form,
 }
 
+
+def refuse_unavailable_invite(invite):
+    """
+    The error response for a chat request on a missing (404) or expired (410)
+    invite, or None if the chat may go on. Checked before any session state
+    is read or written: an expired invite's state reads as missing, so a chat
+    that carried on would lose its progress.
+    """
+    if invite is None:
+        return Response({"detail": "Invite not found."}, status=status.HTTP_404_NOT_FOUND)
+    if invite.is_expired:
+        return Response({"detail": "This invite link has expired."}, status=status.HTTP_410_GONE)
+    return None
+
+
 class ConsentScriptViewSet(viewsets.ViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
     @swagger_auto_schema(
-        operation_description="List all consent scripts", 
+        operation_description="List consent scripts; with limit or cursor, one page at a time",
+        query_serializer=ListQueryInputSerializer,
         tags=["Consent Scripts"],
         responses={200: ConsentScriptOutputSerializer(many=True)}
     )
     def list(self, request):
-        scripts = ConsentScript.objects.all()
-        serializer = ConsentScriptOutputSerializer(scripts, many=True)
-        return Response(serializer.data)
+        params = ListQueryInputSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        # Related versions are only needed for their name and ID, not their script JSON
+        related = ConsentScript.objects.only("script_id", "name", "version_number", "derived_from")
+        scripts = ConsentScript.objects.prefetch_related(
+            Prefetch("derived_from", queryset=related),
+            Prefetch("versions", queryset=related),
+        )
+        return Response(list_objects(
+            scripts, ConsentScriptOutputSerializer, params.validated_data, heavy_fields=("script",)
+        ))
 
     @swagger_auto_schema(
         operation_description="Get consent script details",
@@ -143,20 +194,35 @@ class ConsentScriptViewSet(viewsets.ViewSet):
     def destroy(self, request, pk=None):
         script = get_object_or_404(ConsentScript, pk=pk)
         script.delete()
+        invalidate_script(pk)
         return Response({"message": "Consent script deleted"}, status=status.HTTP_204_NO_CONTENT)
 
-    @action(detail=True, methods=["post"], url_path="download", url_name="download")
+    @swagger_auto_schema(
+        method="get",
+        operation_description="Download the script JSON; answers 304 when If-None-Match has its content hash",
+        tags=["Consent Scripts"]
+    )
+    @swagger_auto_schema(method="post", auto_schema=None)
+    @action(detail=True, methods=["get", "post"], url_path="download", url_name="download")
     def download_script(self, request, pk=None):
-        script = get_object_or_404(ConsentScript, pk=pk)
-        timestamp = timezone.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{script.name}_{timestamp}.json"
-        temp_path = os.path.join(settings.BASE_DIR, 'temp_scripts', filename)
-        os.makedirs(os.path.dirname(temp_path), exist_ok=True)
-
-        with open(temp_path, 'w') as f:
-            json.dump(script.script, f, indent=4)
-
-        return FileResponse(open(temp_path, 'rb'), as_attachment=True, filename=filename)
+        script = get_object_or_404(ConsentScript.objects.only("script_id", "name", "content_hash"), pk=pk)
+        if not script.content_hash:
+            # Rows written without save(), e.g. by loaddata
+            script.content_hash = script_content_hash(script.script)
+            ConsentScript.objects.filter(pk=script.pk).update(content_hash=script.content_hash)
+
+        etag = quote_etag(script.content_hash)
+        if etag in parse_etags(request.headers.get("If-None-Match", "")):
+            # The script JSON is never loaded for an unchanged script
+            response = HttpResponseNotModified()
+        else:
+            timestamp = timezone.now().strftime("%Y%m%d_%H%M%S")
+            filename = f"{script.name}_{timestamp}.json"
+            response = StreamingHttpResponse(json_chunks(script.script, indent=4), content_type="application/json")
+            response["Content-Disposition"] = content_disposition_header(True, filename)
+        response["ETag"] = etag
+        response["Cache-Control"] = "private, no-cache"
+        return response
 
     @action(detail=True, methods=["post"], url_path="upload", url_name="upload")
     def upload_script(self, request, pk=None):
@@ -165,12 +231,34 @@ class ConsentScriptViewSet(viewsets.ViewSet):
         new_script = json.loads(data['script'])
         script.script = new_script
         script.save()
-        return Response({"message": "Script uploaded successfully."})
+        store_script_nodes(script)
+        compile_script(script)
+        return Response({"message": "Script uploaded successfully.", "integrity": check_script_integrity(script)})
+
+    @swagger_auto_schema(
+        operation_description="Integrity report of the script's current content, stored by content hash",
+        tags=["Consent Scripts"]
+    )
+    @action(detail=True, methods=["get"], url_path="integrity", url_name="integrity")
+    def integrity(self, request, pk=None):
+        script = get_object_or_404(ConsentScript.objects.only("script_id", "revision", "content_hash"), pk=pk)
+        report = get_script_integrity_report(script.content_hash)
+        if report is None:
+            # Not checked yet, e.g. after add-message: load the script JSON and run the check once
+            script.refresh_from_db(fields=["script"])
+            report = check_script_integrity(script)
+        return Response({
+            "script_id": script.script_id,
+            "revision": script.revision,
+            "content_hash": script.content_hash,
+            "report": report,
+        })
 
     @action(detail=True, methods=["post"], url_path="add-message", url_name="add-message")
     def add_message(self, request, pk=None):
         script = get_object_or_404(ConsentScript, pk=pk)
         versioned_script = script.script
+        integrity = get_integrity_index(script)
 
         new_id = shortuuid.uuid()[:7]
         while new_id in versioned_script:
@@ -197,29 +285,109 @@ class ConsentScriptViewSet(viewsets.ViewSet):
             if parent_id in versioned_script:
                 versioned_script[parent_id]['child_ids'].append(new_id)
 
+        # Only the new node's links are checked; unreachable or dead-end nodes are reported, not refused
+        report = integrity.add_node(versioned_script, new_id)
+        if report.missing_links:
+            return Response(
+                {"detail": "Unknown parent IDs.", "integrity": report.to_dict()},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
         script.script = versioned_script
         script.save()
+        update_script_nodes(script.pk, versioned_script, [new_id, *parent_ids])
+        store_integrity_index(script, integrity)
+        compile_script(script)
 
         return Response({
             "id": new_id,
             "type": new_message["type"],
             "messages": new_message["messages"],
-            "parent_ids": new_message["parent_ids"]
+            "parent_ids": new_message["parent_ids"],
+            "integrity": report.to_dict()
         })
 
+    @swagger_auto_schema(
+        method="get",
+        operation_description="Page through the script's nodes in order, optionally filtered",
+        query_serializer=ScriptNodeListInputSerializer,
+        tags=["Consent Scripts"]
+    )
+    @swagger_auto_schema(
+        method="post",
+        operation_description="Add one node to the script, linked to its parents and children",
+        request_body=ScriptNodeCreateInputSerializer,
+        tags=["Consent Scripts"]
+    )
+    @action(detail=True, methods=["get", "post"], url_path="nodes", url_name="nodes")
+    def nodes(self, request, pk=None):
+        if request.method == "GET":
+            get_object_or_404(ConsentScript.objects.only("script_id"), pk=pk)
+            serializer = ScriptNodeListInputSerializer(data=request.query_params)
+            serializer.is_valid(raise_exception=True)
+            return Response(list_script_nodes(pk, **serializer.validated_data))
+
+        serializer = ScriptNodeCreateInputSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        result = create_script_node(pk, **serializer.validated_data)
+        return Response(result, status=status.HTTP_201_CREATED)
+
+    @swagger_auto_schema(
+        method="patch",
+        operation_description="Apply JSON Patch operations to one node",
+        request_body=ScriptNodePatchInputSerializer,
+        tags=["Consent Scripts"]
+    )
+    @swagger_auto_schema(
+        method="delete",
+        operation_description="Delete one node and unlink it from its parents and children",
+        query_serializer=ScriptNodeDeleteInputSerializer,
+        tags=["Consent Scripts"]
+    )
+    @action(detail=True, methods=["patch", "delete"], url_path=r"nodes/(?P<node_id>[^/]+)", url_name="node")
+    def node(self, request, pk=None, node_id=None):
+        if request.method == "DELETE":
+            serializer = ScriptNodeDeleteInputSerializer(data=request.query_params)
+            serializer.is_valid(raise_exception=True)
+            return Response(delete_script_node(pk, serializer.validated_data["revision"], node_id))
+
+        serializer = ScriptNodePatchInputSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response(update_script_node(pk, node_id=node_id, **serializer.validated_data))
+
+    @swagger_auto_schema(
+        method="post",
+        operation_description="Give one node new parents",
+        request_body=ScriptNodeMoveInputSerializer,
+        tags=["Consent Scripts"]
+    )
+    @action(detail=True, methods=["post"], url_path=r"nodes/(?P<node_id>[^/]+)/move", url_name="node-move")
+    def move_node(self, request, pk=None, node_id=None):
+        serializer = ScriptNodeMoveInputSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response(move_script_node(pk, node_id=node_id, **serializer.validated_data))
+
 
 class ConsentViewSet(viewsets.ViewSet):
     permission_classes = [permissions.AllowAny]
 
     @swagger_auto_schema(
-        operation_description="List all user consent records",
+        operation_description="List user consent records; with limit or cursor, one page at a time",
+        query_serializer=ListQueryInputSerializer,
         responses={200: ConsentOutputSerializer(many=True)},
         tags=["User Consent"]
     )
     def list(self, request):
-        queryset = Consent.objects.all()
-        serializer = ConsentOutputSerializer(queryset, many=True)
-        return Response(serializer.data)
+        params = ListQueryInputSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        queryset = Consent.objects.select_related("user", "dependent_user")
+        return Response(list_objects(
+            queryset,
+            ConsentOutputSerializer,
+            params.validated_data,
+            heavy_fields=("consent_statements",),
+            summary_counts={"consented": Q(consented_at__isnull=False)},
+        ))
 
     @swagger_auto_schema(
         operation_description="Load or initialize a consent session using invite UUID",
@@ -227,10 +395,15 @@ class ConsentViewSet(viewsets.ViewSet):
         tags=["User Consent"]
     )
     def retrieve(self, request, pk=None):
-        consent, created = get_or_initialize_user_consent(pk)
-        history, just_created = get_or_initialize_consent_history(pk)
+        with invite_context(pk) as invite:
+            refused = refuse_unavailable_invite(invite)
+            if refused:
+                return refused
+            with consent_session(pk, invite.expires_at):
+                consent, created = get_or_initialize_user_consent(pk)
+                history, just_created = get_or_initialize_consent_history(pk)
         response_data = ConsentOutputSerializer(consent).data
-        response_data["chat"] = history
+        response_data.update(chat_payload(history))
 
         return Response(response_data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
 
@@ -270,6 +443,38 @@ class ConsentViewSet(viewsets.ViewSet):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+class ExportViewSet(viewsets.ViewSet):
+    """Study data exports (consents, tests, transcripts), streamed as CSV or JSON Lines."""
+    permission_classes = [permissions.IsAdminUser]
+
+    @swagger_auto_schema(
+        operation_description="List the available exports",
+        tags=["Exports"]
+    )
+    def list(self, request):
+        return Response([{"kind": kind, "columns": list(export["columns"])} for kind, export in EXPORTS.items()])
+
+    @swagger_auto_schema(
+        operation_description="Stream one export (consents, tests or transcripts) as a CSV or JSONL file",
+        query_serializer=ExportQueryInputSerializer,
+        tags=["Exports"]
+    )
+    def retrieve(self, request, pk=None):
+        if pk not in EXPORTS:
+            return Response({"detail": f"Unknown export: {pk}"}, status=status.HTTP_404_NOT_FOUND)
+        params = ExportQueryInputSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        file_format = params.validated_data.pop("file_format")
+        content_type = EXPORT_FORMATS[file_format][0]
+        timestamp = timezone.now().strftime("%Y%m%d_%H%M%S")
+        response = StreamingHttpResponse(
+            export_chunks(pk, file_format, **params.validated_data), content_type=content_type
+        )
+        response["Content-Disposition"] = content_disposition_header(True, f"{pk}_{timestamp}.{file_format}")
+        response["Cache-Control"] = "no-store"
+        return response
+
+
 class ConsentUrlViewSet(viewsets.ViewSet):
     lookup_field = 'username'
     permission_classes = {permissions.IsAuthenticated}
@@ -307,6 +512,20 @@ class ConsentUrlViewSet(viewsets.ViewSet):
                 return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @swagger_auto_schema(
+        operation_description="Create consent URLs for a list of usernames or emails; unknown or repeated users are listed in errors",
+        request_body=ConsentUrlBulkInputSerializer,
+        tags=["Consent URLs"]
+    )
+    @action(detail=False, methods=["post"], url_path="bulk", url_name="bulk")
+    def bulk_create(self, request):
+        serializer = ConsentUrlBulkInputSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response(bulk_create_consent_urls(
+            serializer.validated_data["users"],
+            expires_at=serializer.validated_data.get("expires_at"),
+        ))
+
 
 class ConsentResponseViewSet(viewsets.ViewSet):
     permission_classes = [permissions.AllowAny]
@@ -318,41 +537,65 @@ class ConsentResponseViewSet(viewsets.ViewSet):
     )
     def retrieve(self, request, pk=None):
         serializer = ConsentResponseInputSerializer(
-            data={"invite_id": pk, "node_id": request.query_params.get("node_id")},
+            data={
+                "invite_id": pk,
+                "node_id": request.query_params.get("node_id"),
+                "since_turn": request.query_params.get("since_turn"),
+            },
             context={"request": request}
         )
         serializer.is_valid(raise_exception=True)
         data = serializer.validated_data
         invite_id = str(data["invite_id"])
         node_id = data["node_id"]
-        graph = get_script_from_invite_id(invite_id)
-        history = get_user_consent_history(invite_id)
-
-        try:
-            if node_id == "start":
-                return self._handle_start(invite_id, graph, history)
-
-            return self._handle_next(invite_id, node_id, graph, history)
+        since_turn = data.get("since_turn")
 
-        except Exception as e:
-            return Response({
-                "chat": [],
-                "status": "error",
-                "error": str(e)
-            }, status=status.HTTP_400_BAD_REQUEST)
+        with invite_context(invite_id) as invite:
+            refused = refuse_unavailable_invite(invite)
+            if refused:
+                return refused
+            graph = invite.graph
 
-    def _handle_start(self, invite_id, graph, history):
+            try:
+                with consent_session(invite_id, invite.expires_at):
+                    if node_id == "start":
+                        return self._handle_start(invite_id, graph, since_turn)
+
+                    return self._handle_next(invite_id, node_id, graph, since_turn)
+
+            except Exception as e:
+                return Response({
+                    "chat": [],
+                    "status": "error",
+                    "error": str(e)
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+    def _chat_since(self, invite_id, turn, turn_no, since_turn):
+        """
+        Return (chat, turn_index) for a response that just appended `turn`.
+
+        Without `since_turn` the full history is returned, as older clients
+        expect. A client that is up to date only gets the new turn, without
+        reading the history back.
+        """
+        if since_turn is not None and since_turn >= turn_no:
+            return [turn], turn_no
+        since_turn = since_turn or 0
+        return get_user_consent_history(invite_id, since_turn), since_turn
+
+    def _handle_start(self, invite_id, graph, since_turn=None):
         start_node_id = get_consent_start_id(graph)
         first_sequence = process_consent_sequence(start_node_id, invite_id)
-        history.append(format_turn(graph, "start", "", first_sequence))
-        set_user_consent_history(invite_id, history)
+        turn = format_turn(graph, "start", "", first_sequence)
+        turn_no = append_chat_history(invite_id, turn)
+        chat, turn_index = self._chat_since(invite_id, turn, turn_no, since_turn)
         return Response({
-            "chat": history,
+            **chat_payload(chat, turn_index),
             "next_node_id": start_node_id,
             "end_sequence": first_sequence.get("end_sequence", False),
         })
 
-    def _handle_next(self, invite_id, node_id, graph, history):
+    def _handle_next(self, invite_id, node_id, graph, since_turn=None):
         node = graph.get(node_id, {})
         metadata = graph[node_id].get("metadata", {})
         workflow = metadata.get("workflow", "")
@@ -374,11 +617,12 @@ class ConsentResponseViewSet(viewsets.ViewSet):
             next_node_id = graph[node_id].get("child_ids", [None])[0]
 
         next_sequence = process_consent_sequence(next_node_id, invite_id)
-        history.append(format_turn(graph, node_id, echo_user_response, next_sequence))
-        set_user_consent_history(invite_id, history)
+        turn = format_turn(graph, node_id, echo_user_response, next_sequence)
+        turn_no = append_chat_history(invite_id, turn)
+        chat, turn_index = self._chat_since(invite_id, turn, turn_no, since_turn)
 
         return Response({
-            "chat": history,
+            **chat_payload(chat, turn_index),
             "next_node_id": next_node_id,
             "end_sequence": next_sequence.get("end_sequence", False),
         })
@@ -394,15 +638,21 @@ class ConsentResponseViewSet(viewsets.ViewSet):
         serializer.is_valid(raise_exception=True)
         data = serializer.validated_data
 
-        try:
-            return self._handle_form_submission(data)
+        with invite_context(data["invite_id"]) as invite:
+            refused = refuse_unavailable_invite(invite)
+            if refused:
+                return refused
+
+            try:
+                with consent_session(data["invite_id"], invite.expires_at):
+                    return self._handle_form_submission(data)
 
-        except Exception as e:
-            return Response({
-                "chat": [],
-                "status": "error",
-                "error": str(e),
-            }, status=status.HTTP_400_BAD_REQUEST)
+            except Exception as e:
+                return Response({
+                    "chat": [],
+                    "status": "error",
+                    "error": str(e),
+                }, status=status.HTTP_400_BAD_REQUEST)
 
     def _handle_form_submission(self, data):
         invite_id = str(data["invite_id"])
@@ -414,9 +664,10 @@ class ConsentResponseViewSet(viewsets.ViewSet):
         if not handler:
             raise ValueError(f"Unknown form_type: {form_type}")
 
-        result = handler(graph, invite_id, responses)
+        since_turn = data.get("since_turn") or 0
+        result = handler(graph, invite_id, responses, since_turn=since_turn)
         return Response({
-            "chat": result,
+            **chat_payload(result, since_turn),
             "next_node_id": result[-1].get("node_id"),
             "end_sequence": result[-1].get("end_sequence", False),
         })
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# consentbot/management/commands/benchmark_script_graph.py
+
+"""
+Compare the raw dict and CompactGraph forms of a consent script.
+
+Reports the memory each form retains once built, and the time to compute the
+chat sequence from every node and to walk every node reachable from the
+start. Reads the script from the database (--script-id, or the first script)
+or from a JSON file (--file).
+"""
+
+import gc
+import json
+import time
+import tracemalloc
+from django.core.management.base import BaseCommand, CommandError
+from consentbot.models import ConsentScript
+from consentbot.selectors import get_consent_start_id, get_next_consent_sequence, get_workflow_node_ids
+from utils.compact_graph import CompactGraph
+
+
+def measure_retained(build):
+    """Return (object, bytes still allocated after `build()` returns)."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        obj = build()
+        gc.collect()
+        retained = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return obj, retained
+
+
+def best_of(repeat, func):
+    """Return the fastest of `repeat` runs of `func`, in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+class Command(BaseCommand):
+    help = "Benchmark memory and traversal speed of a consent script as a raw dict and as a CompactGraph."
+
+    def add_arguments(self, parser):
+        source = parser.add_mutually_exclusive_group()
+        source.add_argument("--script-id", help="ConsentScript to benchmark (defaults to the first one).")
+        source.add_argument("--file", metavar="PATH", help="Benchmark a script JSON file instead.")
+        parser.add_argument("--repeat", type=int, default=20, help="Timing runs; the best is reported.")
+
+    def handle(self, *args, **options):
+        if options["file"]:
+            with open(options["file"]) as f:
+                text = f.read()
+            label = options["file"]
+        else:
+            scripts = ConsentScript.objects.all()
+            if options["script_id"]:
+                scripts = scripts.filter(script_id=options["script_id"])
+            script = scripts.first()
+            if script is None:
+                raise CommandError("No consent script found.")
+            text = json.dumps(script.script)
+            label = f"{script.name} ({script.script_id})"
+
+        raw, raw_bytes = measure_retained(lambda: json.loads(text))
+        compact, compact_bytes = measure_retained(lambda: CompactGraph(json.loads(text)))
+        start_id = get_consent_start_id(raw)
+        node_ids = list(raw)
+
+        rows = []
+        for name, graph, retained in (("dict", raw, raw_bytes), ("compact", compact, compact_bytes)):
+            sequences = best_of(options["repeat"], lambda: [get_next_consent_sequence(graph, n) for n in node_ids])
+            walk = best_of(options["repeat"], lambda: get_workflow_node_ids(graph, start_id))
+            rows.append((name, retained, sequences, walk))
+
+        self.stdout.write(f"{label}: {len(node_ids)} nodes, {len(text)} bytes of JSON")
+        self.stdout.write(f"{'form':<8} {'memory':>12} {'sequences':>12} {'walk':>12}")
+        for name, retained, sequences, walk in rows:
+            self.stdout.write(
+                f"{name:<8} {retained / 1024:>9.1f} KB {sequences * 1000:>9.2f} ms {walk * 1000:>9.2f} ms"
+            )
+        self.stdout.write(f"compact / dict memory: {compact_bytes / raw_bytes:.2f}")
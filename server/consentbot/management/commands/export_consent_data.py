@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# consentbot/management/commands/export_consent_data.py
+
+"""
+Export consents, consent tests or chat transcripts as CSV or JSON Lines.
+
+Rows are read from the database in chunks and written as they come, so the
+export runs in constant memory however large the study is. This writes the
+same file as the /exports/<kind>/ endpoint.
+"""
+
+import sys
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from consentbot.selectors import EXPORTS
+from consentbot.services import EXPORT_FORMATS, export_chunks
+
+
+def _datetime(value):
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(value)
+    return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+
+class Command(BaseCommand):
+    help = "Stream consents, tests or transcripts to a CSV or JSONL file (stdout by default)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=list(EXPORTS))
+        parser.add_argument("--file-format", choices=list(EXPORT_FORMATS), default="csv")
+        parser.add_argument("--since", type=_datetime, help="Only rows created at or after this ISO time.")
+        parser.add_argument("--until", type=_datetime, help="Only rows created before this ISO time.")
+        parser.add_argument("--script-id", help="Only rows of this consent script version.")
+        parser.add_argument("--output", "-o", help="File to write; stdout when omitted.")
+
+    def handle(self, *args, **options):
+        chunks = export_chunks(
+            options["kind"],
+            options["file_format"],
+            since=options["since"],
+            until=options["until"],
+            script_id=options["script_id"],
+        )
+        if options["output"]:
+            with open(options["output"], "wb") as output:
+                for chunk in chunks:
+                    output.write(chunk)
+            self.stderr.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+        else:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.flush()
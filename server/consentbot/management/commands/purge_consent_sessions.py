@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# consentbot/management/commands/purge_consent_sessions.py
+
+"""
+Delete expired chat session state from ConsentCache.
+
+Rows are removed oldest-expiry first in small batches, each in its own short
+transaction, so the table is never locked for long. An interrupted run loses
+nothing: already purged batches are committed and the next run picks up the
+remaining expired rows. With --archive, each batch is appended to a JSON Lines
+file before it is deleted.
+
+Chat transcripts (ConsentTurn) are study records and are not touched.
+"""
+
+import json
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from consentbot.models import ConsentCache
+from utils.cache import decode_value
+
+
+class Command(BaseCommand):
+    help = "Delete (and optionally archive) expired consent chat session state in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Rows deleted per transaction.")
+        parser.add_argument("--archive", metavar="PATH", help="Append purged rows to this JSON Lines file.")
+        parser.add_argument(
+            "--before",
+            metavar="DATETIME",
+            help="Purge rows that expired before this ISO 8601 time instead of now.",
+        )
+        parser.add_argument("--max-batches", type=int, default=None, help="Stop after this many batches.")
+        parser.add_argument("--pause", type=float, default=0.0, help="Seconds to sleep between batches.")
+        parser.add_argument("--dry-run", action="store_true", help="Report what would be purged and exit.")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now()
+        if options["before"]:
+            cutoff = parse_datetime(options["before"])
+            if cutoff is None:
+                raise CommandError(f"Invalid --before datetime: {options['before']}")
+            if timezone.is_naive(cutoff):
+                cutoff = timezone.make_aware(cutoff)
+
+        batch_size = options["batch_size"]
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1")
+
+        expired = ConsentCache.objects.filter(expires_at__lt=cutoff)
+        if options["dry_run"]:
+            self.stdout.write(f"{expired.count()} expired session rows before {cutoff.isoformat()}")
+            return
+
+        archive = open(options["archive"], "a") if options["archive"] else None
+        purged = batches = 0
+        try:
+            while options["max_batches"] is None or batches < options["max_batches"]:
+                with transaction.atomic():
+                    rows = list(
+                        expired
+                        .order_by("expires_at", "key")
+                        .values("key", "value", "expires_at")[:batch_size]
+                    )
+                    if not rows:
+                        break
+                    if archive:
+                        for row in rows:
+                            archive.write(json.dumps({
+                                "key": row["key"],
+                                "value": decode_value(row["value"]),
+                                "expires_at": row["expires_at"].isoformat(),
+                            }) + "\n")
+                        archive.flush()
+                    deleted, _ = ConsentCache.objects.filter(
+                        pk__in=[row["key"] for row in rows],
+                        expires_at__lt=cutoff,
+                    ).delete()
+
+                purged += deleted
+                batches += 1
+                self.stdout.write(f"Batch {batches}: purged {deleted} rows (through {rows[-1]['key']})")
+                if options["pause"]:
+                    time.sleep(options["pause"])
+        finally:
+            if archive:
+                archive.close()
+
+        self.stdout.write(self.style.SUCCESS(f"Purged {purged} expired session rows in {batches} batches."))
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# consentbot/management/commands/sync_script_nodes.py
+
+"""
+Rewrite the normalized node and link rows of consent scripts from their JSON.
+
+Saves through the API and the admin keep the rows in step; this is for rows
+written another way (loaddata, raw SQL) or found out of step. With --check,
+each script's rows are exported back to JSON and compared with the stored
+script instead, and nothing is written.
+
+Node content rows are shared between scripts and are left behind when the
+nodes pointing to them change or are deleted; --prune deletes the ones no
+node points to. Run it when no scripts are being edited.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from consentbot.models import ConsentScript
+from utils.script_nodes import export_script, prune_node_contents, store_script_nodes
+
+
+class Command(BaseCommand):
+    help = "Rebuild (or with --check, verify) the node table rows of consent scripts."
+
+    def add_arguments(self, parser):
+        parser.add_argument("script_ids", nargs="*", help="Scripts to sync; all scripts when omitted.")
+        parser.add_argument("--check", action="store_true", help="Compare the rows with the script JSON only.")
+        parser.add_argument("--prune", action="store_true", help="Then delete node content no node points to.")
+
+    def handle(self, *args, **options):
+        scripts = ConsentScript.objects.order_by("created_at")
+        if options["script_ids"]:
+            scripts = scripts.filter(pk__in=options["script_ids"])
+
+        out_of_step = synced = 0
+        for script in scripts.iterator():
+            if options["check"]:
+                if export_script(script.pk) != script.script:
+                    out_of_step += 1
+                    self.stdout.write(self.style.WARNING(f"{script.pk} ({script.name}): rows differ from the script JSON"))
+                continue
+            store_script_nodes(script)
+            synced += 1
+            self.stdout.write(f"{script.pk} ({script.name}): {len(script.script or {})} nodes")
+
+        if options["check"]:
+            if out_of_step:
+                raise CommandError(f"{out_of_step} scripts out of step; run sync_script_nodes to rebuild them.")
+            self.stdout.write(self.style.SUCCESS("All node rows match their scripts."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Synced {synced} scripts."))
+        if options["prune"]:
+            self.stdout.write(f"Pruned {prune_node_contents()} unused node contents.")
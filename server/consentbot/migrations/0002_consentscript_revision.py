@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 03:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consentbot', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='consentscript',
+            name='revision',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
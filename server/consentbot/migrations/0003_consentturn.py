@@ -0,0 +1,27 @@
+# Generated by Django 5.1.7 on 2026-10-18 03:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consentbot', '0002_consentscript_revision'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConsentTurn',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('turn_no', models.PositiveIntegerField()),
+                ('payload', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('invite', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_turns', to='consentbot.consenturl', to_field='consent_url')),
+            ],
+            options={
+                'unique_together': {('invite', 'turn_no')},
+            },
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Moves chat histories stored as one ConsentCache blob per invite into
+# one ConsentTurn row per turn.
+
+import base64
+import json
+import uuid
+import zlib
+from django.db import migrations
+
+HISTORY_SUFFIX = ":user_consent_history"
+KEY_PREFIX = "invite_id:"
+# Turns may since have been written compressed (see utils.cache.encode_value)
+ZLIB_V1_HEADER = "~z1:"
+
+
+def decode_payload(payload):
+    if payload.startswith(ZLIB_V1_HEADER):
+        return zlib.decompress(base64.b64decode(payload[len(ZLIB_V1_HEADER):])).decode("utf-8")
+    return payload
+
+
+def forwards(apps, schema_editor):
+    ConsentCache = apps.get_model("consentbot", "ConsentCache")
+    ConsentTurn = apps.get_model("consentbot", "ConsentTurn")
+    ConsentUrl = apps.get_model("consentbot", "ConsentUrl")
+
+    rows = ConsentCache.objects.filter(key__startswith=KEY_PREFIX, key__endswith=HISTORY_SUFFIX)
+    migrated_keys = []
+    for row in rows.iterator():
+        invite_id = row.key[len(KEY_PREFIX):-len(HISTORY_SUFFIX)]
+        try:
+            invite_id = uuid.UUID(invite_id)
+            history = json.loads(row.value) if row.value else []
+        except ValueError:
+            continue
+        if not ConsentUrl.objects.filter(consent_url=invite_id).exists():
+            continue
+
+        ConsentTurn.objects.filter(invite_id=invite_id).delete()
+        ConsentTurn.objects.bulk_create([
+            ConsentTurn(invite_id=invite_id, turn_no=turn_no, payload=json.dumps(turn))
+            for turn_no, turn in enumerate(history)
+        ])
+        migrated_keys.append(row.key)
+
+    ConsentCache.objects.filter(key__in=migrated_keys).delete()
+
+
+def backwards(apps, schema_editor):
+    ConsentCache = apps.get_model("consentbot", "ConsentCache")
+    ConsentTurn = apps.get_model("consentbot", "ConsentTurn")
+
+    invite_ids = ConsentTurn.objects.values_list("invite_id", flat=True).distinct()
+    for invite_id in invite_ids:
+        payloads = (
+            ConsentTurn.objects
+            .filter(invite_id=invite_id)
+            .order_by("turn_no")
+            .values_list("payload", flat=True)
+        )
+        history = [json.loads(decode_payload(payload)) for payload in payloads]
+        ConsentCache.objects.update_or_create(
+            key=f"{KEY_PREFIX}{invite_id}{HISTORY_SUFFIX}",
+            defaults={"value": json.dumps(history)},
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consentbot', '0003_consentturn'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
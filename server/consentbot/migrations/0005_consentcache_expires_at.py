@@ -0,0 +1,48 @@
+# Generated by Django 5.1.7 on 2026-10-18 03:36
+
+import uuid
+from django.db import migrations, models
+from django.utils import timezone
+
+KEY_PREFIX = "invite_id:"
+
+
+def backfill_expires_at(apps, schema_editor):
+    """Copy each invite's ConsentUrl.expires_at onto its existing cache rows."""
+    ConsentCache = apps.get_model("consentbot", "ConsentCache")
+    ConsentUrl = apps.get_model("consentbot", "ConsentUrl")
+
+    keys_by_invite = {}
+    for key in ConsentCache.objects.filter(expires_at__isnull=True).values_list("key", flat=True).iterator():
+        invite_id = key[len(KEY_PREFIX):].split(":", 1)[0] if key.startswith(KEY_PREFIX) else ""
+        try:
+            invite_id = uuid.UUID(invite_id)
+        except ValueError:
+            invite_id = None
+        keys_by_invite.setdefault(invite_id, []).append(key)
+
+    expiry = dict(
+        ConsentUrl.objects
+        .filter(consent_url__in=[invite_id for invite_id in keys_by_invite if invite_id])
+        .values_list("consent_url", "expires_at")
+    )
+    now = timezone.now()
+    for invite_id, keys in keys_by_invite.items():
+        # Rows without a matching invite can never be read again; expire them now
+        ConsentCache.objects.filter(key__in=keys).update(expires_at=expiry.get(invite_id, now))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consentbot', '0004_move_chat_history_to_turns'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='consentcache',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(backfill_expires_at, migrations.RunPython.noop),
+    ]
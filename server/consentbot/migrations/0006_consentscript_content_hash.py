@@ -0,0 +1,39 @@
+# Generated by Django 5.1.7 on 2026-10-18 03:58
+
+import hashlib
+import json
+from django.db import migrations, models
+
+
+def backfill_content_hash(apps, schema_editor):
+    """Hash existing scripts the way ConsentScript.save() does, without bumping their revision."""
+    ConsentScript = apps.get_model("consentbot", "ConsentScript")
+    for script in ConsentScript.objects.iterator():
+        content = json.dumps(script.script, sort_keys=True, separators=(",", ":"))
+        ConsentScript.objects.filter(pk=script.pk).update(
+            content_hash=hashlib.sha256(content.encode("utf-8")).hexdigest()
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consentbot', '0005_consentcache_expires_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScriptIntegrityReport',
+            fields=[
+                ('content_hash', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('report', models.JSONField()),
+                ('checked_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='consentscript',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=64),
+        ),
+        migrations.RunPython(backfill_content_hash, migrations.RunPython.noop),
+    ]
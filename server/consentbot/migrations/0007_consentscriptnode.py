@@ -0,0 +1,94 @@
+# Generated by Django 5.1.7 on 2026-10-18 04:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+COLUMN_KEYS = ("type", "messages", "attachment", "render_type", "render_content", "metadata")
+LINK_KEYS = ("child_ids", "parent_ids")
+
+
+def backfill_script_nodes(apps, schema_editor):
+    """Write node and link rows for existing scripts, as utils.script_nodes.store_script_nodes does."""
+    ConsentScript = apps.get_model("consentbot", "ConsentScript")
+    ConsentScriptNode = apps.get_model("consentbot", "ConsentScriptNode")
+    ConsentScriptLink = apps.get_model("consentbot", "ConsentScriptLink")
+    for script in ConsentScript.objects.iterator():
+        graph = script.script if isinstance(script.script, dict) else {}
+        graph = {node_id: node for node_id, node in graph.items() if isinstance(node, dict)}
+        nodes, pairs = [], {}
+        for position, (node_id, node) in enumerate(graph.items()):
+            nodes.append(ConsentScriptNode(
+                script_id=script.pk,
+                node_id=node_id,
+                position=position,
+                extra={key: value for key, value in node.items() if key not in COLUMN_KEYS and key not in LINK_KEYS},
+                keys=list(node),
+                **{key: node.get(key) for key in COLUMN_KEYS},
+            ))
+            for child_id in node.get("child_ids") or ():
+                pairs[(node_id, child_id)] = None
+            for parent_id in node.get("parent_ids") or ():
+                pairs[(parent_id, node_id)] = None
+
+        links = []
+        for parent_id, child_id in pairs:
+            child_ids = graph.get(parent_id, {}).get("child_ids") or ()
+            parent_ids = graph.get(child_id, {}).get("parent_ids") or ()
+            child_positions = [i for i, node_id in enumerate(child_ids) if node_id == child_id]
+            parent_positions = [i for i, node_id in enumerate(parent_ids) if node_id == parent_id]
+            for i in range(max(len(child_positions), len(parent_positions))):
+                links.append(ConsentScriptLink(
+                    script_id=script.pk,
+                    parent_id=parent_id,
+                    child_id=child_id,
+                    child_position=child_positions[i] if i < len(child_positions) else None,
+                    parent_position=parent_positions[i] if i < len(parent_positions) else None,
+                ))
+        ConsentScriptNode.objects.bulk_create(nodes, batch_size=500)
+        ConsentScriptLink.objects.bulk_create(links, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consentbot', '0006_consentscript_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConsentScriptLink',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('parent_id', models.CharField(max_length=50)),
+                ('child_id', models.CharField(max_length=50)),
+                ('child_position', models.PositiveIntegerField(blank=True, null=True)),
+                ('parent_position', models.PositiveIntegerField(blank=True, null=True)),
+                ('script', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='links', to='consentbot.consentscript')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['script', 'parent_id'], name='consentbot__script__c27987_idx'), models.Index(fields=['script', 'child_id'], name='consentbot__script__fdc8bc_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ConsentScriptNode',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('node_id', models.CharField(max_length=50)),
+                ('position', models.PositiveIntegerField()),
+                ('type', models.CharField(blank=True, max_length=20, null=True)),
+                ('messages', models.JSONField(blank=True, null=True)),
+                ('attachment', models.JSONField(blank=True, null=True)),
+                ('render_type', models.CharField(blank=True, max_length=20, null=True)),
+                ('render_content', models.JSONField(blank=True, null=True)),
+                ('metadata', models.JSONField(blank=True, null=True)),
+                ('extra', models.JSONField(blank=True, default=dict)),
+                ('keys', models.JSONField(default=list)),
+                ('script', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='nodes', to='consentbot.consentscript')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['script', 'position'], name='consentbot__script__f1f382_idx')],
+                'unique_together': {('script', 'node_id')},
+            },
+        ),
+        migrations.RunPython(backfill_script_nodes, migrations.RunPython.noop),
+    ]
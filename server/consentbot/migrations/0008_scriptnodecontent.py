@@ -0,0 +1,59 @@
+# Generated by Django 5.1.7 on 2026-10-18 04:31
+
+import django.db.models.deletion
+import hashlib
+import json
+from django.db import migrations, models
+
+COLUMN_KEYS = ("type", "messages", "attachment", "render_type", "render_content", "metadata")
+LINK_KEYS = ("child_ids", "parent_ids")
+
+
+def move_node_content(apps, schema_editor):
+    """Move node columns into content rows keyed like utils.script_nodes.node_content_hash."""
+    ConsentScriptNode = apps.get_model("consentbot", "ConsentScriptNode")
+    ScriptNodeContent = apps.get_model("consentbot", "ScriptNodeContent")
+    encoder = json.JSONEncoder(sort_keys=True, separators=(",", ":"))
+    stored = set()
+    for row in ConsentScriptNode.objects.iterator():
+        values = {key: getattr(row, key) for key in COLUMN_KEYS}
+        values.update(row.extra)
+        # The node as it was exported, without its links
+        content = {key: values.get(key) for key in row.keys if key not in LINK_KEYS}
+        content_hash = hashlib.sha256(encoder.encode(content).encode("utf-8")).hexdigest()
+        if content_hash not in stored:
+            ScriptNodeContent.objects.get_or_create(
+                content_hash=content_hash,
+                defaults={key: getattr(row, key) for key in (*COLUMN_KEYS, "extra")},
+            )
+            stored.add(content_hash)
+        ConsentScriptNode.objects.filter(pk=row.pk).update(content_id=content_hash)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consentbot', '0007_consentscriptnode'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScriptNodeContent',
+            fields=[
+                ('content_hash', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('type', models.CharField(blank=True, max_length=20, null=True)),
+                ('messages', models.JSONField(blank=True, null=True)),
+                ('attachment', models.JSONField(blank=True, null=True)),
+                ('render_type', models.CharField(blank=True, max_length=20, null=True)),
+                ('render_content', models.JSONField(blank=True, null=True)),
+                ('metadata', models.JSONField(blank=True, null=True)),
+                ('extra', models.JSONField(blank=True, default=dict)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='consentscriptnode',
+            name='content',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='nodes', to='consentbot.scriptnodecontent'),
+        ),
+        migrations.RunPython(move_node_content, migrations.RunPython.noop),
+    ]
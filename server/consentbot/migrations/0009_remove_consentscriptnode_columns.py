@@ -0,0 +1,48 @@
+# Generated by Django 5.1.7 on 2026-10-18 04:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Separate from 0008 so the backfill's row updates are committed before the table is altered (PostgreSQL)
+
+    dependencies = [
+        ('consentbot', '0008_scriptnodecontent'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='consentscriptnode',
+            name='content',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='nodes', to='consentbot.scriptnodecontent'),
+        ),
+        migrations.RemoveField(
+            model_name='consentscriptnode',
+            name='attachment',
+        ),
+        migrations.RemoveField(
+            model_name='consentscriptnode',
+            name='extra',
+        ),
+        migrations.RemoveField(
+            model_name='consentscriptnode',
+            name='messages',
+        ),
+        migrations.RemoveField(
+            model_name='consentscriptnode',
+            name='metadata',
+        ),
+        migrations.RemoveField(
+            model_name='consentscriptnode',
+            name='render_content',
+        ),
+        migrations.RemoveField(
+            model_name='consentscriptnode',
+            name='render_type',
+        ),
+        migrations.RemoveField(
+            model_name='consentscriptnode',
+            name='type',
+        ),
+    ]
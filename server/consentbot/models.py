@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 # consentbot/models.py
 
+import hashlib
+import json
 import uuid
 from django.db import models
 from django.utils import timezone
@@ -9,6 +11,11 @@ from datetime import timedelta
 def default_expiry():
     return timezone.now() + timedelta(weeks=2)
 
+def script_content_hash(script):
+    """SHA-256 of a script graph serialized canonically (sorted keys, no whitespace)."""
+    content = json.dumps(script, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
 
 class ConsentAgeGroup(models.TextChoices):
     LESS_THAN_SIX = '<=6', '<=6'
@@ -40,6 +47,8 @@ class Consent(models.Model):
 class ConsentCache(models.Model):
     key = models.CharField(max_length=200, primary_key=True)
     value = models.TextField()
+    # Mirrors the invite's ConsentUrl.expires_at; expired rows read as missing
+    expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
 
 
 class ConsentScript(models.Model):
@@ -58,6 +67,10 @@ class ConsentScript(models.Model):
     )
     version_number = models.IntegerField()
     script = models.JSONField()
+    # Bumped on every save; compiled script caches are keyed on it
+    revision = models.PositiveIntegerField(default=0, editable=False)
+    # Hash of the script content; integrity reports are stored against it
+    content_hash = models.CharField(max_length=64, blank=True, default='', editable=False, db_index=True)
 
     class Meta:
         unique_together = ('name', 'version_number')
@@ -65,6 +78,17 @@ class ConsentScript(models.Model):
     def __str__(self):
         return f"{self.name} (v{self.version_number})"
 
+    def save(self, *args, **kwargs):
+        self.content_hash = script_content_hash(self.script)
+        update_fields = kwargs.get('update_fields')
+        if not self._state.adding:
+            self.revision = (self.revision or 0) + 1
+            if update_fields is not None and 'revision' not in update_fields:
+                update_fields = kwargs['update_fields'] = list(update_fields) + ['revision']
+        if update_fields is not None and 'content_hash' not in update_fields:
+            kwargs['update_fields'] = list(update_fields) + ['content_hash']
+        super().save(*args, **kwargs)
+
     @classmethod
     def get_consent_names(cls):
         return list(cls.objects.values_list('name', flat=True))
@@ -77,6 +101,73 @@ class ConsentScript(models.Model):
         return max_version if max_version is not None else 0
 
 
+class ScriptNodeContent(models.Model):
+    """
+    The content of a consent script node: everything but its links.
+
+    Rows are keyed by a hash of the content's canonical JSON (see
+    utils/script_nodes.py), so each distinct content is stored once and the
+    unchanged nodes of every script version and revision share a row.
+    """
+    content_hash = models.CharField(max_length=64, primary_key=True)
+    type = models.CharField(max_length=20, null=True, blank=True)
+    messages = models.JSONField(null=True, blank=True)
+    attachment = models.JSONField(null=True, blank=True)
+    render_type = models.CharField(max_length=20, null=True, blank=True)
+    render_content = models.JSONField(null=True, blank=True)
+    metadata = models.JSONField(null=True, blank=True)
+    # Keys without a column of their own
+    extra = models.JSONField(default=dict, blank=True)
+
+
+class ConsentScriptNode(models.Model):
+    """
+    One node of a consent script, normalized out of `ConsentScript.script`.
+
+    `ConsentScript.script` stays the materialized JSON export; the rows are
+    written alongside it (see utils/script_nodes.py). `keys` keeps the node's
+    keys in their original order, so a node exports exactly as stored.
+    """
+    script = models.ForeignKey(ConsentScript, on_delete=models.CASCADE, related_name='nodes')
+    node_id = models.CharField(max_length=50)
+    # Order of the node in the script JSON
+    position = models.PositiveIntegerField()
+    content = models.ForeignKey(ScriptNodeContent, on_delete=models.PROTECT, related_name='nodes')
+    keys = models.JSONField(default=list)
+
+    class Meta:
+        unique_together = ('script', 'node_id')
+        indexes = [models.Index(fields=['script', 'position'])]
+
+
+class ConsentScriptLink(models.Model):
+    """
+    A parent -> child link of a consent script.
+
+    The positions are the link's index in the parent's `child_ids` and in the
+    child's `parent_ids`; a null position means that side does not list the
+    link. The first node's parent is "start", which is not a node.
+    """
+    script = models.ForeignKey(ConsentScript, on_delete=models.CASCADE, related_name='links')
+    parent_id = models.CharField(max_length=50)
+    child_id = models.CharField(max_length=50)
+    child_position = models.PositiveIntegerField(null=True, blank=True)
+    parent_position = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['script', 'parent_id']),
+            models.Index(fields=['script', 'child_id']),
+        ]
+
+
+class ScriptIntegrityReport(models.Model):
+    """The result of a full integrity check, shared by every script with the same content."""
+    content_hash = models.CharField(max_length=64, primary_key=True)
+    report = models.JSONField()
+    checked_at = models.DateTimeField(auto_now_add=True)
+
+
 class ConsentTest(models.Model):
     user_test_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey("authentication.User", on_delete=models.CASCADE, related_name='user_tests')
@@ -94,3 +185,14 @@ class ConsentUrl(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     expires_at = models.DateTimeField(default=default_expiry)
     user = models.ForeignKey("authentication.User", on_delete=models.CASCADE, related_name='consent_urls')
+
+
+class ConsentTurn(models.Model):
+    """One formatted chat turn, appended in order for an invite."""
+    invite = models.ForeignKey(ConsentUrl, to_field='consent_url', on_delete=models.CASCADE, related_name='chat_turns')
+    turn_no = models.PositiveIntegerField()
+    payload = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('invite', 'turn_no')
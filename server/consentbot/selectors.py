@@ -1,19 +1,127 @@
 #!/usr/bin/env python
 # consentbot/selectors.py
 
+import json
+from contextlib import contextmanager
+from contextvars import ContextVar
 from django.contrib.auth import get_user_model
-from django.shortcuts import get_object_or_404
+from django.db.models import Q
+from django.http import Http404
+from django.utils import timezone
 from consentbot.models import (
+    Consent,
     ConsentScript,
+    ConsentScriptLink,
+    ConsentScriptNode,
+    ConsentTest,
+    ConsentTurn,
     ConsentUrl,
+    ScriptIntegrityReport,
 )
 
 User = get_user_model()
 
 from utils.cache import (
+    decode_value,
     get_user_consent_history,
     set_user_consent_history
 )
+from utils.compact_graph import CompactGraph
+from utils.script_cache import CompiledScript, get_runtime_script
+from utils.script_nodes import LazyScriptGraph, link_lists, node_from_row
+
+# Invite contexts opened with `invite_context`, by invite ID
+_active_invites = ContextVar("invite_contexts", default={})
+
+
+class InviteContext:
+    """
+    Everything a chat request needs to know about one invite, resolved once.
+
+    The ConsentUrl is loaded together with its user and the user's consent
+    script row (without the script JSON; the graph comes from the script
+    cache). Services that change `user` or `consent_url` save the shared
+    instances, so later steps of the same request see the changes.
+    """
+
+    def __init__(self, consent_url):
+        self.consent_url = consent_url
+        self.invite_id = str(consent_url.consent_url)
+        self.user = consent_url.user
+        self._compiled_script = None
+
+    @property
+    def consent_script(self):
+        return self.user.consent_script
+
+    @property
+    def expires_at(self):
+        return self.consent_url.expires_at
+
+    @property
+    def is_expired(self):
+        """Whether the invite link has expired; its session state reads as missing then."""
+        return self.expires_at is not None and self.expires_at <= timezone.now()
+
+    @property
+    def compiled_script(self) -> CompiledScript:
+        if self._compiled_script is None:
+            script = self.consent_script
+            if script is None:
+                raise ValueError("User does not have a consent_script assigned.")
+            try:
+                self._compiled_script = get_runtime_script(script.pk, script.revision)
+            except ConsentScript.DoesNotExist:
+                raise ValueError(f"ConsentScript for invite ID {self.invite_id} not found.")
+        return self._compiled_script
+
+    @property
+    def graph(self) -> dict:
+        return self.compiled_script.graph
+
+
+def load_invite_context(invite_id: str):
+    """Build an InviteContext with one query, or return None if the invite does not exist."""
+    consent_url = (
+        ConsentUrl.objects
+        .select_related("user__consent_script")
+        .defer("user__consent_script__script")
+        .filter(consent_url=invite_id)
+        .first()
+    )
+    return InviteContext(consent_url) if consent_url else None
+
+
+@contextmanager
+def invite_context(invite_id: str):
+    """
+    Resolve an invite once for the duration of a request.
+
+    While the block is active, `get_invite_context` and the invite lookups in
+    this module reuse the same InviteContext. Yields None if the invite does
+    not exist. Nested calls for the same invite reuse the open context.
+    """
+    invite_id = str(invite_id)
+    contexts = _active_invites.get()
+    if invite_id in contexts:
+        yield contexts[invite_id]
+        return
+
+    context = load_invite_context(invite_id)
+    if context is None:
+        yield None
+        return
+
+    token = _active_invites.set({**contexts, invite_id: context})
+    try:
+        yield context
+    finally:
+        _active_invites.reset(token)
+
+
+def get_invite_context(invite_id: str):
+    """Return the open InviteContext for an invite, loading one if none is open. None if not found."""
+    return _active_invites.get().get(str(invite_id)) or load_invite_context(invite_id)
 
 def get_bot_messages(node):
     return node.get("messages", []) if node.get("type") == "bot" else []
@@ -35,6 +143,11 @@ def get_form_content(node):
 
 
 def get_consent_start_id(graph):
+    if isinstance(graph, LazyScriptGraph):
+        # Looked up in the link table instead of loading every node
+        start_id = graph.start_node_id
+        if start_id is not None:
+            return start_id
     for node_id, node in graph.items():
         if node.get("parent_ids") and node["parent_ids"][0] == "start":
             return node_id
@@ -115,25 +228,69 @@ def get_next_consent_sequence(conversation_graph, node_id):
     }, node_ids
 
 
+def get_workflow_node_ids(conversation_graph: dict, start_id: str, metadata_field: str = None) -> list:
+    """
+    Collects the nodes reachable from start_id that belong to a workflow.
+
+    The walk is iterative, so deep scripts cannot hit the recursion limit.
+
+    Args:
+        conversation_graph (dict): The full conversation graph.
+        start_id (str): The node to begin traversal from.
+        metadata_field (str, optional): Only nodes whose metadata workflow
+            matches are collected; the walk continues through other nodes.
+            When omitted every reachable node is collected.
+
+    Returns:
+        list: Matching node_ids in the order they were reached.
+    """
+    if isinstance(conversation_graph, CompactGraph):
+        return [
+            node_id for node_id, node in conversation_graph.walk(start_id)
+            if not metadata_field or (node is not None and node.get("metadata", {}).get("workflow") == metadata_field)
+        ]
+
+    node_ids = []
+    visited = {start_id}
+    stack = [start_id]
+    while stack:
+        node_id = stack.pop()
+        node = conversation_graph.get(node_id, {})
+        if not metadata_field or node.get("metadata", {}).get("workflow") == metadata_field:
+            node_ids.append(node_id)
+        for child_id in reversed(node.get("child_ids", [])):
+            if child_id not in visited:
+                visited.add(child_id)
+                stack.append(child_id)
+    return node_ids
+
+
 def get_user_from_invite_id(invite_id: str):
     """
     Retrieve the User instance associated with a given invite ID.
     """
-    consent_url = get_object_or_404(ConsentUrl, consent_url=invite_id)
-    return consent_url.user
+    context = get_invite_context(invite_id)
+    if context is None:
+        raise Http404("No ConsentUrl matches the given query.")
+    return context.user
 
 
-def get_script_from_invite_id(invite_id: str)-> str:
-    """Retrieve the consent script JSON from a ConsentUrl UUID."""
-    try:
-        script_id = ConsentUrl.objects.get(consent_url=invite_id).user.consent_script_id
-        if not script_id:
-            raise ValueError("User does not have a consent_script assigned.")
-        return ConsentScript.objects.get(script_id=script_id).script
-    except ConsentUrl.DoesNotExist:
+def get_compiled_script_from_invite_id(invite_id: str) -> CompiledScript:
+    """
+    Retrieve the compiled consent script for a ConsentUrl UUID.
+
+    The script JSON is not read from the database; the graph itself comes
+    from this worker's script cache when it is warm.
+    """
+    context = get_invite_context(invite_id)
+    if context is None:
         raise ValueError(f"Invite ID {invite_id} not found.")
-    except ConsentScript.DoesNotExist:
-        raise ValueError(f"ConsentScript for invite ID {invite_id} not found.")
+    return context.compiled_script
+
+
+def get_script_from_invite_id(invite_id: str)-> dict:
+    """Retrieve the consent script JSON from a ConsentUrl UUID."""
+    return get_compiled_script_from_invite_id(invite_id).graph
 
 
 def format_turn(conversation_graph: dict, node_id: str, echo_user_response="", next_sequence: dict = None):
@@ -170,15 +327,205 @@ def format_turn(conversation_graph: dict, node_id: str, echo_user_response="", n
     }
 
 
-def build_chat_from_history(invite_id:str)-> dict:
+def build_chat_from_history(invite_id:str, since_turn:int=0)-> dict:
     """
     Builds a list of completed chat turns for frontend consumption.
 
     Args:
         invite_id (str): The invite UUID identifying the session.
+        since_turn (int, optional): Number of turns the client already has.
+            Only turns from this index on are returned. Defaults to 0.
 
     Returns:
         list[dict]: A list of chat turn dictionaries (each with bot/user messages).
     """
-    history = get_user_consent_history(invite_id)
+    history = get_user_consent_history(invite_id, since_turn)
     return [entry for entry in history if "bot_messages" in entry]
+
+
+def chat_payload(chat:list, turn_index:int=0)-> dict:
+    """
+    Wraps chat turns with the cursor fields clients use to request deltas.
+
+    Args:
+        chat (list[dict]): Consecutive chat turns, ending with the latest one.
+        turn_index (int, optional): Turn number of the first turn in `chat`. Defaults to 0.
+
+    Returns:
+        dict: `chat`, `turn_index`, and `history_version`, the number of turns
+        in the full history. Clients send `history_version` back as `since_turn`.
+    """
+    return {
+        "chat": chat,
+        "turn_index": turn_index,
+        "history_version": turn_index + len(chat),
+    }
+
+
+def get_script_integrity_report(content_hash: str):
+    """
+    Return the stored integrity report for a script content hash, or None if
+    that content has not been checked.
+    """
+    if not content_hash:
+        return None
+    return (
+        ScriptIntegrityReport.objects
+        .filter(content_hash=content_hash)
+        .values_list("report", flat=True)
+        .first()
+    )
+
+
+def list_script_nodes(script_id, after=None, limit=50, type=None, render_type=None, workflow=None, q=None) -> dict:
+    """
+    Return one page of a script's nodes, in script order, from the node table.
+
+    Pages are keyed by node position: pass the previous page's `next_after`
+    as `after` to get the next one. `q` matches message text, case-insensitively.
+
+    Returns:
+        dict: "results", a list of nodes with their `node_id` and `position`,
+            and "next_after", or None on the last page.
+    """
+    nodes = ConsentScriptNode.objects.filter(script_id=script_id).select_related("content")
+    if after is not None:
+        nodes = nodes.filter(position__gt=after)
+    if type:
+        nodes = nodes.filter(content__type=type)
+    if render_type:
+        nodes = nodes.filter(content__render_type=render_type)
+    if workflow:
+        nodes = nodes.filter(content__metadata__workflow=workflow)
+    if q:
+        nodes = nodes.filter(content__messages__icontains=q)
+    rows = list(nodes.order_by("position")[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    node_ids = [row.node_id for row in rows]
+    children, parents = link_lists(
+        ConsentScriptLink.objects
+        .filter(script_id=script_id)
+        .filter(Q(parent_id__in=node_ids) | Q(child_id__in=node_ids))
+        .values_list("parent_id", "child_id", "child_position", "parent_position")
+    )
+    return {
+        "results": [
+            {
+                "node_id": row.node_id,
+                "position": row.position,
+                **node_from_row(row, children.get(row.node_id, []), parents.get(row.node_id, [])),
+            }
+            for row in rows
+        ],
+        "next_after": rows[-1].position if has_more else None,
+    }
+
+
+# Rows fetched per round trip while an export streams
+EXPORT_CHUNK_SIZE = 2000
+
+# Each export: model, output column -> lookup, and the lookups of its filters
+_USER_COLUMNS = {
+    "user_id": "user__user_id",
+    "username": "user__username",
+    "email": "user__email",
+    "first_name": "user__first_name",
+    "last_name": "user__last_name",
+}
+EXPORTS = {
+    "consents": {
+        "model": Consent,
+        "columns": {
+            "user_consent_id": "user_consent_id",
+            **_USER_COLUMNS,
+            "dependent_user_id": "dependent_user__user_id",
+            "dependent_email": "dependent_user__email",
+            "consent_script_id": "consent_script_id",
+            "consent_script_name": "consent_script__name",
+            "consent_script_version": "consent_script__version_number",
+            "consent_age_group": "consent_age_group",
+            "store_sample_this_study": "store_sample_this_study",
+            "store_sample_other_studies": "store_sample_other_studies",
+            "store_phi_this_study": "store_phi_this_study",
+            "store_phi_other_studies": "store_phi_other_studies",
+            "return_primary_results": "return_primary_results",
+            "return_actionable_secondary_results": "return_actionable_secondary_results",
+            "return_secondary_results": "return_secondary_results",
+            "consent_statements": "consent_statements",
+            "user_full_name_consent": "user_full_name_consent",
+            "child_full_name_consent": "child_full_name_consent",
+            "consented_at": "consented_at",
+            "created_at": "created_at",
+        },
+        "script_field": "consent_script_id",
+    },
+    "tests": {
+        "model": ConsentTest,
+        "columns": {
+            "user_test_id": "user_test_id",
+            **_USER_COLUMNS,
+            "consent_script_id": "consent_script_version_id",
+            "consent_script_name": "consent_script_version__name",
+            "consent_script_version": "consent_script_version__version_number",
+            "test_try_num": "test_try_num",
+            "test_question": "test_question",
+            "user_answer": "user_answer",
+            "answer_correct": "answer_correct",
+            "created_at": "created_at",
+        },
+        "script_field": "consent_script_version_id",
+    },
+    "transcripts": {
+        "model": ConsentTurn,
+        "columns": {
+            "invite_id": "invite_id",
+            "turn_no": "turn_no",
+            **{name: f"invite__{lookup}" for name, lookup in _USER_COLUMNS.items()},
+            "consent_script_id": "invite__user__consent_script_id",
+            "created_at": "created_at",
+            "turn": "payload",
+        },
+        "script_field": "invite__user__consent_script_id",
+    },
+}
+
+
+def get_export_rows(kind: str, since=None, until=None, script_id=None):
+    """
+    Stream the rows of a data export, with the user's fields joined in.
+
+    Rows come from a server-side cursor (where the database has them) in
+    chunks of EXPORT_CHUNK_SIZE, ordered by creation time, so memory stays
+    flat however many rows there are. Transcript turns are decoded to their
+    JSON.
+
+    Args:
+        kind (str): A key of EXPORTS.
+        since (datetime): Only rows created at or after this time.
+        until (datetime): Only rows created before this time.
+        script_id (UUID): Only rows of this script version; for transcripts,
+            the script the participant is assigned.
+
+    Returns:
+        tuple: (column names, iterator of row tuples)
+    """
+    export = EXPORTS[kind]
+    rows = export["model"].objects.all()
+    if since:
+        rows = rows.filter(created_at__gte=since)
+    if until:
+        rows = rows.filter(created_at__lt=until)
+    if script_id:
+        rows = rows.filter(**{export["script_field"]: script_id})
+    columns = list(export["columns"])
+    rows = (
+        rows
+        .order_by("created_at", "pk")
+        .values_list(*export["columns"].values())
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+    if kind == "transcripts":
+        rows = (row[:-1] + (json.loads(decode_value(row[-1])),) for row in rows)
+    return columns, rows
@@ -2,12 +2,14 @@
 # consentbot/serializers.py
 
 import datetime
-from rest_framework import serializers
+import shortuuid
+from rest_framework import serializers, status
+from rest_framework.exceptions import APIException
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.core.cache import cache
-from django.db.models import Count
-from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.db.models import Count, Q
+from django.http import Http404
 from django.utils import timezone
 from authentication.services import FeedbackInputSerializer
 from consentbot.models import (
@@ -16,26 +18,41 @@ from consentbot.models import (
     ConsentScript,
     ConsentTest,
     ConsentUrl,
+    ScriptIntegrityReport,
+    script_content_hash,
 )
 from consentbot.selectors import (
+    EXPORTS,
     build_chat_from_history,
     format_turn,
+    get_compiled_script_from_invite_id,
+    get_invite_context,
     get_script_from_invite_id,
     get_next_consent_sequence,
     get_consent_start_id,
+    get_export_rows,
+    get_script_integrity_report,
+    get_user_from_invite_id,
+    get_workflow_node_ids,
 )
 
 from utils.cache import (
+    append_user_consent_turn,
+    end_consent_session,
+    get_last_user_consent_turn,
+    get_many,
     get_user_consent_history,
-    set_user_consent_history,
-    get_user_workflow,
-    set_user_workflow,
-    set_consenting_myself,
-    set_consent_node,
-    get_consenting_children,
-    set_consenting_children,
-    get_consent_node
+    get_workflow_queue,
+    set_many,
+    set_workflow_queue,
 )
+from utils.listing import SelectableFieldsMixin
+from utils.graph_integrity import IntegrityIndex, IntegrityReport, check_graph_integrity
+from utils.script_cache import cache_edited_script, get_compiled_script
+from utils.script_edits import LINK_FIELDS, EditedGraph, apply_node_patch, write_script_nodes
+from utils.script_integrity import get_integrity_index, store_integrity_index
+from utils.script_nodes import update_script_nodes
+from utils.streaming import csv_chunks, jsonl_chunks
 
 User = get_user_model()  
 # flags
@@ -91,7 +108,7 @@ class ConsentInputSerializer(serializers.ModelSerializer):
         )
 
 
-class ConsentOutputSerializer(serializers.ModelSerializer):
+class ConsentOutputSerializer(SelectableFieldsMixin, serializers.ModelSerializer):
     user_id = serializers.UUIDField(source='user.user_id', read_only=True)
     email = serializers.EmailField(source='user.email', read_only=True)
     dependent_user_id = serializers.UUIDField(source='dependent_user.user_id', read_only=True)
@@ -136,7 +153,7 @@ class ConsentScriptInputSerializer(serializers.ModelSerializer):
         }
 
 
-class ConsentScriptOutputSerializer(serializers.ModelSerializer):
+class ConsentScriptOutputSerializer(SelectableFieldsMixin, serializers.ModelSerializer):
     derived_from = serializers.StringRelatedField()
     versions = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
 
@@ -154,6 +171,88 @@ class ConsentScriptOutputSerializer(serializers.ModelSerializer):
         ]
 
 
+class ScriptNodeListInputSerializer(serializers.Serializer):
+    after = serializers.IntegerField(
+        required=False,
+        min_value=0,
+        help_text="Position of the last node of the previous page (its next_after)."
+    )
+    limit = serializers.IntegerField(required=False, min_value=1, max_value=500, default=50)
+    type = serializers.CharField(required=False)
+    render_type = serializers.CharField(required=False)
+    workflow = serializers.CharField(required=False, help_text="Only nodes with this metadata workflow.")
+    q = serializers.CharField(required=False, help_text="Only nodes whose messages contain this text.")
+
+
+class ScriptNodeCreateInputSerializer(serializers.Serializer):
+    revision = serializers.IntegerField(
+        min_value=0,
+        help_text="Script revision the edit is based on; a stale revision is rejected with 409."
+    )
+    node_id = serializers.CharField(
+        required=False,
+        max_length=50,
+        help_text="ID for the new node. Generated when omitted."
+    )
+    node = serializers.DictField(
+        help_text="The node: type, messages, parent_ids, and optionally child_ids, render fields and metadata."
+    )
+
+
+class ScriptNodePatchInputSerializer(serializers.Serializer):
+    revision = serializers.IntegerField(min_value=0)
+    operations = serializers.ListField(
+        child=serializers.DictField(),
+        allow_empty=False,
+        help_text='JSON Patch operations ("add", "replace", "remove", "test") with paths relative to the node.'
+    )
+
+
+class ScriptNodeMoveInputSerializer(serializers.Serializer):
+    revision = serializers.IntegerField(min_value=0)
+    parent_ids = serializers.ListField(
+        child=serializers.CharField(),
+        allow_empty=False,
+        help_text='The node\'s new parents ("start" for the first node).'
+    )
+
+
+class ScriptNodeDeleteInputSerializer(serializers.Serializer):
+    revision = serializers.IntegerField(min_value=0)
+
+
+class ExportQueryInputSerializer(serializers.Serializer):
+    # Not `format`, which DRF reads to pick a renderer
+    file_format = serializers.ChoiceField(choices=["csv", "jsonl"], default="csv")
+    since = serializers.DateTimeField(required=False, help_text="Only rows created at or after this time.")
+    until = serializers.DateTimeField(required=False, help_text="Only rows created before this time.")
+    script_id = serializers.UUIDField(required=False, help_text="Only rows of this consent script version.")
+
+
+class ScriptRevisionConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "The script has changed since it was loaded. Reload it and retry the edit."
+    default_code = "revision_conflict"
+
+
+# Export file format -> (content type, chunk writer)
+EXPORT_FORMATS = {
+    "csv": ("text/csv", csv_chunks),
+    "jsonl": ("application/x-ndjson", jsonl_chunks),
+}
+
+
+def export_chunks(kind, file_format="csv", since=None, until=None, script_id=None):
+    """
+    Stream a data export (a key of selectors.EXPORTS) as encoded chunks of
+    CSV or JSON Lines, fetching rows as the chunks are consumed.
+    """
+    if kind not in EXPORTS:
+        raise ValueError(f"Unknown export: {kind}")
+    columns, rows = get_export_rows(kind, since=since, until=until, script_id=script_id)
+    return EXPORT_FORMATS[file_format][1](columns, rows)
+
+
 class ConsentResponseInputSerializer(serializers.Serializer):
     invite_id = serializers.UUIDField(
         help_text="UUID of the invite link provided to the user."
@@ -173,6 +272,15 @@ class ConsentResponseInputSerializer(serializers.Serializer):
         required=False,
         help_text="List of form response objects. Supports string, boolean, or null values."
     )
+    since_turn = serializers.IntegerField(
+        required=False,
+        allow_null=True,
+        min_value=0,
+        help_text=(
+            "Number of chat turns the client already has (the last `history_version`). "
+            "When given, `chat` only contains turns from this index on; otherwise it is the full history."
+        )
+    )
 
 
     def validate(self, data):
@@ -225,15 +333,297 @@ class ConsentUrlOutputSerializer(serializers.ModelSerializer):
         return f"{base_url}/consent/{obj.consent_url}/"
 
 
+# Users accepted by one bulk invite request
+MAX_BULK_INVITES = 5000
+
+
+class ConsentUrlBulkInputSerializer(serializers.Serializer):
+    users = serializers.ListField(
+        child=serializers.CharField(),
+        min_length=1,
+        max_length=MAX_BULK_INVITES,
+        help_text="Usernames or emails of the users to invite."
+    )
+    expires_at = serializers.DateTimeField(required=False, help_text="Expiry of every invite (default two weeks).")
+
+
+def bulk_create_consent_urls(identifiers: list, expires_at=None) -> dict:
+    """
+    Create one consent URL for each user in a list of usernames or emails.
+
+    Users are resolved in one query and the URLs inserted with bulk_create.
+    Entries that match no user, match two different users (one by username,
+    another by email), or repeat a user already in the list are reported in
+    `errors` with their index and are not invited.
+
+    Returns:
+        dict: "invites", ConsentUrlOutputSerializer data in list order, and
+            "errors", a list of {"index", "user", "detail"}.
+    """
+    users = User.objects.filter(Q(username__in=identifiers) | Q(email__in=identifiers))
+    by_username, by_email = {}, {}
+    for user in users:
+        by_username[user.username] = user
+        by_email[user.email] = user
+
+    invites, errors, invited = [], [], set()
+    for index, identifier in enumerate(identifiers):
+        matches = {user.pk: user for user in (by_username.get(identifier), by_email.get(identifier)) if user}
+        if not matches:
+            detail = "No user with this username or email."
+        elif len(matches) > 1:
+            detail = "Matches one user's username and another user's email."
+        elif next(iter(matches)) in invited:
+            detail = "User is already listed in this request."
+        else:
+            user = next(iter(matches.values()))
+            invited.add(user.pk)
+            invite = ConsentUrl(user=user)
+            if expires_at:
+                invite.expires_at = expires_at
+            invites.append(invite)
+            continue
+        errors.append({"index": index, "user": identifier, "detail": detail})
+
+    with transaction.atomic():
+        ConsentUrl.objects.bulk_create(invites, batch_size=500)
+    return {
+        "invites": ConsentUrlOutputSerializer(invites, many=True).data,
+        "errors": errors,
+    }
+
+
+def check_script_integrity(script: ConsentScript) -> dict:
+    """
+    Return the integrity report for a script's current content.
+
+    Reports are stored by content hash, so the full check only runs for
+    content that has not been checked before.
+
+    Returns:
+        dict: `IntegrityReport.to_dict()` of the script graph.
+    """
+    if not script.content_hash:
+        # Rows written without save(), e.g. by loaddata
+        script.content_hash = script_content_hash(script.script)
+        ConsentScript.objects.filter(pk=script.pk).update(content_hash=script.content_hash)
+
+    report = get_script_integrity_report(script.content_hash)
+    if report is not None:
+        return report
+    report = check_graph_integrity(script.script).to_dict()
+    ScriptIntegrityReport.objects.get_or_create(content_hash=script.content_hash, defaults={"report": report})
+    return report
+
+
+def _load_script_for_edit(script_id, revision):
+    """Return (script row without its JSON, compiled script) if the script is at `revision`."""
+    script = ConsentScript.objects.only("script_id", "revision").filter(pk=script_id).first()
+    if script is None:
+        raise Http404("Consent script not found.")
+    if script.revision != revision:
+        raise ScriptRevisionConflict()
+    compiled = get_compiled_script(script.pk, revision)
+    if compiled.revision != revision:
+        raise ScriptRevisionConflict()
+    return script, compiled
+
+
+def _linked_node(changes, graph, node_id):
+    """The node as changed so far in this edit, as a dict that can be modified."""
+    if node_id not in changes:
+        changes[node_id] = graph[node_id].to_dict()
+    return changes[node_id]
+
+
+def _commit_script_edit(script, compiled, changes, index):
+    """
+    Write the changed nodes, JSON and rows, and store the index and the
+    compiled script for the new revision.
+    """
+    graph = compiled.graph
+    try:
+        with transaction.atomic():
+            revision = write_script_nodes(script.pk, script.revision, changes)
+            if revision is None:
+                raise ScriptRevisionConflict()
+            update_script_nodes(script.pk, EditedGraph(graph, changes), changes)
+    except ValueError as e:
+        raise serializers.ValidationError({"node_id": [str(e)]})
+    script.revision = revision
+    store_integrity_index(script, index)
+    cache_edited_script(compiled, revision, changes)
+    return revision
+
+
+def create_script_node(script_id, revision, node, node_id=None) -> dict:
+    """
+    Add a node to a script and link it to its parents and children.
+
+    Raises:
+        Http404: If the script does not exist.
+        ScriptRevisionConflict: If the script is no longer at `revision`.
+        serializers.ValidationError: If the node ID is taken or invalid, or
+            a parent or child does not exist.
+
+    Returns:
+        dict: The new revision, node ID, node and the issues it introduces.
+    """
+    script, compiled = _load_script_for_edit(script_id, revision)
+    graph = compiled.graph
+    if node_id is None:
+        node_id = shortuuid.uuid()[:7]
+        while node_id in graph:
+            node_id = shortuuid.uuid()[:7]
+    elif node_id in graph or node_id == "start":
+        raise serializers.ValidationError({"node_id": f"'{node_id}' is taken or not a valid node ID."})
+
+    # Defaults as in add_message
+    node = {
+        "type": None,
+        "messages": [],
+        "attachment": None,
+        "render_type": "button",
+        "metadata": {"workflow": "", "end_sequence": False},
+        **{key: value for key, value in node.items() if key not in LINK_FIELDS},
+        "parent_ids": list(dict.fromkeys(node.get("parent_ids") or [])),
+        "child_ids": list(dict.fromkeys(node.get("child_ids") or [])),
+    }
+    changes = {node_id: node}
+    for parent_id in node["parent_ids"]:
+        if parent_id in graph:
+            _linked_node(changes, graph, parent_id)["child_ids"].append(node_id)
+    for child_id in node["child_ids"]:
+        if child_id in graph:
+            _linked_node(changes, graph, child_id)["parent_ids"].append(node_id)
+
+    index = get_integrity_index(script, graph)
+    report = index.add_node(EditedGraph(graph, changes), node_id)
+    if report.missing_links:
+        raise serializers.ValidationError({"detail": "Unknown node IDs.", "integrity": report.to_dict()})
+
+    revision = _commit_script_edit(script, compiled, changes, index)
+    return {"revision": revision, "node_id": node_id, "node": node, "integrity": report.to_dict()}
+
+
+def update_script_node(script_id, revision, node_id, operations) -> dict:
+    """
+    Apply JSON-Patch-style operations to one node of a script.
+
+    Raises:
+        Http404: If the script or node does not exist.
+        ScriptRevisionConflict: If the script is no longer at `revision`.
+        serializers.ValidationError: If an operation does not apply.
+
+    Returns:
+        dict: The new revision, the node and the issues it has.
+    """
+    script, compiled = _load_script_for_edit(script_id, revision)
+    graph = compiled.graph
+    if node_id not in graph:
+        raise Http404("Node not found.")
+    try:
+        node = apply_node_patch(graph[node_id].to_dict(), operations)
+    except ValueError as e:
+        raise serializers.ValidationError({"operations": str(e)})
+
+    # Links are unchanged, so the index carries over to the new revision
+    changes = {node_id: node}
+    index = get_integrity_index(script, graph)
+    report = IntegrityReport(1)
+    index.check_node(EditedGraph(graph, changes), node_id, report)
+
+    revision = _commit_script_edit(script, compiled, changes, index)
+    return {"revision": revision, "node_id": node_id, "node": node, "integrity": report.to_dict()}
+
+
+def move_script_node(script_id, revision, node_id, parent_ids) -> dict:
+    """
+    Give a node new parents, unlinking it from its old ones.
+
+    Raises:
+        Http404: If the script or node does not exist.
+        ScriptRevisionConflict: If the script is no longer at `revision`.
+        serializers.ValidationError: If a new parent does not exist.
+
+    Returns:
+        dict: The new revision, the node and the issues the move introduces.
+    """
+    script, compiled = _load_script_for_edit(script_id, revision)
+    graph = compiled.graph
+    if node_id not in graph:
+        raise Http404("Node not found.")
+    missing = [parent_id for parent_id in parent_ids if parent_id != "start" and parent_id not in graph]
+    if missing:
+        raise serializers.ValidationError({"parent_ids": f"Unknown node IDs: {', '.join(missing)}"})
+
+    changes = {}
+    node = _linked_node(changes, graph, node_id)
+    old_parent_ids = node["parent_ids"]
+    node["parent_ids"] = list(dict.fromkeys(parent_ids))
+    for parent_id in old_parent_ids:
+        if parent_id in graph and parent_id not in node["parent_ids"]:
+            parent = _linked_node(changes, graph, parent_id)
+            parent["child_ids"] = [child_id for child_id in parent["child_ids"] if child_id != node_id]
+    for parent_id in node["parent_ids"]:
+        if parent_id in graph and parent_id not in old_parent_ids:
+            _linked_node(changes, graph, parent_id)["child_ids"].append(node_id)
+
+    # Removing links is not incremental: rebuild the index and compare
+    before = get_integrity_index(script, graph)
+    edited = EditedGraph(graph, changes)
+    index = IntegrityIndex(edited)
+    report = index.report_changes(before, edited, list(changes))
+
+    revision = _commit_script_edit(script, compiled, changes, index)
+    return {"revision": revision, "node_id": node_id, "node": node, "integrity": report.to_dict()}
+
+
+def delete_script_node(script_id, revision, node_id) -> dict:
+    """
+    Remove a node from a script, unlinking it from its parents and children.
+
+    Raises:
+        Http404: If the script or node does not exist.
+        ScriptRevisionConflict: If the script is no longer at `revision`.
+
+    Returns:
+        dict: The new revision and the issues the deletion introduces.
+    """
+    script, compiled = _load_script_for_edit(script_id, revision)
+    graph = compiled.graph
+    if node_id not in graph:
+        raise Http404("Node not found.")
+
+    node = graph[node_id]
+    changes = {node_id: None}
+    for parent_id in node.get("parent_ids") or ():
+        if parent_id in graph and parent_id != node_id:
+            parent = _linked_node(changes, graph, parent_id)
+            parent["child_ids"] = [child_id for child_id in parent["child_ids"] if child_id != node_id]
+    for child_id in node.get("child_ids") or ():
+        if child_id in graph and child_id != node_id:
+            child = _linked_node(changes, graph, child_id)
+            child["parent_ids"] = [parent_id for parent_id in child["parent_ids"] if parent_id != node_id]
+
+    before = get_integrity_index(script, graph)
+    edited = EditedGraph(graph, changes)
+    index = IntegrityIndex(edited)
+    report = index.report_changes(before, edited, [changed for changed, value in changes.items() if value is not None])
+
+    revision = _commit_script_edit(script, compiled, changes, index)
+    return {"revision": revision, "node_id": node_id, "integrity": report.to_dict()}
+
+
 def clean_up_after_chat(invite_id):
     """Set the invite URL to expire 24 hours from now."""
-    try:
-        consent_url = ConsentUrl.objects.get(consent_url=str(invite_id))
-        consent_url.expires_at = timezone.now() + datetime.timedelta(hours=24)
-        consent_url.save()
-    except ConsentUrl.DoesNotExist:
-        # Log or raise if needed
-        pass
+    context = get_invite_context(invite_id)
+    if context is None:
+        return
+    consent_url = context.consent_url
+    consent_url.expires_at = timezone.now() + datetime.timedelta(hours=24)
+    consent_url.save()
+    end_consent_session(invite_id, consent_url.expires_at)
 
 
 def get_or_initialize_consent_history(invite_id):
@@ -250,10 +640,10 @@ def get_or_initialize_consent_history(invite_id):
 
     graph = get_script_from_invite_id(invite_id)
     start_node = get_consent_start_id(graph)
-    sequence = process_consent_sequence(start_node, invite_id, graph=graph)
+    sequence = process_consent_sequence(start_node, invite_id)
 
     history = [format_turn(graph, start_node, echo_user_response="", next_sequence=sequence)]
-    set_user_consent_history(invite_id, history)
+    append_user_consent_turn(invite_id, history[0])
     return history, True
 
 
@@ -265,7 +655,9 @@ def get_or_initialize_user_consent(invite_id:str) -> bool:
         tuple: (Consent instance, bool indicating if it was created)
     """
     # Get the ConsentUrl instance (or 404 if invalid/expired)
-    invite = get_object_or_404(ConsentUrl, consent_url=invite_id)
+    invite = get_invite_context(invite_id)
+    if invite is None:
+        raise Http404("No ConsentUrl matches the given query.")
 
     # Check for an existing Consent record
     existing = Consent.objects.filter(user=invite.user, dependent_user=None).order_by('-created_at').first()
@@ -287,50 +679,51 @@ def process_consent_sequence(node_id, invite_id, graph=None):
     """
     Given a node_id and invite_id, compute the next consent sequence.
     Uses workflow cache to determine progress and clean up as needed.
+
+    The sequence is looked up in the invite's compiled script; pass `graph`
+    to walk a different graph instead.
     """
     if graph is None:
-        graph = get_script_from_invite_id(invite_id)
+        # Precomputed when the script was compiled
+        sequence, visited_nodes = get_compiled_script_from_invite_id(invite_id).get_sequence(node_id)
+    else:
+        sequence, visited_nodes = get_next_consent_sequence(graph, node_id)
 
-    workflow = cache.get(f"user_workflow_{invite_id}", [])
+    workflow = get_workflow_queue(invite_id)
 
-    if workflow and workflow[0] and node_id in workflow[0]:
-        sequence, visited_nodes = get_next_consent_sequence(graph, node_id)
+    if workflow.front_contains(node_id):
         # Remove visited nodes from the current workflow path
-        workflow[0] = [n for n in workflow[0] if n not in visited_nodes]
-        if not workflow[0] or sequence.get("end_sequence"):
-            workflow.pop(0)
-        cache.set(f"user_workflow_{invite_id}", workflow)
-    else:
-        sequence, _ = get_next_consent_sequence(graph, node_id)
+        workflow.discard_from_front(visited_nodes)
+        if not workflow.front or sequence.get("end_sequence"):
+            workflow.pop_front()
+        set_workflow_queue(invite_id, workflow)
 
     return sequence
 
 
 def append_chat_history(invite_id:str, chat_turn:dict):
     """
-    Appends a chat turn to the user's consent chat history in cache.
+    Appends a chat turn to the user's consent chat history.
 
     Args:
         invite_id (str): The invite UUID identifying the session.
         chat_turn (dict): A formatted chat turn dictionary using `format_turn`.
+
+    Returns:
+        int: The turn number assigned to the appended turn.
     """
-    history = get_user_consent_history(invite_id)
-    history.append(chat_turn)
-    set_user_consent_history(invite_id, history)
+    return append_user_consent_turn(invite_id, chat_turn)
 
 
-def update_consent_and_advance(invite_id, node_id, graph, echo_user_response):
+def update_consent_and_advance(invite_id, node_id, graph, echo_user_response, since_turn=0):
     next_node_id = graph[node_id]["child_ids"][0]
     next_sequence = process_consent_sequence(next_node_id, invite_id)
-    history = get_user_consent_history(invite_id)
-
-    history.append(format_turn(graph, node_id, echo_user_response, next_sequence))
-    set_user_consent_history(invite_id, history)
+    append_chat_history(invite_id, format_turn(graph, node_id, echo_user_response, next_sequence))
     clean_up_after_chat(invite_id)
-    return build_chat_from_history(invite_id)
+    return build_chat_from_history(invite_id, since_turn)
 
 
-def handle_sample_storage(graph, invite_id, responses):
+def handle_sample_storage(graph, invite_id, responses, since_turn=0):
     """
     Processes the 'sample storage' form by updating the user's consent record,
     saving chat state, and progressing the conversation.
@@ -339,20 +732,21 @@ def handle_sample_storage(graph, invite_id, responses):
         conversation_graph (dict): The full consent script graph.
         invite_id (str): The invite UUID identifying the session.
         responses (list): List of form response dicts.
+        since_turn (int, optional): Number of turns the client already has.
 
     Returns:
         list[dict]: Updated chat history for the frontend.
     """
 
     samples, node_id = responses[0]['value'], responses[1]['value']
-    consent = Consent.objects.filter(user=ConsentUrl.objects.get(consent_url=invite_id).user).latest('created_at')
+    consent = Consent.objects.filter(user=get_user_from_invite_id(invite_id)).latest('created_at')
     consent.store_sample_this_study = True
     consent.store_sample_other_studies = (samples == "storeSamplesOtherStudies")
     consent.save()
-    return update_consent_and_advance(invite_id, node_id, graph, "Sample use submitted!")
+    return update_consent_and_advance(invite_id, node_id, graph, "Sample use submitted!", since_turn)
 
 
-def handle_phi_use(graph, invite_id, responses):
+def handle_phi_use(graph, invite_id, responses, since_turn=0):
     """
     Handles the form submission for PHI (Protected Health Information) usage consent.
 
@@ -363,20 +757,21 @@ def handle_phi_use(graph, invite_id, responses):
         conversation_graph (dict): The parsed consent script.
         invite_id (str): UUID of the invite link.
         responses (list): List of form responses submitted by the user.
+        since_turn (int, optional): Number of turns the client already has.
 
     Returns:
         list: Updated chat history to be sent back to the frontend.
     """
 
     samples, node_id = responses[0]['value'], responses[1]['value']
-    consent = Consent.objects.filter(user=ConsentUrl.objects.get(consent_url=invite_id).user).latest('created_at')
+    consent = Consent.objects.filter(user=get_user_from_invite_id(invite_id)).latest('created_at')
     consent.store_phi_this_study = True
     consent.store_phi_other_studies = (samples == "storePhiOtherStudies")
     consent.save()
-    return update_consent_and_advance(invite_id, node_id, graph, "PHI use submitted!")
+    return update_consent_and_advance(invite_id, node_id, graph, "PHI use submitted!", since_turn)
 
 
-def handle_result_return(graph, invite_id, responses):
+def handle_result_return(graph, invite_id, responses, since_turn=0):
     """
     Handles the form submission for return of genetic results preferences.
 
@@ -387,6 +782,7 @@ def handle_result_return(graph, invite_id, responses):
         conversation_graph (dict): The parsed consent script.
         invite_id (str): UUID of the invite link.
         responses (list): List of form responses submitted by the user.
+        since_turn (int, optional): Number of turns the client already has.
 
     Returns:
         list: Updated chat history to be sent back to the frontend.
@@ -394,15 +790,15 @@ def handle_result_return(graph, invite_id, responses):
 
     response_dict = {r["name"]: r["value"] for r in responses}
     node_id = response_dict["node_id"]
-    consent = Consent.objects.filter(user=ConsentUrl.objects.get(consent_url=invite_id).user).latest('created_at')
+    consent = Consent.objects.filter(user=get_user_from_invite_id(invite_id)).latest('created_at')
     consent.return_primary_results = response_dict.get("rorPrimary") is True
     consent.return_actionable_secondary_results = response_dict.get("rorSecondary") is True
     consent.return_secondary_results = response_dict.get("rorSecondaryNot") is True
     consent.save()
-    return update_consent_and_advance(invite_id, node_id, graph, "Result return preferences submitted!")
+    return update_consent_and_advance(invite_id, node_id, graph, "Result return preferences submitted!", since_turn)
 
 
-def handle_consent(graph, invite_id, responses):
+def handle_consent(graph, invite_id, responses, since_turn=0):
     """
     Handles the final user consent form submission.
 
@@ -413,6 +809,7 @@ def handle_consent(graph, invite_id, responses):
         conversation_graph (dict): The parsed consent script.
         invite_id (str): UUID of the invite link.
         responses (list): List of form responses submitted by the user.
+        since_turn (int, optional): Number of turns the client already has.
 
     Returns:
         list: Updated chat history to be sent back to the frontend.
@@ -420,7 +817,7 @@ def handle_consent(graph, invite_id, responses):
 
     response_dict = {r["name"]: r["value"] for r in responses}
     node_id = response_dict["node_id"]
-    user = ConsentUrl.objects.get(consent_url=invite_id).user
+    user = get_user_from_invite_id(invite_id)
     consent = Consent.objects.filter(user=user).latest('created_at')
 
     if response_dict.get("consent"):
@@ -430,24 +827,24 @@ def handle_consent(graph, invite_id, responses):
         user.save()
         consent.save()
 
-    return update_consent_and_advance(invite_id, node_id, graph, "Consent submitted!")
+    return update_consent_and_advance(invite_id, node_id, graph, "Consent submitted!", since_turn)
 
 
-def handle_family_enrollment_form(conversation_graph, invite_id, responses):
+def handle_family_enrollment_form(conversation_graph, invite_id, responses, since_turn=0):
     """
     Processes the form where a user selects who they are enrolling (self, children, or both).
     Updates user flags, generates dynamic workflow, and advances the chat sequence.
     """
     checked = responses[0]["value"]
-    user = ConsentUrl.objects.get(consent_url=invite_id).user
-    history = get_user_consent_history(invite_id)
-    parent_node_id = history[-1]["node_id"] if history else None
+    user = get_user_from_invite_id(invite_id)
+    last_turn = get_last_user_consent_turn(invite_id)
+    parent_node_id = last_turn["node_id"] if last_turn else None
 
     if not parent_node_id or parent_node_id not in conversation_graph:
         raise Exception("Invalid or missing parent node")
 
     try:
-        fields = history[-1]['user_responses'][0]['label']['fields']
+        fields = last_turn['user_responses'][0]['label']['fields']
         checkbox_node_ids = {f['name']: f['id_value'] for f in fields}
     except Exception:
         raise Exception("Checkbox fields missing from chat history")
@@ -471,13 +868,12 @@ def handle_family_enrollment_form(conversation_graph, invite_id, responses):
     generate_workflow(start_node_id, workflow_ids, invite_id)
     next_sequence = process_consent_sequence(start_node_id, invite_id)
 
-    history.append(format_turn(conversation_graph, start_node_id, ", ".join(checked), next_sequence))
-    set_user_consent_history(invite_id, history)
+    append_chat_history(invite_id, format_turn(conversation_graph, start_node_id, ", ".join(checked), next_sequence))
 
-    return build_chat_from_history(invite_id)
+    return build_chat_from_history(invite_id, since_turn)
 
 
-def handle_user_feedback_form(graph, invite_id, responses):
+def handle_user_feedback_form(graph, invite_id, responses, since_turn=0):
     """
     Handles submission of a feedback form, stores the data,
     and advances the chat sequence.
@@ -485,6 +881,7 @@ def handle_user_feedback_form(graph, invite_id, responses):
     Args:
         invite_id (str): The invite UUID identifying the session.
         responses (list): List of form response dicts.
+        since_turn (int, optional): Number of turns the client already has.
 
     Returns:
         list[dict]: Updated chat history for the frontend.
@@ -498,7 +895,7 @@ def handle_user_feedback_form(graph, invite_id, responses):
         "suggestions": (data.get("suggestions") or "")[:2000]
     }
 
-    user = ConsentUrl.objects.get(consent_url=invite_id).user
+    user = get_user_from_invite_id(invite_id)
     if data.get("anonymize") is None:
         payload["user"] = user.pk
 
@@ -506,10 +903,10 @@ def handle_user_feedback_form(graph, invite_id, responses):
     serializer.is_valid(raise_exception=True)
     serializer.save()
 
-    return update_consent_and_advance(invite_id, node_id, graph, "Feedback submitted!")
+    return update_consent_and_advance(invite_id, node_id, graph, "Feedback submitted!", since_turn)
 
 
-def handle_other_adult_contact_form(conversation_graph, invite_id, responses):
+def handle_other_adult_contact_form(conversation_graph, invite_id, responses, since_turn=0):
     """
     Processes the form submission where the user wants to refer another adult.
     This creates a new user record and progresses the chat.
@@ -518,6 +915,7 @@ def handle_other_adult_contact_form(conversation_graph, invite_id, responses):
         conversation_graph (dict): Parsed consent script graph.
         invite_id (str): The invite UUID.
         responses (list): Submitted form responses.
+        since_turn (int, optional): Number of turns the client already has.
 
     Returns:
         list[dict]: Updated chat history for frontend.
@@ -525,8 +923,7 @@ def handle_other_adult_contact_form(conversation_graph, invite_id, responses):
     response_dict = {r.get("name"): r.get("value") for r in responses if r.get("name")}
     node_id = response_dict.get("node_id")
 
-    consent_url = get_object_or_404(ConsentUrl, consent_url=invite_id)
-    referring_user = consent_url.user
+    referring_user = get_user_from_invite_id(invite_id)
 
     first_name = response_dict.get("firstname", "")
     last_name = response_dict.get("lastname", "")
@@ -548,55 +945,27 @@ def handle_other_adult_contact_form(conversation_graph, invite_id, responses):
 
     next_node_id = conversation_graph[node_id]["child_ids"][0]
     next_sequence = process_consent_sequence(next_node_id, invite_id)
+    append_chat_history(invite_id, format_turn(conversation_graph, node_id, echo_user_response, next_sequence))
 
-    history = get_user_consent_history(invite_id)
-    history.append(format_turn(conversation_graph, node_id, echo_user_response, next_sequence))
-    set_user_consent_history(invite_id, history)
-
-    return build_chat_from_history(invite_id)
+    return build_chat_from_history(invite_id, since_turn)
 
 
 def generate_workflow(start_node_id, user_option_node_ids, invite_id):
-    conversation_graph = get_script_from_invite_id(invite_id)
+    compiled = get_compiled_script_from_invite_id(invite_id)
 
     # generate a sub workflow to dynamically process user responses
-    workflow = get_user_workflow(invite_id)
+    workflow = get_workflow_queue(invite_id)
 
-    metadata_field = conversation_graph[start_node_id]['metadata']['workflow']
+    # Sub-graphs are memoized per script revision
+    metadata_field = compiled.graph[start_node_id]['metadata']['workflow']
     for user_option_node_id in user_option_node_ids:
-        sub_graph = traverse(conversation_graph, user_option_node_id, metadata_field)
-        workflow.append(sub_graph)
-    set_user_workflow(invite_id, workflow)
-    return workflow
+        workflow.append(compiled.get_workflow_nodes(user_option_node_id, metadata_field))
+    set_workflow_queue(invite_id, workflow)
+    return workflow.to_list()
 
 
 def traverse(conversation_graph, start_id, metadata_field=None):
-    sub_graph_nodes = set()
-    visited = set()
-
-    def dfs(node_id):
-        if node_id in visited:
-            return
-        visited.add(node_id)
-
-        node = conversation_graph.get(node_id, {})
-        metadata = node.get('metadata', {})
-        workflow = metadata.get('workflow')
-
-        if metadata_field:
-            if workflow != metadata_field:
-                # Keep walking children even if this node doesn't match
-                pass
-            else:
-                sub_graph_nodes.add(node_id)
-        else:
-            sub_graph_nodes.add(node_id)
-
-        for child_id in node.get('child_ids', []):
-            dfs(child_id)
-
-    dfs(start_id)
-    return list(sub_graph_nodes)
+    return get_workflow_node_ids(conversation_graph, start_id, metadata_field)
 
 
 def process_test_question(conversation_graph, current_node_id, invite_id):
@@ -607,8 +976,7 @@ def process_test_question(conversation_graph, current_node_id, invite_id):
 
     try:
         # Get user from invite
-        consent_url = get_object_or_404(ConsentUrl, consent_url=str(invite_id))
-        user = consent_url.user
+        user = get_user_from_invite_id(invite_id)
         script_version = getattr(user, "consent_script", None)
 
         if not script_version:
@@ -631,7 +999,7 @@ def process_test_question(conversation_graph, current_node_id, invite_id):
             else:
                 return node_metadata.get("pass_node_id", "")
 
-    except ConsentUrl.DoesNotExist:
+    except Http404:
         # If the invite ID is invalid
         return node_metadata.get("fail_node_id", "")
     
@@ -678,11 +1046,11 @@ def process_user_consent(conversation_graph, current_node_id, invite_id):
     node = conversation_graph[current_node_id]["metadata"]
 
     if node["workflow"] in ["start_consent", "end_consent"]:
-        consent_url_obj = ConsentUrl.objects.filter(consent_url=str(invite_id)).first()
-        if not consent_url_obj:
+        invite = get_invite_context(invite_id)
+        if not invite:
             return ''
 
-        user = consent_url_obj.user
+        user = invite.user
 
         # Check if user is enrolling themselves and hasn't completed consent
         if user.enrolling_myself and not user.consent_complete:
@@ -693,27 +1061,32 @@ def process_user_consent(conversation_graph, current_node_id, invite_id):
                 consent_age_group=adult,
             )
 
-            set_consenting_myself(invite_id, True)
-            set_consent_node(invite_id, current_node_id)
+            set_many(invite_id, {
+                "user_consenting": True,
+                "consent_node_id": current_node_id,
+            })
 
             return node.get("enrolling_myself_node_id")
 
         # Check if enrolling children
         elif user.enrolling_children:
-            set_consenting_myself(invite_id, False)
+            state = get_many(invite_id, ["children_consenting", "consent_node_id"])
+            updates = {"user_consenting": False}
 
-            if get_consenting_children(invite_id) is None:
-                set_consenting_children(invite_id, True)
-                consent_node_id = get_consent_node(invite_id)
-                node = conversation_graph[consent_node_id]["metadata"]
+            if state["children_consenting"] is None:
+                updates["children_consenting"] = True
+                set_many(invite_id, updates)
+                node = conversation_graph[state["consent_node_id"]]["metadata"]
                 return node.get("enrolling_children_node_id")
 
+            set_many(invite_id, updates)
+
     elif node["workflow"] == "decline_consent":
-        consent_url_obj = ConsentUrl.objects.filter(consent_url=str(invite_id)).first()
-        if not consent_url_obj:
+        invite = get_invite_context(invite_id)
+        if not invite:
             return ''
 
-        user = consent_url_obj.user
+        user = invite.user
         user.declined_consent = True
         user.save()
 
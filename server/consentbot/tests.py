@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# consentbot/tests.py
+
+import time
+from datetime import timedelta
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from consentbot.models import Consent, ConsentAgeGroup, ConsentCache, ConsentScript, ConsentTurn, ConsentUrl
+from utils.cache import consent_session, get_consent_node, set_consent_node
+from utils.script_cache import script_cache
+from utils.script_edits import write_script_nodes
+from utils.script_nodes import export_script, store_script_nodes
+from utils.session_backends import WriteBehindSessionBackend
+
+User = get_user_model()
+
+
+class InviteExpiryTests(TestCase):
+    """Chat requests on an expired invite are refused before session state is touched."""
+
+    def setUp(self):
+        self.client = APIClient()
+        user = User.objects.create_user(username="participant", email="participant@test.tst", password="x")
+        self.invite = ConsentUrl.objects.create(user=user)
+        self.invite_id = str(self.invite.consent_url)
+
+    def expire_invite(self):
+        self.invite.expires_at = timezone.now() - timedelta(days=1)
+        self.invite.save()
+
+    def test_live_invite_session_round_trips(self):
+        with consent_session(self.invite_id, self.invite.expires_at):
+            set_consent_node(self.invite_id, "abc")
+        with consent_session(self.invite_id, self.invite.expires_at):
+            self.assertEqual(get_consent_node(self.invite_id), "abc")
+
+    def test_expired_invite_chat_is_refused(self):
+        self.expire_invite()
+
+        response = self.client.get(f"/mia/consentbot/consent-response/{self.invite_id}/", {"node_id": "start"})
+        self.assertEqual(response.status_code, 410)
+
+        response = self.client.post("/mia/consentbot/consent-response/", {
+            "invite_id": self.invite_id,
+            "node_id": "abc",
+            "form_type": "consent",
+            "form_responses": [],
+        }, format="json")
+        self.assertEqual(response.status_code, 410)
+
+        response = self.client.get(f"/mia/consentbot/consent/{self.invite_id}/")
+        self.assertEqual(response.status_code, 410)
+
+        self.assertFalse(ConsentTurn.objects.filter(invite_id=self.invite_id).exists())
+        self.assertFalse(ConsentCache.objects.filter(key__contains=self.invite_id).exists())
+
+    def test_unknown_invite_is_not_found(self):
+        response = self.client.get("/mia/consentbot/consent-response/00000000-0000-0000-0000-000000000000/", {"node_id": "start"})
+        self.assertEqual(response.status_code, 404)
+
+
+class WriteBehindSessionBackendTests(TestCase):
+    """Rows read through the write-behind backend expire in its cache as in the database."""
+
+    def setUp(self):
+        cache.clear()
+        self.backend = WriteBehindSessionBackend(interval=60)
+
+    def test_expired_row_is_a_miss(self):
+        ConsentCache.objects.create(key="expired", value="v", expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.backend.get_many(["expired"]), {})
+        self.assertIsNone(cache.get("expired"))
+
+    def test_refilled_row_expires_with_its_row(self):
+        ConsentCache.objects.create(key="expiring", value="v", expires_at=timezone.now() + timedelta(seconds=1.5))
+        self.assertEqual(self.backend.get_many(["expiring"]), {"expiring": "v"})
+        self.assertEqual(cache.get("expiring"), "v")
+        time.sleep(1.6)
+        self.assertEqual(self.backend.get_many(["expiring"]), {})
+
+
+def script_node(node_type, message, parent_ids, child_ids, end_sequence=False):
+    return {
+        "type": node_type,
+        "messages": [message],
+        "attachment": None,
+        "render_type": "button",
+        "metadata": {"workflow": "", "end_sequence": end_sequence},
+        "parent_ids": parent_ids,
+        "child_ids": child_ids,
+    }
+
+
+class ScriptNodeEditTests(TestCase):
+    """Node-level edits write the script JSON and node rows at the next revision, or nothing."""
+
+    def setUp(self):
+        script_cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(email="editor@test.tst"))
+        self.script = ConsentScript.objects.create(name="Edits", version_number=1, script={
+            "n1": script_node("bot", "Hello", ["start"], ["n2"]),
+            "n2": script_node("user", "OK", ["n1"], ["n3"]),
+            "n3": script_node("bot", "Bye", ["n2"], [], end_sequence=True),
+        })
+        store_script_nodes(self.script)
+        self.nodes_url = f"/mia/consentbot/scripts/{self.script.pk}/nodes/"
+
+    def stored(self):
+        """The stored script, after checking that its node rows match it."""
+        script = ConsentScript.objects.get(pk=self.script.pk)
+        self.assertEqual(export_script(script.pk), script.script)
+        return script
+
+    def test_create_node(self):
+        response = self.client.post(self.nodes_url, {
+            "revision": 0,
+            "node_id": "n4",
+            "node": {"type": "bot", "messages": ["More"], "parent_ids": ["n3"]},
+        }, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["revision"], 1)
+        script = self.stored()
+        self.assertEqual(script.revision, 1)
+        self.assertEqual(script.script["n4"]["messages"], ["More"])
+        self.assertEqual(script.script["n4"]["parent_ids"], ["n3"])
+        self.assertEqual(script.script["n3"]["child_ids"], ["n4"])
+
+    def test_patch_node(self):
+        response = self.client.patch(f"{self.nodes_url}n2/", {
+            "revision": 0,
+            "operations": [{"op": "replace", "path": "/messages/0", "value": "Sure"}],
+        }, format="json")
+        self.assertEqual(response.status_code, 200)
+        script = self.stored()
+        self.assertEqual(script.revision, 1)
+        self.assertEqual(script.script["n2"]["messages"], ["Sure"])
+
+    def test_move_node(self):
+        response = self.client.post(f"{self.nodes_url}n3/move/", {"revision": 0, "parent_ids": ["n1"]}, format="json")
+        self.assertEqual(response.status_code, 200)
+        script = self.stored()
+        self.assertEqual(script.script["n3"]["parent_ids"], ["n1"])
+        self.assertEqual(script.script["n1"]["child_ids"], ["n2", "n3"])
+        self.assertEqual(script.script["n2"]["child_ids"], [])
+
+    def test_delete_node(self):
+        response = self.client.delete(f"{self.nodes_url}n3/?revision=0")
+        self.assertEqual(response.status_code, 200)
+        script = self.stored()
+        self.assertNotIn("n3", script.script)
+        self.assertEqual(script.script["n2"]["child_ids"], [])
+
+    def test_consecutive_edits(self):
+        for revision, message in enumerate(["One", "Two", "Three"]):
+            response = self.client.patch(f"{self.nodes_url}n1/", {
+                "revision": revision,
+                "operations": [{"op": "replace", "path": "/messages/0", "value": message}],
+            }, format="json")
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stored().script["n1"]["messages"], ["Three"])
+        self.assertEqual(script_cache.get(self.script.pk, 3).graph["n1"]["messages"], ("Three",))
+
+    def test_stale_revision_conflicts(self):
+        self.client.patch(f"{self.nodes_url}n2/", {
+            "revision": 0,
+            "operations": [{"op": "replace", "path": "/messages/0", "value": "Sure"}],
+        }, format="json")
+        before = self.stored()
+
+        response = self.client.patch(f"{self.nodes_url}n2/", {
+            "revision": 0,
+            "operations": [{"op": "replace", "path": "/messages/0", "value": "Stale"}],
+        }, format="json")
+        self.assertEqual(response.status_code, 409)
+        response = self.client.delete(f"{self.nodes_url}n3/?revision=0")
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(write_script_nodes(self.script.pk, 0, {"n2": None}), None)
+
+        after = self.stored()
+        self.assertEqual(after.revision, before.revision)
+        self.assertEqual(after.script, before.script)
+
+    def test_links_cannot_be_patched(self):
+        for path in ("/child_ids", "/parent_ids"):
+            response = self.client.patch(f"{self.nodes_url}n2/", {
+                "revision": 0,
+                "operations": [{"op": "replace", "path": path, "value": []}],
+            }, format="json")
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.stored().revision, 0)
+
+    def test_node_id_with_quote_is_rejected(self):
+        response = self.client.post(self.nodes_url, {
+            "revision": 0,
+            "node_id": 'n"4',
+            "node": {"type": "bot", "messages": ["More"], "parent_ids": ["n3"]},
+        }, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.stored().revision, 0)
+        with self.assertRaises(ValueError):
+            write_script_nodes(self.script.pk, 0, {"n\\4": {}})
+
+
+class ListEndpointTests(TestCase):
+    """Keyset pages, field selection and summaries of the list endpoints."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(email="coordinator@test.tst"))
+        user = User.objects.create_user(email="participant@test.tst")
+        for i in range(5):
+            Consent.objects.create(
+                user=user,
+                consent_age_group=ConsentAgeGroup.EIGHTEEN_AND_OVER,
+                consented_at=timezone.now() if i % 2 else None,
+            )
+        # Rows created in the same instant are ordered by primary key
+        Consent.objects.update(created_at=timezone.now())
+        ConsentScript.objects.create(name="Listed", version_number=1, script={"n1": {"messages": ["Hello"]}})
+
+    def test_cursor_walk_returns_every_row_once(self):
+        seen = []
+        params = {"limit": 2}
+        while True:
+            response = self.client.get("/mia/consentbot/consent/", params)
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            self.assertLessEqual(len(page["results"]), 2)
+            seen += [row["user_consent_id"] for row in page["results"]]
+            if page["next_cursor"] is None:
+                break
+            params = {"limit": 2, "cursor": page["next_cursor"]}
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(set(seen), {str(pk) for pk in Consent.objects.values_list("pk", flat=True)})
+
+    def test_bad_cursor_is_rejected(self):
+        response = self.client.get("/mia/consentbot/consent/", {"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_unknown_field_is_rejected(self):
+        response = self.client.get("/mia/consentbot/consent/", {"fields": "user_consent_id,nope"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("fields", response.json())
+
+    def test_fields_without_script_do_not_load_it(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/mia/consentbot/scripts/", {"fields": "script_id,name"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [
+            {"script_id": str(script.pk), "name": script.name} for script in ConsentScript.objects.all()
+        ])
+        self.assertFalse(any('"script"' in query["sql"] for query in queries.captured_queries))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/mia/consentbot/scripts/", {"fields": "script_id,script"})
+        self.assertEqual(response.json()[0]["script"], {"n1": {"messages": ["Hello"]}})
+        self.assertTrue(any('"script"' in query["sql"] for query in queries.captured_queries))
+
+    def test_summary_returns_counts(self):
+        response = self.client.get("/mia/consentbot/consent/", {"summary": "true"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"count": 5, "consented": 2})
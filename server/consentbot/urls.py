@@ -6,7 +6,8 @@ from consentbot.apis import (
     ConsentScriptViewSet,
     ConsentViewSet,
     ConsentUrlViewSet,
-    ConsentResponseViewSet
+    ConsentResponseViewSet,
+    ExportViewSet
 )
 
 router = DefaultRouter()
@@ -14,6 +15,7 @@ router.register(r'scripts', ConsentScriptViewSet, basename='consent-scripts')
 router.register(r'consent', ConsentViewSet, basename='consent')
 router.register(r'consent-url', ConsentUrlViewSet, basename='consent-url')
 router.register(r'consent-response', ConsentResponseViewSet, basename='consent-response')
+router.register(r'exports', ExportViewSet, basename='exports')
 
 
 urlpatterns = [
@@ -1,105 +1,486 @@
 #!/usr/bin/env python
 # utils/cache.py
 
+import base64
 import json
-from consentbot.models import ConsentCache
+import logging
+import threading
+import time
+import zlib
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from consentbot.models import ConsentTurn, ConsentUrl
+from utils.session_backends import get_session_backend
+from utils.workflow_queue import WorkflowQueue
+
+logger = logging.getLogger(__name__)
+
+# Attempts made when a concurrent append claims the same turn number
+APPEND_TURN_RETRIES = 3
+
+# Per-invite state fields, each stored under its own ConsentCache key
+SESSION_FIELDS = (
+    "workflow_front",
+    "workflow_rest",
+    # Whole workflow as one JSON list, read only to upgrade older sessions
+    "workflow",
+    "user_consenting",
+    "children_consenting",
+    "consent_node_id",
+    "child_user_id",
+    "child_user_consent_id",
+)
+
+# Sessions opened with `consent_session`, by invite ID
+_active_sessions = ContextVar("consent_sessions", default={})
 
 
 # Internal helpers
-def _cache_get(key):
-    try:
-        return ConsentCache.objects.get(pk=key).value
-    except ConsentCache.DoesNotExist:
-        return None
-
-
-def _cache_set(key, value):
-    obj, _ = ConsentCache.objects.get_or_create(pk=key)
+def _serialize(value):
     if isinstance(value, (dict, list)):
-        obj.value = json.dumps(value)
-    else:
-        obj.value = str(value)
-    obj.save()
+        return json.dumps(value)
+    return str(value)
 
 
 def _build_key(invite_id, suffix):
     return f"invite_id:{invite_id}:{suffix}"
 
 
+# Value codec
+# Stored values at least COMPRESS_MIN_BYTES long are zlib-compressed and
+# base64-encoded behind a versioned header. Values without a header, including
+# every row written before the codec existed, are plaintext.
+CODEC_HEADER_ZLIB_V1 = "~z1:"
+COMPRESS_MIN_BYTES = getattr(settings, "CONSENT_CACHE_COMPRESS_MIN_BYTES", 1024)
+COMPRESS_LEVEL = getattr(settings, "CONSENT_CACHE_COMPRESS_LEVEL", 6)
+
+
+class CodecStats:
+    """Process-wide counters for value sizes and codec time."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.encoded = 0
+        self.compressed = 0
+        self.decoded = 0
+        self.plain_bytes = 0
+        self.stored_bytes = 0
+        self.encode_seconds = 0.0
+        self.decode_seconds = 0.0
+
+    def record_encode(self, plain_bytes, stored_bytes, compressed, seconds):
+        with self._lock:
+            self.encoded += 1
+            self.compressed += int(compressed)
+            self.plain_bytes += plain_bytes
+            self.stored_bytes += stored_bytes
+            self.encode_seconds += seconds
+
+    def record_decode(self, seconds):
+        with self._lock:
+            self.decoded += 1
+            self.decode_seconds += seconds
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "encoded": self.encoded,
+                "compressed": self.compressed,
+                "decoded": self.decoded,
+                "plain_bytes": self.plain_bytes,
+                "stored_bytes": self.stored_bytes,
+                "ratio": (self.plain_bytes / self.stored_bytes) if self.stored_bytes else None,
+                "encode_seconds": self.encode_seconds,
+                "decode_seconds": self.decode_seconds,
+            }
+
+
+codec_stats = CodecStats()
+
+
+def encode_value(text):
+    """Encode a stored string, compressing it when that makes it smaller."""
+    started = time.perf_counter()
+    raw = text.encode("utf-8")
+    stored = text
+    if len(raw) >= COMPRESS_MIN_BYTES:
+        packed = zlib.compress(raw, COMPRESS_LEVEL)
+        candidate = CODEC_HEADER_ZLIB_V1 + base64.b64encode(packed).decode("ascii")
+        if len(candidate) < len(raw):
+            stored = candidate
+
+    compressed = stored is not text
+    stored_bytes = len(stored) if compressed else len(raw)
+    codec_stats.record_encode(len(raw), stored_bytes, compressed, time.perf_counter() - started)
+    if compressed:
+        logger.debug("Compressed cache value from %d to %d bytes", len(raw), stored_bytes)
+    return stored
+
+
+def decode_value(stored):
+    """Decode a stored string written by `encode_value`, or plaintext as is."""
+    if stored is None or not stored.startswith(CODEC_HEADER_ZLIB_V1):
+        return stored
+    started = time.perf_counter()
+    text = zlib.decompress(base64.b64decode(stored[len(CODEC_HEADER_ZLIB_V1):])).decode("utf-8")
+    codec_stats.record_decode(time.perf_counter() - started)
+    return text
+
+
+def get_invite_expiry(invite_id):
+    """Return the invite's ConsentUrl.expires_at, which session state expires with."""
+    return (
+        ConsentUrl.objects
+        .filter(consent_url=invite_id)
+        .values_list("expires_at", flat=True)
+        .first()
+    )
+
+
+# Session state
+class ConsentSession:
+    """
+    All cached chat state for one invite.
+
+    The state is read with a single query the first time a field is read, and
+    only the fields that were set are written back, in one statement, on `flush`.
+    Written state expires with the invite; pass `expires_at` when it is already
+    known to save looking it up.
+    """
+
+    def __init__(self, invite_id, expires_at=None):
+        self.invite_id = str(invite_id)
+        self.expires_at = expires_at
+        self._values = {}
+        self._dirty = set()
+        self._loaded = False
+
+    def _keys(self, fields):
+        return {_build_key(self.invite_id, field): field for field in fields}
+
+    def load(self):
+        keys = self._keys(SESSION_FIELDS)
+        rows = get_session_backend().get_many(keys)
+        loaded = {keys[key]: decode_value(value) for key, value in rows.items()}
+        # Fields set before the first read keep their new values
+        loaded.update({field: self._values[field] for field in self._dirty})
+        self._values = loaded
+        self._loaded = True
+        return self
+
+    def get(self, field):
+        if not self._loaded:
+            self.load()
+        return self._values.get(field)
+
+    def set(self, field, value):
+        self._values[field] = _serialize(value)
+        self._dirty.add(field)
+
+    @property
+    def dirty(self):
+        return bool(self._dirty)
+
+    def flush(self):
+        if not self._dirty:
+            return
+        if self.expires_at is None:
+            self.expires_at = get_invite_expiry(self.invite_id)
+        get_session_backend().set_many(
+            {key: encode_value(self._values[field]) for key, field in self._keys(self._dirty).items()},
+            self.expires_at,
+        )
+        self._dirty.clear()
+
+    def touch(self, expires_at):
+        """Move the expiry of this invite's stored state."""
+        self.expires_at = expires_at
+        get_session_backend().touch(self._keys(SESSION_FIELDS), expires_at)
+
+    def persist(self):
+        """Make this invite's state durable, for backends that write behind."""
+        self.flush()
+        get_session_backend().persist(self._keys(SESSION_FIELDS))
+
+
+@contextmanager
+def consent_session(invite_id, expires_at=None):
+    """
+    Open an invite's chat state for a request and flush changes when the block exits.
+
+    While the block is active, the getter and setter functions in this module
+    read and write the session instead of the database. Nested calls for the
+    same invite reuse the open session.
+    """
+    invite_id = str(invite_id)
+    sessions = _active_sessions.get()
+    if invite_id in sessions:
+        yield sessions[invite_id]
+        return
+
+    session = ConsentSession(invite_id, expires_at)
+    token = _active_sessions.set({**sessions, invite_id: session})
+    try:
+        yield session
+    finally:
+        _active_sessions.reset(token)
+        session.flush()
+
+
+def get_active_session(invite_id):
+    """Return the open ConsentSession for an invite, or None."""
+    return _active_sessions.get().get(str(invite_id))
+
+
+def end_consent_session(invite_id, expires_at=None):
+    """
+    Persist an invite's state when its chat session ends.
+
+    Args:
+        invite_id (str): The invite UUID identifying the session.
+        expires_at (datetime, optional): The invite's new expiry, if it changed.
+    """
+    session = get_active_session(invite_id) or ConsentSession(invite_id)
+    if expires_at is not None:
+        session.touch(expires_at)
+    session.persist()
+
+
+def _decode_flag(value):
+    return value == "true" if value else None
+
+
+# How stored strings are turned back into values; other fields are returned as stored
+FIELD_DECODERS = {
+    "workflow": lambda value: json.loads(value) if value else [],
+    "user_consenting": _decode_flag,
+    "children_consenting": _decode_flag,
+}
+
+
+def get_many(invite_id, fields):
+    """
+    Read several state fields for an invite with at most one query.
+
+    Args:
+        invite_id (str): The invite UUID identifying the session.
+        fields (list[str]): Field names from SESSION_FIELDS.
+
+    Returns:
+        dict: Decoded values by field name; missing fields decode as if unset.
+    """
+    session = get_active_session(invite_id)
+    if session is not None:
+        raw = {field: session.get(field) for field in fields}
+    else:
+        keys = {_build_key(invite_id, field): field for field in fields}
+        rows = get_session_backend().get_many(keys)
+        raw = {field: decode_value(rows.get(key)) for key, field in keys.items()}
+
+    return {
+        field: FIELD_DECODERS.get(field, lambda value: value)(value)
+        for field, value in raw.items()
+    }
+
+
+def set_many(invite_id, mapping, expires_at=None):
+    """
+    Write several state fields for an invite with a single upsert.
+
+    Inside `consent_session` the values are buffered and written when the
+    session flushes.
+
+    Args:
+        invite_id (str): The invite UUID identifying the session.
+        mapping (dict): Values by field name from SESSION_FIELDS.
+        expires_at (datetime, optional): The invite's expiry. Looked up from
+            the ConsentUrl when omitted.
+    """
+    session = get_active_session(invite_id)
+    if session is not None:
+        for field, value in mapping.items():
+            session.set(field, value)
+    else:
+        get_session_backend().set_many(
+            {_build_key(invite_id, field): encode_value(_serialize(value)) for field, value in mapping.items()},
+            expires_at or get_invite_expiry(invite_id),
+        )
+
+
 # Workflow
+def get_workflow_queue(invite_id):
+    """Retrieve the user's current workflow as a WorkflowQueue."""
+    state = get_many(invite_id, ["workflow_front", "workflow_rest", "workflow"])
+    if state["workflow_front"] is None and state["workflow"]:
+        # Stored by an older version as one list; rewritten on the next save
+        return WorkflowQueue.from_legacy(state["workflow"])
+    return WorkflowQueue.parse(state["workflow_front"], state["workflow_rest"])
+
+
+def set_workflow_queue(invite_id, queue):
+    """Store the parts of the user's workflow queue that changed since it was read."""
+    mapping = {}
+    if queue.front_changed:
+        mapping["workflow_front"] = queue.dump_front()
+    if queue.rest_changed:
+        mapping["workflow_rest"] = queue.dump_rest()
+    if queue.replaces_legacy:
+        mapping["workflow"] = ""
+    if mapping:
+        set_many(invite_id, mapping)
+    queue.mark_saved()
+
+
 def get_user_workflow(invite_id):
     """Retrieve the user's current workflow graph (list of node ID lists)."""
-    value = _cache_get(_build_key(invite_id, "workflow"))
-    return json.loads(value) if value else []
+    return get_workflow_queue(invite_id).to_list()
 
 
 def set_user_workflow(invite_id, workflow):
     """Store the user’s current workflow graph."""
-    _cache_set(_build_key(invite_id, "workflow"), json.dumps(workflow))
+    set_workflow_queue(invite_id, WorkflowQueue(workflow))
 
 
 # Consent status flags
 def set_consenting_myself(invite_id, consenting=True):
     """Set whether the user is enrolling themselves."""
-    _cache_set(_build_key(invite_id, "user_consenting"), consenting)
+    set_many(invite_id, {"user_consenting": consenting})
 
 
 def get_consenting_myself(invite_id):
     """Get whether the user is enrolling themselves."""
-    value = _cache_get(_build_key(invite_id, "user_consenting"))
-    return value == "true" if value else None
+    return get_many(invite_id, ["user_consenting"])["user_consenting"]
 
 
 def set_consenting_children(invite_id, consenting=True):
     """Set whether the user is enrolling children."""
-    _cache_set(_build_key(invite_id, "children_consenting"), consenting)
+    set_many(invite_id, {"children_consenting": consenting})
 
 
 def get_consenting_children(invite_id):
     """Get whether the user is enrolling children."""
-    value = _cache_get(_build_key(invite_id, "children_consenting"))
-    return value == "true" if value else None
+    return get_many(invite_id, ["children_consenting"])["children_consenting"]
 
 
 # Consent chat node tracking
 def set_consent_node(invite_id, consent_node_id):
     """Set the ID of the main consent node used during enrollment."""
-    _cache_set(_build_key(invite_id, "consent_node_id"), consent_node_id)
+    set_many(invite_id, {"consent_node_id": consent_node_id})
 
 
 def get_consent_node(invite_id):
     """Get the ID of the main consent node."""
-    return _cache_get(_build_key(invite_id, "consent_node_id"))
+    return get_many(invite_id, ["consent_node_id"])["consent_node_id"]
 
 
 # Child user tracking (for family enrollment)
 def set_child_user_id(invite_id, child_user_id):
     """Store the user ID of a child participant."""
-    _cache_set(_build_key(invite_id, "child_user_id"), child_user_id)
+    set_many(invite_id, {"child_user_id": child_user_id})
 
 
 def get_child_user_id(invite_id):
     """Retrieve the user ID of a child participant."""
-    return _cache_get(_build_key(invite_id, "child_user_id"))
+    return get_many(invite_id, ["child_user_id"])["child_user_id"]
 
 
 def set_child_user_consent_id(invite_id, child_user_consent_id):
     """Store the consent record ID for a child participant."""
-    _cache_set(_build_key(invite_id, "child_user_consent_id"), child_user_consent_id)
+    set_many(invite_id, {"child_user_consent_id": child_user_consent_id})
 
 
 def get_child_user_consent_id(invite_id):
     """Retrieve the consent record ID for a child participant."""
-    return _cache_get(_build_key(invite_id, "child_user_consent_id"))
+    return get_many(invite_id, ["child_user_consent_id"])["child_user_consent_id"]
 
 
 # Chat history
 def set_user_consent_history(invite_id, history):
-    """Store the user’s full consent chat history (list of formatted turns)."""
-    _cache_set(_build_key(invite_id, "user_consent_history"), json.dumps(history))
-
-
-def get_user_consent_history(invite_id):
-    """Retrieve the user’s full consent chat history."""
-    value = _cache_get(_build_key(invite_id, "user_consent_history"))
-    return json.loads(value) if value else []
+    """Replace the user’s full consent chat history (list of formatted turns)."""
+    with transaction.atomic():
+        ConsentTurn.objects.filter(invite_id=invite_id).delete()
+        ConsentTurn.objects.bulk_create([
+            ConsentTurn(invite_id=invite_id, turn_no=turn_no, payload=encode_value(json.dumps(turn)))
+            for turn_no, turn in enumerate(history)
+        ])
+
+
+def get_user_consent_history(invite_id, since_turn=0):
+    """Retrieve the user’s consent chat history, starting at turn number `since_turn`."""
+    turns = ConsentTurn.objects.filter(invite_id=invite_id)
+    if since_turn:
+        turns = turns.filter(turn_no__gte=since_turn)
+    payloads = (
+        turns
+        .order_by("turn_no")
+        .values_list("payload", flat=True)
+    )
+    return [json.loads(decode_value(payload)) for payload in payloads]
+
+
+def append_user_consent_turn(invite_id, turn):
+    """
+    Append one formatted turn to the user’s consent chat history.
+
+    Returns:
+        int: The turn number assigned to the new turn.
+    """
+    payload = encode_value(json.dumps(turn))
+    for attempt in range(APPEND_TURN_RETRIES):
+        try:
+            # A savepoint is only needed to recover inside an outer transaction
+            with transaction.atomic() if connection.in_atomic_block else nullcontext():
+                return _insert_next_turn(invite_id, payload)
+        except IntegrityError:
+            if attempt == APPEND_TURN_RETRIES - 1:
+                raise
+
+
+def _insert_next_turn(invite_id, payload):
+    """Insert `payload` as the invite's next turn and return its turn number."""
+    if connection.vendor not in ("postgresql", "sqlite"):
+        last_turn_no = (
+            ConsentTurn.objects
+            .filter(invite_id=invite_id)
+            .aggregate(last=Max("turn_no"))["last"]
+        )
+        turn_no = 0 if last_turn_no is None else last_turn_no + 1
+        ConsentTurn.objects.create(invite_id=invite_id, turn_no=turn_no, payload=payload)
+        return turn_no
+
+    # Number and insert the turn in one statement
+    quote = connection.ops.quote_name
+    table = quote(ConsentTurn._meta.db_table)
+    invite, turn_no, payload_col, created = (
+        quote(ConsentTurn._meta.get_field(name).column)
+        for name in ("invite", "turn_no", "payload", "created_at")
+    )
+    sql = (
+        f"INSERT INTO {table} ({invite}, {turn_no}, {payload_col}, {created}) "
+        f"SELECT %s, COALESCE(MAX({turn_no}) + 1, 0), %s, %s FROM {table} WHERE {invite} = %s "
+        f"RETURNING {turn_no}"
+    )
+    invite_param = ConsentTurn._meta.get_field("invite").get_db_prep_value(invite_id, connection)
+    created_param = connection.ops.adapt_datetimefield_value(timezone.now())
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [invite_param, payload, created_param, invite_param])
+        return cursor.fetchone()[0]
+
+
+def get_last_user_consent_turn(invite_id):
+    """Retrieve the most recent turn of the user’s consent chat history, or None."""
+    payload = (
+        ConsentTurn.objects
+        .filter(invite_id=invite_id)
+        .order_by("-turn_no")
+        .values_list("payload", flat=True)
+        .first()
+    )
+    return json.loads(decode_value(payload)) if payload else None
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# utils/compact_graph.py
+
+"""
+Compact in-memory representation of a consent script graph.
+
+`ConsentScript.script` is a dict of node dicts, each with its own lists of
+child and parent IDs and a metadata dict. `json.loads` creates a separate
+string for every occurrence of a node ID, so a warm script costs several
+times its JSON size. CompactGraph keeps the same data with:
+
+- node IDs interned once and numbered; child and parent links stored as
+  integer arrays (CSR layout: one offsets array, one targets array),
+- one slotted CompactNode record per node instead of a dict,
+- messages as tuples and identical metadata dicts shared between nodes,
+- the `end_sequence` / `test_question` metadata flags decoded to booleans.
+
+CompactGraph and CompactNode are read-only mappings that look like the raw
+dicts (`graph.get(node_id, {})`, `node["child_ids"]`,
+`node.get("metadata", {})`), so the selectors and services that walk a graph
+work on either form. Metadata keeps its stored values; use the decoded
+`node.end_sequence` and `node.test_question` attributes for the flags.
+"""
+
+import sys
+from array import array
+from collections.abc import Mapping
+from operator import attrgetter
+from types import MappingProxyType
+
+_MISSING = object()
+
+# Node keys stored in CompactNode slots; any other keys go to `extra`
+_SLOT_KEYS = ("type", "messages", "attachment", "render_type", "render_content", "metadata")
+_LINK_KEYS = ("child_ids", "parent_ids")
+
+_HAS_CHILD_IDS = 1
+_HAS_PARENT_IDS = 2
+
+
+def decode_flag(value):
+    """Decode a stored metadata flag ("true"/"false", or a bool) to a bool."""
+    if isinstance(value, bool):
+        return value
+    return isinstance(value, str) and value.lower() == "true"
+
+
+class CompactNode(Mapping):
+    """One node of a CompactGraph. Reads like the node dict it was built from."""
+
+    __slots__ = (
+        "_graph", "index", "_flags", "type", "messages", "attachment", "render_type",
+        "render_content", "metadata", "extra", "end_sequence", "test_question",
+    )
+
+    def __init__(self, graph, index, node, metadata):
+        self._graph = graph
+        self.index = index
+        self._flags = (
+            (_HAS_CHILD_IDS if "child_ids" in node else 0)
+            | (_HAS_PARENT_IDS if "parent_ids" in node else 0)
+        )
+        node_type = node.get("type", _MISSING)
+        self.type = sys.intern(node_type) if isinstance(node_type, str) else node_type
+        messages = node.get("messages", _MISSING)
+        self.messages = tuple(messages) if isinstance(messages, list) else messages
+        self.attachment = node.get("attachment", _MISSING)
+        render_type = node.get("render_type", _MISSING)
+        self.render_type = sys.intern(render_type) if isinstance(render_type, str) else render_type
+        self.render_content = node.get("render_content", _MISSING)
+        self.metadata = metadata
+        extra = {key: value for key, value in node.items() if key not in _SLOT_KEYS and key not in _LINK_KEYS}
+        self.extra = extra or None
+
+        flags = metadata if isinstance(metadata, Mapping) else {}
+        self.end_sequence = decode_flag(flags.get("end_sequence"))
+        self.test_question = decode_flag(flags.get("test_question"))
+
+    @property
+    def node_id(self):
+        return self._graph.node_id(self.index)
+
+    def __getitem__(self, key):
+        if key == "child_ids" and self._flags & _HAS_CHILD_IDS:
+            return self._graph.child_ids(self.index)
+        if key == "parent_ids" and self._flags & _HAS_PARENT_IDS:
+            return self._graph.parent_ids(self.index)
+        if key in _SLOT_KEYS:
+            value = getattr(self, key)
+            if value is not _MISSING:
+                return value
+        elif self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        # Mapping.get goes through __getitem__ and an exception; this is the hot path
+        getter = _NODE_GETTERS.get(key)
+        if getter is not None:
+            value = getter(self)
+            return default if value is _MISSING else value
+        if self.extra:
+            return self.extra.get(key, default)
+        return default
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __iter__(self):
+        for key in _SLOT_KEYS:
+            if getattr(self, key) is not _MISSING:
+                yield key
+        if self._flags & _HAS_CHILD_IDS:
+            yield "child_ids"
+        if self._flags & _HAS_PARENT_IDS:
+            yield "parent_ids"
+        if self.extra:
+            yield from self.extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"<CompactNode {self.node_id!r}>"
+
+    def to_dict(self):
+        """Rebuild the node as a plain dict, as stored in `ConsentScript.script`."""
+        node = {}
+        for key, value in self.items():
+            if isinstance(value, tuple):
+                value = list(value)
+            elif isinstance(value, MappingProxyType):
+                value = dict(value)
+            node[key] = value
+        return node
+
+
+_NODE_GETTERS = {key: attrgetter(key) for key in _SLOT_KEYS}
+_NODE_GETTERS["child_ids"] = lambda node: (
+    node._graph.child_ids(node.index) if node._flags & _HAS_CHILD_IDS else _MISSING
+)
+_NODE_GETTERS["parent_ids"] = lambda node: (
+    node._graph.parent_ids(node.index) if node._flags & _HAS_PARENT_IDS else _MISSING
+)
+
+
+class CompactGraph(Mapping):
+    """A read-only consent script graph with interned IDs and array-backed links."""
+
+    def __init__(self, script):
+        ids = [sys.intern(node_id) for node_id in script]
+        index = {node_id: i for i, node_id in enumerate(ids)}
+        self._size = len(ids)
+
+        def intern(node_id):
+            i = index.get(node_id)
+            if i is None:
+                # Referenced but not defined; numbered after the real nodes
+                i = index[node_id] = len(ids)
+                ids.append(sys.intern(node_id))
+            return i
+
+        metadata_pool = {}
+
+        def share(metadata):
+            if not isinstance(metadata, dict):
+                return metadata
+            try:
+                key = tuple(sorted(metadata.items()))
+                hash(key)
+            except TypeError:
+                return MappingProxyType(metadata)
+            shared = metadata_pool.get(key)
+            if shared is None:
+                shared = metadata_pool[key] = MappingProxyType(metadata)
+            return shared
+
+        child_offsets, child_targets = array("i", [0]), array("i")
+        parent_offsets, parent_targets = array("i", [0]), array("i")
+        nodes = []
+        for i, node_id in enumerate(ids[:self._size]):
+            node = script[node_id]
+            child_targets.extend(intern(child_id) for child_id in node.get("child_ids") or ())
+            child_offsets.append(len(child_targets))
+            parent_targets.extend(intern(parent_id) for parent_id in node.get("parent_ids") or ())
+            parent_offsets.append(len(parent_targets))
+            nodes.append(CompactNode(self, i, node, share(node.get("metadata", _MISSING))))
+
+        self._ids = tuple(ids)
+        self._index = index
+        self._nodes = tuple(nodes)
+        self._child_offsets, self._child_targets = child_offsets, child_targets
+        self._parent_offsets, self._parent_targets = parent_offsets, parent_targets
+
+    # Mapping interface, keyed by node ID
+    def __getitem__(self, node_id):
+        i = self._index.get(node_id)
+        if i is None or i >= self._size:
+            raise KeyError(node_id)
+        return self._nodes[i]
+
+    def __iter__(self):
+        return iter(self._ids[:self._size])
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, node_id):
+        i = self._index.get(node_id)
+        return i is not None and i < self._size
+
+    def get(self, node_id, default=None):
+        i = self._index.get(node_id)
+        if i is None or i >= self._size:
+            return default
+        return self._nodes[i]
+
+    # Index-based access
+    def index_of(self, node_id):
+        """The integer index of a node ID, or None if it is never mentioned."""
+        return self._index.get(node_id)
+
+    def node_id(self, index):
+        return self._ids[index]
+
+    def node_at(self, index):
+        """The CompactNode at `index`, or None for a referenced but undefined ID."""
+        return self._nodes[index] if index < self._size else None
+
+    def child_indexes(self, index):
+        return self._child_targets[self._child_offsets[index]:self._child_offsets[index + 1]]
+
+    def parent_indexes(self, index):
+        return self._parent_targets[self._parent_offsets[index]:self._parent_offsets[index + 1]]
+
+    def child_ids(self, index):
+        ids = self._ids
+        return tuple([ids[i] for i in self._child_targets[self._child_offsets[index]:self._child_offsets[index + 1]]])
+
+    def parent_ids(self, index):
+        ids = self._ids
+        return tuple([ids[i] for i in self._parent_targets[self._parent_offsets[index]:self._parent_offsets[index + 1]]])
+
+    def walk(self, start_id):
+        """
+        Yield (node_id, node) for every node reachable from `start_id`, once each.
+
+        Depth-first, children in order. Referenced but undefined IDs are
+        yielded with node None and not walked further.
+        """
+        i = self._index.get(start_id)
+        if i is None:
+            yield start_id, None
+            return
+        ids, nodes, size = self._ids, self._nodes, self._size
+        offsets, targets = self._child_offsets, self._child_targets
+        seen = bytearray(len(ids))
+        seen[i] = 1
+        stack = [i]
+        while stack:
+            i = stack.pop()
+            if i >= size:
+                yield ids[i], None
+                continue
+            yield ids[i], nodes[i]
+            for child in reversed(targets[offsets[i]:offsets[i + 1]]):
+                if not seen[child]:
+                    seen[child] = 1
+                    stack.append(child)
+
+    def to_dict(self):
+        """Rebuild the graph as a plain dict, as stored in `ConsentScript.script`."""
+        return {node.node_id: node.to_dict() for node in self._nodes}
@@ -6,16 +6,44 @@ Graph Integrity Checker for Consent Chat Graph
 
 Usage:
     python graph_integrity.py path/to/conversation_graph.json
+    python graph_integrity.py scripts/ "exports/**/*.json" --format junit --jobs 8
+    python graph_integrity.py --benchmark 100000
 
 This script verifies:
 - All referenced parent/child IDs exist
 - Parent-child relationships are mirrored
 - There are no unreachable nodes
-- Cycles are detected (excluding test_question nodes)
+- Cycles are detected, reported once per strongly connected component
 - Dead-end nodes are marked as terminal (`end_sequence=true`)
+
+Reachability, cycles and dead ends come from a single iterative pass of
+Tarjan's strongly connected components algorithm from the start nodes, so a
+check is linear in the size of the graph and never recurses.
+`check_graph_integrity` returns an IntegrityReport; only the CLI prints.
+
+Given several paths, a directory or a glob, the CLI runs in batch mode: the
+files are checked in a process pool and the results are printed as text,
+JSON or JUnit XML with the time each check took. Batch exit codes:
+0 if every graph passed, 1 if any has integrity issues, 2 if any could not
+be loaded. `manage.py graph_integrity --from-db` checks the scripts in the
+database the same way.
+
+IntegrityIndex keeps the reachability and components of a graph between
+edits, so that adding a node or a link is validated by looking only at its
+neighborhood (see utils/script_integrity.py).
 """
+import argparse
+import glob
 import json
+import os
+import random
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree import ElementTree
+
+REQUIRED_FIELDS = ['type', 'messages', 'parent_ids', 'child_ids', 'metadata']
+
 
 def is_test_question(node_id, graph):
     """
@@ -24,6 +52,12 @@ def is_test_question(node_id, graph):
     node = graph.get(node_id, {})
     return str(node.get("metadata", {}).get("test_question", "")).lower() == "true"
 
+def is_terminal(node):
+    """
+    Returns True if the node's metadata marks it as the end of a sequence.
+    """
+    return str(node.get("metadata", {}).get("end_sequence", "")).lower() == "true"
+
 def normalize_metadata_flags(metadata):
     """
     Normalize metadata boolean fields to strings 'true' or 'false'.
@@ -39,123 +73,468 @@ def normalize_metadata_flags(metadata):
                 metadata[key] = "false"
     return metadata
 
-def trace_cycle(graph, start_node):
+
+class IntegrityReport:
+    """
+    Structured result of an integrity check.
+
+    Attributes:
+        node_count (int): Number of nodes checked.
+        missing_fields (list[tuple]): (node_id, field) for required fields a node lacks.
+        missing_links (list[tuple]): (node_id, "parent_id" | "child_id", referenced_id)
+            for references to nodes that do not exist.
+        unmirrored_links (list[tuple]): (node_id, "->" | "<-", other_id) for child or
+            parent links that the other node does not list back.
+        has_start (bool): Whether a start node (parent_ids containing "start") exists.
+        unreachable (list[str]): Nodes not reachable from a start node.
+        cycles (list[dict]): One entry per strongly connected component with a cycle:
+            "nodes" (sorted node IDs in the component) and "example" (one closed
+            cycle through its smallest node, first node repeated at the end).
+        dead_ends (list[str]): Reachable nodes without children that are not terminal.
+    """
+
+    def __init__(self, node_count):
+        self.node_count = node_count
+        self.missing_fields = []
+        self.missing_links = []
+        self.unmirrored_links = []
+        self.has_start = True
+        self.unreachable = []
+        self.cycles = []
+        self.dead_ends = []
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    @property
+    def errors(self):
+        """Every issue as a human readable message."""
+        errors = [f"Missing field '{field}' in node: {node_id}" for node_id, field in self.missing_fields]
+        errors += [f"{node_id} has non-existent {kind}: {ref}" for node_id, kind, ref in self.missing_links]
+        errors += [
+            f"Inconsistent link: {node_id} {arrow} {other} not mirrored"
+            for node_id, arrow, other in self.unmirrored_links
+        ]
+        if not self.has_start:
+            errors.append("No start node found (parent_ids = ['start'])")
+        errors += [f"Node {node_id} is unreachable from start" for node_id in self.unreachable]
+        errors += [f"Cycle detected: {' -> '.join(cycle['example'])}" for cycle in self.cycles]
+        errors += [f"Dead-end node {node_id} is not marked terminal" for node_id in self.dead_ends]
+        return errors
+
+    def to_dict(self):
+        return {
+            "ok": self.ok,
+            "node_count": self.node_count,
+            "missing_fields": [list(item) for item in self.missing_fields],
+            "missing_links": [list(item) for item in self.missing_links],
+            "unmirrored_links": [list(item) for item in self.unmirrored_links],
+            "has_start": self.has_start,
+            "unreachable": self.unreachable,
+            "cycles": self.cycles,
+            "dead_ends": self.dead_ends,
+            "errors": self.errors,
+        }
+
+
+def strongly_connected_components(num_nodes, children, roots):
+    """
+    Iterative Tarjan's algorithm over integer node indexes.
+
+    Args:
+        num_nodes (int): Nodes are numbered 0..num_nodes-1.
+        children (list[list[int]]): Successor indexes of each node.
+        roots (iterable[int]): Nodes to start from; only nodes reachable from
+            them are visited.
+
+    Returns:
+        tuple:
+            - bytearray: 1 for every visited (reachable) node
+            - list[list[int]]: The components, in reverse topological order
     """
-    Trace and return the full cycle starting from a node.
+    index_of = [-1] * num_nodes
+    lowlink = [0] * num_nodes
+    on_stack = bytearray(num_nodes)
+    visited = bytearray(num_nodes)
+    stack = []
+    components = []
+    counter = 0
+
+    for root in roots:
+        if index_of[root] != -1:
+            continue
+        # Each frame is (node, position of the next child to look at)
+        work = [(root, 0)]
+        while work:
+            node, position = work.pop()
+            if position == 0:
+                index_of[node] = lowlink[node] = counter
+                counter += 1
+                visited[node] = 1
+                stack.append(node)
+                on_stack[node] = 1
+            successors = children[node]
+            descended = False
+            while position < len(successors):
+                child = successors[position]
+                position += 1
+                if index_of[child] == -1:
+                    work.append((node, position))
+                    work.append((child, 0))
+                    descended = True
+                    break
+                if on_stack[child] and index_of[child] < lowlink[node]:
+                    lowlink[node] = index_of[child]
+            if descended:
+                continue
+
+            if lowlink[node] == index_of[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = 0
+                    component.append(member)
+                    if member == node:
+                        break
+                components.append(component)
+            if work:
+                parent = work[-1][0]
+                if lowlink[node] < lowlink[parent]:
+                    lowlink[parent] = lowlink[node]
+
+    return visited, components
+
+
+def example_cycle(start, members, children):
     """
-    path = []
-    visited = set()
+    Return one closed cycle through `start` that stays inside a component.
 
-    def dfs(node_id):
-        if node_id in visited:
-            if node_id in path:
-                cycle_index = path.index(node_id)
-                return path[cycle_index:] + [node_id]
-            return None
-        visited.add(node_id)
-        path.append(node_id)
-        for child_id in graph.get(node_id, {}).get("child_ids", []):
-            result = dfs(child_id)
-            if result:
-                return result
-        path.pop()
-        return None
+    Breadth-first from `start` back to itself, so the cycle is a shortest one
+    and the search is linear in the size of the component.
+    """
+    previous = {start: None}
+    queue = [start]
+    for node in queue:
+        for child in children[node]:
+            if child not in members:
+                continue
+            if child == start:
+                path = [node]
+                while previous[path[-1]] is not None:
+                    path.append(previous[path[-1]])
+                path.reverse()
+                return path + [start]
+            if child not in previous:
+                previous[child] = node
+                queue.append(child)
+    return [start, start]
 
-    return dfs(start_node)
 
-def canonicalize_cycle(cycle):
+def index_links(graph, report):
     """
-    Canonicalize the cycle so duplicates can be compared reliably.
-    Rotate so the smallest node ID is first.
+    Number the nodes and check every link, recording problems in `report`.
+
+    Returns:
+        tuple:
+            - list[str]: Node IDs; a node's index is its position
+            - list[list[int]]: Child indexes of each node, existing children only
+            - list[int]: Indexes of the start nodes
     """
-    if not cycle:
-        return ()
-    min_index = min(range(len(cycle)), key=lambda i: cycle[i])
-    rotated = cycle[min_index:] + cycle[:min_index]
-    return tuple(rotated)
+    ids = list(graph)
+    index = {node_id: i for i, node_id in enumerate(ids)}
+    links = [(node.get("child_ids") or (), node.get("parent_ids") or ()) for node in graph.values()]
+    children = []
+    roots = []
+
+    def has_link(link_ids, node_id):
+        # Link lists are short; only long ones are worth hashing
+        return node_id in (link_ids if len(link_ids) < 16 else set(link_ids))
+
+    for i, (node_id, node) in enumerate(graph.items()):
+        for field in REQUIRED_FIELDS:
+            if field not in node:
+                report.missing_fields.append((node_id, field))
+        child_ids, parent_ids = links[i]
+        child_indexes = []
+        for cid in child_ids:
+            j = index.get(cid)
+            if j is None:
+                report.missing_links.append((node_id, "child_id", cid))
+                continue
+            child_indexes.append(j)
+            if not has_link(links[j][1], node_id):
+                report.unmirrored_links.append((node_id, "->", cid))
+        for pid in parent_ids:
+            j = index.get(pid)
+            if j is None:
+                report.missing_links.append((node_id, "parent_id", pid))
+            elif not has_link(links[j][0], node_id):
+                report.unmirrored_links.append((node_id, "<-", pid))
+        children.append(child_indexes)
+        if "start" in parent_ids:
+            roots.append(i)
+
+    return ids, children, roots
+
 
 def check_graph_integrity(graph):
     """
     Perform integrity checks on the graph: missing fields, bad links, unreachable or cyclic nodes.
+
+    The graph is not modified.
+
+    Returns:
+        IntegrityReport: The issues found.
+    """
+    report = IntegrityReport(len(graph))
+    ids, children, roots = index_links(graph, report)
+
+    if not roots:
+        report.has_start = False
+        return report
+
+    visited, components = strongly_connected_components(len(ids), children, roots)
+
+    report.unreachable = [node_id for i, node_id in enumerate(ids) if not visited[i] and node_id != "start"]
+
+    for component in components:
+        if len(component) == 1 and component[0] not in children[component[0]]:
+            continue
+        members = set(component)
+        start = min(component, key=ids.__getitem__)
+        report.cycles.append({
+            "nodes": sorted(ids[i] for i in component),
+            "example": [ids[i] for i in example_cycle(start, members, children)],
+        })
+
+    for i, node_id in enumerate(ids):
+        if visited[i]:
+            node = graph[node_id]
+            if not node.get("child_ids") and not is_terminal(node):
+                report.dead_ends.append(node_id)
+
+    return report
+
+
+class IntegrityIndex:
     """
-    errors = []
-    all_node_ids = set(graph.keys())
-    seen = set()
+    Reachability and strongly connected components of a graph, kept current across edits.
+
+    Built with one full pass, then updated by `add_node` and `add_edge`,
+    which only look at the neighborhood of the edit:
+
+    - Reachability spreads from a newly linked node into nodes that were
+      unreachable before, so each node is marked at most once.
+    - Components keep a topological order in which every edge goes from a
+      lower to a higher order. An edge that agrees with the order cannot close
+      a cycle and needs no search; otherwise only the nodes ordered between
+      its ends are searched and reordered (Pearce and Kelly's dynamic
+      topological sort). An edge that closes a new cycle rebuilds the index.
+
+    Every edit to the graph must go through the index; after removing nodes
+    or links, build a new one. The index holds plain sets and dicts, so it
+    can be pickled into a cache.
+    """
+
+    def __init__(self, graph):
+        self._build(graph)
+
+    def _build(self, graph):
+        ids, children, roots = index_links(graph, IntegrityReport(len(graph)))
+        self.reachable = set()
+        if roots:
+            visited, _ = strongly_connected_components(len(ids), children, roots)
+            self.reachable = {node_id for i, node_id in enumerate(ids) if visited[i]}
+
+        _, components = strongly_connected_components(len(ids), children, range(len(ids)))
+        # Members of cyclic components map to the smallest member ID; other nodes are their own key
+        self.component = {}
+        self.order = {}
+        for position, component in enumerate(reversed(components)):
+            key = min(ids[i] for i in component)
+            if len(component) > 1 or component[0] in children[component[0]]:
+                for i in component:
+                    self.component[ids[i]] = key
+            self.order[key] = position
+        self.next_order = len(components)
+
+    def _key(self, node_id):
+        return self.component.get(node_id, node_id)
+
+    def add_node(self, graph, node_id):
+        """
+        Record a node that was just added to `graph`, with its links mirrored.
+
+        Returns:
+            IntegrityReport: The issues the new node introduces.
+        """
+        node = graph[node_id]
+        report = IntegrityReport(1)
+
+        # Ordered after every existing node, so the links from its parents agree with the order
+        self.order[node_id] = self.next_order
+        self.next_order += 1
+        for pid in node.get("parent_ids") or ():
+            if pid == "start":
+                self._mark_reachable(graph, node_id)
+            elif pid not in graph:
+                report.missing_links.append((node_id, "parent_id", pid))
+            elif node_id not in (graph[pid].get("child_ids") or ()):
+                report.unmirrored_links.append((node_id, "<-", pid))
+            elif pid in self.reachable:
+                self._mark_reachable(graph, node_id)
+
+        for cid in node.get("child_ids") or ():
+            if cid not in graph:
+                report.missing_links.append((node_id, "child_id", cid))
+            elif node_id not in (graph[cid].get("parent_ids") or ()):
+                report.unmirrored_links.append((node_id, "->", cid))
+            else:
+                self._link(graph, node_id, cid, report)
+
+        if node_id not in self.reachable:
+            report.unreachable.append(node_id)
+        self.check_node(graph, node_id, report)
+        return report
+
+    def add_edge(self, graph, parent_id, child_id):
+        """
+        Record a link between two existing nodes that was just added to `graph`.
+
+        Returns:
+            IntegrityReport: The issues the new link introduces.
+        """
+        report = IntegrityReport(0)
+        for node_id, kind, ref in ((parent_id, "child_id", child_id), (child_id, "parent_id", parent_id)):
+            if ref not in graph:
+                report.missing_links.append((node_id, kind, ref))
+        if report.missing_links:
+            return report
+        if child_id not in (graph[parent_id].get("child_ids") or ()):
+            report.unmirrored_links.append((child_id, "<-", parent_id))
+        if parent_id not in (graph[child_id].get("parent_ids") or ()):
+            report.unmirrored_links.append((parent_id, "->", child_id))
 
-    for node in graph.values():
-        if "metadata" in node:
-            node["metadata"] = normalize_metadata_flags(node["metadata"])
+        if parent_id == "start" or parent_id in self.reachable:
+            self._mark_reachable(graph, child_id)
+        self._link(graph, parent_id, child_id, report)
+        return report
 
-    for node_id, node in graph.items():
-        required_fields = ['type', 'messages', 'parent_ids', 'child_ids', 'metadata']
-        for field in required_fields:
+    def check_node(self, graph, node_id, report):
+        """Record a node's missing fields, and whether it is a dead end, in `report`."""
+        node = graph[node_id]
+        for field in REQUIRED_FIELDS:
             if field not in node:
-                errors.append(f"Missing field '{field}' in node: {node_id}")
-
-        for pid in node.get("parent_ids", []):
-            if pid not in all_node_ids:
-                errors.append(f"{node_id} has non-existent parent_id: {pid}")
-        for cid in node.get("child_ids", []):
-            if cid not in all_node_ids:
-                errors.append(f"{node_id} has non-existent child_id: {cid}")
-
-        for cid in node.get("child_ids", []):
-            child = graph.get(cid)
-            if child and node_id not in child.get("parent_ids", []):
-                errors.append(f"Inconsistent link: {node_id} -> {cid} not mirrored")
-        for pid in node.get("parent_ids", []):
-            parent = graph.get(pid)
-            if parent and node_id not in parent.get("child_ids", []):
-                errors.append(f"Inconsistent link: {node_id} <- {pid} not mirrored")
-
-        seen.add(node_id)
-
-    start_nodes = [nid for nid, n in graph.items() if "start" in n.get("parent_ids", [])]
-    if not start_nodes:
-        errors.append("No start node found (parent_ids = ['start'])")
-        return report(errors, graph)
-
-    visited = set()
-    seen_cycles = set()
-
-    def dfs(nid, path):
-        if nid in path:
-            cycle = trace_cycle(graph, nid)
-            if cycle:
-                canon = canonicalize_cycle(cycle)
-                if canon not in seen_cycles:
-                    seen_cycles.add(canon)
-        if nid in visited:
+                report.missing_fields.append((node_id, field))
+        if node_id in self.reachable and not node.get("child_ids") and not is_terminal(node):
+            report.dead_ends.append(node_id)
+
+    def report_changes(self, before, graph, node_ids=()):
+        """
+        Report what an edit made worse, comparing this index with the one from before it.
+
+        Lists nodes that became unreachable and cyclic components that are not
+        part of a single component from before, and checks the nodes in `node_ids` with `check_node`. Takes time linear
+        in the size of the graph.
+
+        Returns:
+            IntegrityReport: The issues the edit introduced.
+        """
+        report = IntegrityReport(len(node_ids))
+        report.unreachable = sorted(node_id for node_id in before.reachable - self.reachable if node_id in graph)
+        for key, members in self._cyclic_components().items():
+            # A component that split off an old one holds no new cycle
+            old_keys = {before.component.get(member) for member in members}
+            if None in old_keys or len(old_keys) > 1:
+                report.cycles.append(self._cycle(graph, key))
+        for node_id in node_ids:
+            if node_id in graph:
+                self.check_node(graph, node_id, report)
+        return report
+
+    def _cyclic_components(self):
+        components = {}
+        for node_id, key in self.component.items():
+            components.setdefault(key, set()).add(node_id)
+        return components
+
+    def _mark_reachable(self, graph, node_id):
+        stack = [node_id]
+        while stack:
+            node_id = stack.pop()
+            if node_id in self.reachable or node_id not in graph:
+                continue
+            self.reachable.add(node_id)
+            stack.extend(graph[node_id].get("child_ids") or ())
+
+    def _link(self, graph, parent_id, child_id, report):
+        source, target = self._key(parent_id), self._key(child_id)
+        if source == target:
+            if parent_id == child_id and parent_id not in self.component:
+                self.component[parent_id] = parent_id
+                report.cycles.append({"nodes": [parent_id], "example": [parent_id, parent_id]})
+            return
+        upper, lower = self.order[source], self.order[target]
+        if lower > upper:
             return
-        visited.add(nid)
-        path.add(nid)
-        for child_id in graph[nid].get("child_ids", []):
-            dfs(child_id, path)
-        path.remove(nid)
 
-    for start in start_nodes:
-        dfs(start, set())
+        # Forward from the child through nodes ordered no later than the parent
+        forward = {target}
+        seen = {child_id}
+        stack = [child_id]
+        while stack:
+            for cid in graph[stack.pop()].get("child_ids") or ():
+                if cid in seen or cid not in graph:
+                    continue
+                seen.add(cid)
+                key = self._key(cid)
+                if key == source:
+                    self._build(graph)
+                    report.cycles.append(self._cycle(graph, parent_id))
+                    return
+                if self.order[key] < upper:
+                    forward.add(key)
+                    stack.append(cid)
 
-    unreachable = all_node_ids - visited
-    for nid in unreachable:
-        if nid != "start":
-            errors.append(f"Node {nid} is unreachable from start")
+        # Backward from the parent through nodes ordered no earlier than the child
+        backward = {source}
+        seen = {parent_id}
+        stack = [parent_id]
+        while stack:
+            for pid in graph[stack.pop()].get("parent_ids") or ():
+                if pid in seen or pid not in graph:
+                    continue
+                seen.add(pid)
+                key = self._key(pid)
+                if self.order[key] > lower:
+                    backward.add(key)
+                    stack.append(pid)
 
-    for cycle in seen_cycles:
-        errors.append(f"Cycle detected: {' -> '.join(cycle)}")
+        # Reuse the same positions: the parent's ancestors first, then the child's descendants
+        positions = sorted(self.order[key] for key in backward | forward)
+        keys = sorted(backward, key=self.order.get) + sorted(forward, key=self.order.get)
+        for key, position in zip(keys, positions):
+            self.order[key] = position
 
-    for nid in visited:
-        node = graph[nid]
-        if not node.get("child_ids") and node.get("metadata", {}).get("end_sequence") != "true":
-            errors.append(f"Dead-end node {nid} is not marked terminal")
+    def _cycle(self, graph, node_id):
+        key = self._key(node_id)
+        ids = sorted(member for member, member_key in self.component.items() if member_key == key)
+        index = {member: i for i, member in enumerate(ids)}
+        children = [
+            [index[cid] for cid in graph[member].get("child_ids") or () if cid in index]
+            for member in ids
+        ]
+        example = example_cycle(0, set(range(len(ids))), children)
+        return {"nodes": ids, "example": [ids[i] for i in example]}
 
-    return report(errors, graph)
 
-def report(errors, graph):
+def print_report(report):
     """
-    Print summary and list of integrity issues.
+    Print summary and list of integrity issues. Returns the CLI exit code.
     """
-    print(f"\n✅ Checked {len(graph)} nodes.")
+    print(f"\n✅ Checked {report.node_count} nodes.")
+    errors = report.errors
     if errors:
         print(f"❌ Found {len(errors)} issues:")
         for err in errors:
@@ -165,24 +544,259 @@ def report(errors, graph):
         print("🎉 No integrity issues found!")
         return 0
 
+def make_synthetic_graph(num_nodes, shape="tree", seed=0):
+    """
+    Build a consistent synthetic consent graph for benchmarking.
+
+    Shapes:
+        chain: one path num_nodes long; the deepest possible traversal.
+        tree: a random tree of bot/user nodes with terminal leaves.
+        cyclic: the tree plus a back edge from every tenth node to an
+            ancestor, giving many overlapping cycles.
+    """
+    rng = random.Random(seed)
+    ids = [f"n{i}" for i in range(num_nodes)]
+    parents = {0: ["start"]}
+    if shape == "chain":
+        for i in range(1, num_nodes):
+            parents[i] = [i - 1]
+    else:
+        for i in range(1, num_nodes):
+            parents[i] = [rng.randrange(max(0, i - 50), i)]
+        if shape == "cyclic":
+            for i in range(10, num_nodes, 10):
+                ancestor = i
+                for _ in range(rng.randrange(1, 5)):
+                    if parents[ancestor][0] == "start":
+                        break
+                    ancestor = parents[ancestor][0]
+                parents[ancestor] = parents[ancestor] + [i]
+
+    children = {i: [] for i in range(num_nodes)}
+    for i, pids in parents.items():
+        for pid in pids:
+            if pid != "start":
+                children[pid].append(i)
+
+    graph = {
+        "start": {
+            "type": "start",
+            "messages": [],
+            "parent_ids": [],
+            "child_ids": [ids[0]],
+            "metadata": {"workflow": "", "end_sequence": "false"},
+        },
+    }
+    graph.update(
+        (ids[i], {
+            "type": "bot" if i % 2 == 0 else "user",
+            "messages": [f"message {i}"],
+            "parent_ids": [pid if pid == "start" else ids[pid] for pid in parents[i]],
+            "child_ids": [ids[c] for c in children[i]],
+            "metadata": {"workflow": "", "end_sequence": "false" if children[i] else "true"},
+        })
+        for i in range(num_nodes)
+    )
+    return graph
+
+
+def benchmark(num_nodes, repeat=3):
+    """
+    Time check_graph_integrity on synthetic graphs of each shape.
+    """
+    print(f"{'shape':<8} {'nodes':>9} {'seconds':>9} {'nodes/s':>11}  result")
+    for shape in ("chain", "tree", "cyclic"):
+        graph = make_synthetic_graph(num_nodes, shape)
+        best = float("inf")
+        for _ in range(repeat):
+            started = time.perf_counter()
+            report = check_graph_integrity(graph)
+            best = min(best, time.perf_counter() - started)
+        summary = "ok" if report.ok else f"{len(report.cycles)} cyclic components, {len(report.errors)} issues"
+        print(f"{shape:<8} {num_nodes:>9} {best:>9.3f} {num_nodes / best:>11,.0f}  {summary}")
+
+EXIT_PASSED, EXIT_FAILED, EXIT_ERROR = 0, 1, 2
+
+
+def expand_paths(patterns):
+    """
+    Resolve files, directories (every *.json below them) and glob patterns
+    into a sorted list of files without duplicates. A pattern that matches
+    nothing is kept, so that it is reported as an error.
+    """
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths += glob.glob(os.path.join(pattern, "**", "*.json"), recursive=True)
+        elif glob.has_magic(pattern):
+            paths += [path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path)]
+        else:
+            paths.append(pattern)
+    return sorted(dict.fromkeys(paths))
+
+
+def check_source(name, source):
+    """
+    Check one graph, given as a dict or as the path of a JSON file.
+
+    Returns:
+        dict: name, status ("passed", "failed" or "error"), seconds, and the
+            report or error message.
+    """
+    started = time.perf_counter()
+    result = {"name": name}
+    try:
+        if isinstance(source, str):
+            with open(source, "r") as f:
+                source = json.load(f)
+        if not isinstance(source, dict):
+            raise ValueError("the graph is not a JSON object")
+        report = check_graph_integrity(source)
+    except Exception as e:
+        result.update(status="error", error=f"{type(e).__name__}: {e}")
+    else:
+        result.update(status="passed" if report.ok else "failed", report=report.to_dict())
+    result["seconds"] = round(time.perf_counter() - started, 6)
+    return result
+
+
+def _check_task(task):
+    return check_source(*task)
+
+
+def check_many(tasks, jobs=None):
+    """
+    Check (name, graph or path) tasks, in a process pool unless `jobs` is 1.
+
+    Tasks are consumed lazily, with at most a few per worker in flight, so
+    a large batch is never all in memory. Yields results in task order.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1:
+        yield from map(_check_task, tasks)
+        return
+    tasks = iter(tasks)
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        pending = []
+        for task in tasks:
+            pending.append(pool.submit(_check_task, task))
+            if len(pending) >= jobs * 4:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+
+def summarize_results(results, seconds):
+    """Counts by status, the wall time and the batch exit code."""
+    counts = {status: sum(1 for result in results if result["status"] == status) for status in ("passed", "failed", "error")}
+    exit_code = EXIT_ERROR if counts["error"] else EXIT_FAILED if counts["failed"] else EXIT_PASSED
+    return {"total": len(results), **counts, "seconds": round(seconds, 6), "exit_code": exit_code}
+
+
+def format_results(results, summary, fmt="text"):
+    """Render batch results as "text", "json" or "junit" (JUnit XML)."""
+    if fmt == "json":
+        return json.dumps({"summary": summary, "results": results}, indent=2)
+
+    if fmt == "junit":
+        suite = ElementTree.Element("testsuite", {
+            "name": "graph_integrity",
+            "tests": str(summary["total"]),
+            "failures": str(summary["failed"]),
+            "errors": str(summary["error"]),
+            "time": f"{summary['seconds']:.3f}",
+        })
+        for result in results:
+            case = ElementTree.SubElement(suite, "testcase", {
+                "classname": "graph_integrity",
+                "name": result["name"],
+                "time": f"{result['seconds']:.3f}",
+            })
+            if result["status"] == "error":
+                ElementTree.SubElement(case, "error", {"message": result["error"]})
+            elif result["status"] == "failed":
+                errors = result["report"]["errors"]
+                failure = ElementTree.SubElement(case, "failure", {"message": f"{len(errors)} integrity issues"})
+                failure.text = "\n".join(errors)
+        ElementTree.indent(suite)
+        return ElementTree.tostring(suite, encoding="unicode", xml_declaration=True)
+
+    lines = []
+    for result in results:
+        if result["status"] == "error":
+            lines.append(f"💥 {result['name']}: {result['error']}")
+        elif result["status"] == "failed":
+            lines.append(f"❌ {result['name']}: {len(result['report']['errors'])} issues ({result['seconds']:.3f}s)")
+        else:
+            lines.append(f"✅ {result['name']} ({result['seconds']:.3f}s)")
+    lines.append(
+        f"\nChecked {summary['total']} graphs in {summary['seconds']:.3f}s: "
+        f"{summary['passed']} passed, {summary['failed']} with issues, {summary['error']} could not be checked."
+    )
+    return "\n".join(lines)
+
+
+def run_batch(tasks, jobs=None, fmt="text", output=None):
+    """
+    Check a batch of (name, graph or path) tasks and write the results to
+    `output` (a path) or stdout. Returns the batch exit code.
+    """
+    started = time.perf_counter()
+    results = list(check_many(tasks, jobs))
+    summary = summarize_results(results, time.perf_counter() - started)
+    text = format_results(results, summary, fmt)
+    if output:
+        with open(output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return summary["exit_code"]
+
+
 def main():
     """
     CLI entry point.
     """
-    if len(sys.argv) != 2:
-        print("Usage: python graph_integrity.py path/to/graph.json")
+    parser = argparse.ArgumentParser(
+        description="Check consent chat graphs for integrity issues.",
+        epilog="Batch exit codes: 0 all passed, 1 integrity issues, 2 a graph could not be loaded.",
+    )
+    parser.add_argument("paths", nargs="*", metavar="path", help="Graph JSON files, directories or glob patterns.")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON (--format json in batch mode).")
+    parser.add_argument("--format", choices=("text", "json", "junit"), help="Batch output format (default text).")
+    parser.add_argument("--jobs", type=int, default=None, help="Worker processes in batch mode (default: CPU count).")
+    parser.add_argument("--output", metavar="FILE", help="Write batch results to FILE instead of stdout.")
+    parser.add_argument("--benchmark", type=int, metavar="NODES", help="Benchmark on synthetic graphs instead.")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark)
+        return
+    if not args.paths:
+        parser.print_usage()
         sys.exit(1)
 
-    file_path = sys.argv[1]
+    batch = (
+        len(args.paths) > 1 or args.format or args.output
+        or os.path.isdir(args.paths[0]) or glob.has_magic(args.paths[0])
+    )
+    if batch:
+        paths = expand_paths(args.paths)
+        fmt = args.format or ("json" if args.json else "text")
+        sys.exit(run_batch(((path, path) for path in paths), args.jobs, fmt, args.output))
+
     try:
-        with open(file_path, "r") as f:
+        with open(args.paths[0], "r") as f:
             graph = json.load(f)
     except Exception as e:
         print(f"Error loading JSON: {e}")
         sys.exit(1)
 
-    exit_code = check_graph_integrity(graph)
-    sys.exit(exit_code)
+    report = check_graph_integrity(graph)
+    if args.json:
+        print(json.dumps(report.to_dict(), indent=2))
+        sys.exit(0 if report.ok else 1)
+    sys.exit(print_report(report))
 
 if __name__ == "__main__":
     main()
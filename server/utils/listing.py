@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# utils/listing.py
+
+"""
+Keyset pagination, field selection and summaries for list endpoints.
+
+List endpoints read these query parameters (ListQueryInputSerializer):
+
+- `limit` and `cursor` return one page, `{"results": [...], "next_cursor": ...}`,
+  ordered by creation time and primary key. Pages are found with a keyset
+  condition on those two columns instead of an OFFSET, so every page costs
+  the same however deep it is. Without either parameter the whole list is
+  returned as a plain array, as before.
+- `fields` is a comma-separated list of the output fields to return. Heavy
+  columns (a script's JSON, consent statements) are only loaded when asked for.
+- `summary=true` returns counts instead of rows.
+"""
+
+import base64
+import binascii
+import json
+from datetime import datetime
+from django.db.models import Count, Q
+from rest_framework import serializers
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(created_at, pk):
+    """An opaque cursor pointing just after the row with these ordering values."""
+    payload = json.dumps([created_at.isoformat(), str(pk)], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    Returns:
+        tuple: (created_at, pk) of the last row of the previous page.
+
+    Raises:
+        ValueError: If the cursor was not made by `encode_cursor`.
+    """
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, pk = json.loads(payload)
+        return datetime.fromisoformat(created_at), pk
+    except (binascii.Error, TypeError, ValueError) as e:
+        raise ValueError("Invalid cursor.") from e
+
+
+class ListQueryInputSerializer(serializers.Serializer):
+    cursor = serializers.CharField(required=False, help_text="next_cursor of the previous page.")
+    limit = serializers.IntegerField(
+        required=False,
+        min_value=1,
+        max_value=MAX_PAGE_SIZE,
+        help_text=f"Page size; returns a page instead of the full list (default {DEFAULT_PAGE_SIZE} with a cursor)."
+    )
+    fields = serializers.CharField(required=False, help_text="Comma-separated output fields to return.")
+    summary = serializers.BooleanField(required=False, default=False, help_text="Return counts without rows.")
+
+    def validate_cursor(self, value):
+        try:
+            return decode_cursor(value)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+
+    def validate_fields(self, value):
+        return list(dict.fromkeys(name.strip() for name in value.split(",") if name.strip()))
+
+
+class SelectableFieldsMixin:
+    """
+    Serializer mixin: `fields=[...]` outputs only the named fields, and the
+    others (method fields included) are never computed.
+
+    `extra_fields` names the keys `to_representation` adds beyond the
+    declared fields; they can be selected too.
+    """
+    extra_fields = ()
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.selected_fields = None if fields is None else set(fields)
+        if self.selected_fields is not None:
+            for name in set(self.fields) - self.selected_fields:
+                self.fields.pop(name)
+
+    @classmethod
+    def selectable_fields(cls):
+        return set(cls().fields) | set(cls.extra_fields)
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if self.selected_fields is not None and self.extra_fields:
+            data = {key: value for key, value in data.items() if key in self.selected_fields}
+        return data
+
+
+def list_objects(queryset, serializer_class, params, created_field="created_at", heavy_fields=(), summary_counts=None):
+    """
+    Serialize a list endpoint's queryset as the query parameters ask.
+
+    Args:
+        queryset (QuerySet): All rows the endpoint lists.
+        serializer_class: Output serializer, with SelectableFieldsMixin.
+        params (dict): Validated ListQueryInputSerializer data.
+        created_field (str): Creation time column, ordered on with the primary key.
+        heavy_fields (iterable[str]): Columns deferred unless selected by `fields`.
+        summary_counts (dict): Extra counts for `summary`, name -> Q filter.
+
+    Raises:
+        serializers.ValidationError: If `fields` names an unknown field.
+
+    Returns:
+        list | dict: The serialized rows, a page, or the summary counts.
+    """
+    if params.get("summary"):
+        return queryset.order_by().aggregate(
+            count=Count("pk"),
+            **{name: Count("pk", filter=condition) for name, condition in (summary_counts or {}).items()},
+        )
+
+    fields = params.get("fields")
+    if fields is not None:
+        selectable = serializer_class.selectable_fields()
+        unknown = [name for name in fields if name not in selectable]
+        if unknown:
+            raise serializers.ValidationError({"fields": [f"Unknown fields: {', '.join(unknown)}"]})
+        deferred = [name for name in heavy_fields if name not in fields]
+        if deferred:
+            queryset = queryset.defer(*deferred)
+
+    queryset = queryset.order_by(created_field, "pk")
+    if "limit" not in params and "cursor" not in params:
+        return serializer_class(queryset, many=True, fields=fields).data
+
+    if "cursor" in params:
+        created_at, pk = params["cursor"]
+        queryset = queryset.filter(
+            Q(**{f"{created_field}__gt": created_at}) | Q(**{created_field: created_at, "pk__gt": pk})
+        )
+    limit = params.get("limit", DEFAULT_PAGE_SIZE)
+    rows = list(queryset[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(getattr(rows[-1], created_field), rows[-1].pk)
+    return {
+        "results": serializer_class(rows, many=True, fields=fields).data,
+        "next_cursor": next_cursor,
+    }
@@ -0,0 +1,375 @@
+#!/usr/bin/env python
+# utils/script_cache.py
+
+"""
+Process-local cache of compiled consent scripts.
+
+Every chat turn needs the conversation graph for the invite's consent script.
+Instead of fetching and deserializing the full `ConsentScript.script` JSON on
+each lookup, workers keep compiled scripts in an LRU cache keyed by
+(script_id, revision). `ConsentScript.save()` bumps the revision, so a stale
+entry in another worker is simply never hit again and ages out.
+
+Compiling a script also precomputes the chat sequence that starts at each
+node, so a chat turn is a dictionary lookup instead of a graph walk. Workflow
+sub-graphs are memoized on the compiled script the first time they are used.
+The graph itself is kept as a `utils.compact_graph.CompactGraph`.
+
+Compiling records the content hash (`utils.script_nodes.node_content_hash`)
+and children of every node. A new revision, or a new version derived from a
+cached script, is compiled against the cached one: a precomputed sequence is
+reused as is when none of the nodes it was walked from changed. After a
+node-level edit, the new revision is built from the cached one directly
+(`cache_edited_script`), hashing only the changed nodes.
+
+With SCRIPT_GRAPH_LOADING set to "lazy", a script that is not in the cache
+is not compiled; `get_runtime_script` returns a LazyScript that reads only
+the nodes a request walks from the node table instead.
+"""
+
+import threading
+from collections import OrderedDict
+from functools import cached_property
+from types import MappingProxyType
+from django.conf import settings
+from consentbot.models import ConsentScript
+from utils.compact_graph import CompactGraph
+from utils.script_edits import EditedGraph
+from utils.script_nodes import LazyScriptGraph, node_content, node_content_hash
+
+
+class CompiledScript:
+    """
+    A consent script prepared for the chat runtime.
+
+    `graph` is a read-only CompactGraph built from the script JSON; it and the
+    `sequences` table are shared between requests.
+    """
+
+    def __init__(self, script_id, revision, graph, base=None):
+        self.script_id = str(script_id)
+        self.revision = revision
+        self.node_keys, self.size = self._key_nodes(graph)
+        self.graph = graph = CompactGraph(graph)
+        self.start_node_id = self._find_start_node_id(graph)
+        self.sequences = self._build_sequences(graph, self.node_keys, base)
+        self._workflow_nodes = {}
+
+    @classmethod
+    def from_edit(cls, previous, revision, changes):
+        """
+        Compile the revision a node-level edit wrote from the compiled script
+        it was computed against.
+
+        Only the changed nodes are hashed and only the sequences that read
+        one of them are walked again. The CompactGraph is still rebuilt from
+        the previous one's node records, a linear pass without any JSON
+        decoding or hashing.
+
+        Args:
+            previous (CompiledScript): The script the edit was computed against.
+            revision (int): The revision the edit wrote.
+            changes (dict): node_id -> the node's new dict, or None if it was deleted.
+        """
+        compiled = cls.__new__(cls)
+        compiled.script_id = previous.script_id
+        compiled.revision = revision
+        node_keys, size = dict(previous.node_keys), previous.size
+        for node_id, node in changes.items():
+            old = previous.graph.get(node_id)
+            if old is not None and node_keys.pop(node_id, None) is not None:
+                size -= cls._node_key(old.to_dict())[1]
+            if isinstance(node, dict):
+                node_keys[node_id], node_size = cls._node_key(node)
+                size += node_size
+        compiled.node_keys, compiled.size = node_keys, size
+        compiled.graph = graph = CompactGraph(EditedGraph(previous.graph, changes))
+        compiled.start_node_id = cls._find_start_node_id(graph)
+        compiled.sequences = cls._build_sequences(graph, node_keys, previous, changed=set(changes))
+        compiled._workflow_nodes = {}
+        return compiled
+
+    @property
+    def key(self):
+        return (self.script_id, self.revision)
+
+    @staticmethod
+    def _find_start_node_id(graph):
+        for node_id, node in graph.items():
+            if node.get("parent_ids") and node["parent_ids"][0] == "start":
+                return node_id
+        return None
+
+    @staticmethod
+    def _node_key(node):
+        """
+        Return (node key, approximate JSON size) of a node dict. The key is
+        (content hash, child_ids); two nodes with the same key read the same
+        during a sequence walk.
+        """
+        content = node_content(node)
+        child_ids = node.get("child_ids")
+        key = (
+            node_content_hash(node, content),
+            tuple(child_ids) if isinstance(child_ids, list) else child_ids,
+        )
+        # About 12 bytes per listed link ID
+        return key, len(content) + 12 * (len(child_ids or ()) + len(node.get("parent_ids") or ()))
+
+    @classmethod
+    def _key_nodes(cls, graph):
+        """Return ({node_id: node key}, approximate JSON size) of a script graph."""
+        node_keys = {}
+        size = 0
+        for node_id, node in graph.items():
+            if not isinstance(node, dict):
+                continue
+            node_keys[node_id], node_size = cls._node_key(node)
+            size += node_size
+        return node_keys, size
+
+    @staticmethod
+    def _sequence_reads(graph, node_ids):
+        """The nodes a sequence walk reads: the nodes it traversed and their children."""
+        reads = set(node_ids)
+        for node_id in node_ids:
+            node = graph.get(node_id)
+            if node is not None:
+                reads.update(node.get("child_ids") or ())
+        return tuple(reads)
+
+    @classmethod
+    def _build_sequences(cls, graph, node_keys, base=None, changed=None):
+        """
+        Precompute the sequence starting at each node, reusing the entries of
+        `base` that read no changed node. Changed nodes are found by comparing
+        node keys, or given as the `changed` set of node IDs.
+        """
+        # Imported here because consentbot.selectors imports this module
+        from consentbot.selectors import get_next_consent_sequence
+
+        sequences = {}
+        for node_id in graph:
+            entry = base.sequences.get(node_id) if base is not None else None
+            if entry is not None and (
+                changed.isdisjoint(entry[2]) if changed is not None
+                else all(base.node_keys.get(read_id) == node_keys.get(read_id) for read_id in entry[2])
+            ):
+                sequences[node_id] = entry
+                continue
+            try:
+                sequence, node_ids = get_next_consent_sequence(graph, node_id)
+            except (KeyError, TypeError):
+                # Malformed nodes are left to fail at request time, as before
+                continue
+            sequence["bot_messages"] = tuple(sequence["bot_messages"])
+            sequence["user_responses"] = tuple(sequence["user_responses"])
+            sequences[node_id] = (MappingProxyType(sequence), tuple(node_ids), cls._sequence_reads(graph, node_ids))
+        return sequences
+
+    def get_sequence(self, node_id):
+        """
+        Return the (read-only sequence, traversed node_ids) pair starting at `node_id`.
+
+        Behaves like `consentbot.selectors.get_next_consent_sequence` on the
+        script graph, including its errors for nodes that are not in the table.
+        """
+        entry = self.sequences.get(node_id)
+        if entry is None:
+            from consentbot.selectors import get_next_consent_sequence
+            return get_next_consent_sequence(self.graph, node_id)
+        return entry[:2]
+
+    def get_workflow_nodes(self, start_id, metadata_field=None):
+        """
+        Return the tuple of workflow node_ids reachable from `start_id`.
+
+        Memoized version of `consentbot.selectors.get_workflow_node_ids`.
+        """
+        key = (start_id, metadata_field)
+        node_ids = self._workflow_nodes.get(key)
+        if node_ids is None:
+            from consentbot.selectors import get_workflow_node_ids
+            # Concurrent first calls may both walk; the results are identical
+            node_ids = self._workflow_nodes[key] = tuple(
+                get_workflow_node_ids(self.graph, start_id, metadata_field)
+            )
+        return node_ids
+
+
+class LazyScript:
+    """
+    A consent script read from the node table as it is walked.
+
+    Has the interface of CompiledScript without the precomputed tables:
+    sequences and workflow sub-graphs are walked on a LazyScriptGraph, which
+    keeps the nodes it loads for as long as this object lives (one request).
+    """
+
+    def __init__(self, script_id, revision):
+        self.script_id = str(script_id)
+        self.revision = revision
+        self.graph = LazyScriptGraph(script_id)
+        self._workflow_nodes = {}
+
+    @property
+    def key(self):
+        return (self.script_id, self.revision)
+
+    @cached_property
+    def start_node_id(self):
+        return self.graph.start_node_id
+
+    def get_sequence(self, node_id):
+        from consentbot.selectors import get_next_consent_sequence
+        return get_next_consent_sequence(self.graph, node_id)
+
+    def get_workflow_nodes(self, start_id, metadata_field=None):
+        key = (start_id, metadata_field)
+        node_ids = self._workflow_nodes.get(key)
+        if node_ids is None:
+            from consentbot.selectors import get_workflow_node_ids
+            self.graph.load_reachable(start_id)
+            node_ids = self._workflow_nodes[key] = tuple(
+                get_workflow_node_ids(self.graph, start_id, metadata_field)
+            )
+        return node_ids
+
+
+class ScriptCache:
+    """Thread-safe LRU cache of CompiledScript objects bounded by count and size."""
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, script_id, revision):
+        key = (str(script_id), revision)
+        with self._lock:
+            compiled = self._entries.get(key)
+            if compiled is not None:
+                self._entries.move_to_end(key)
+            return compiled
+
+    def put(self, compiled):
+        with self._lock:
+            # A newer revision supersedes any older one for the same script
+            self._discard(compiled.script_id)
+            self._entries[compiled.key] = compiled
+            self.total_bytes += compiled.size
+            self._evict()
+        return compiled
+
+    def find(self, script_id):
+        """The cached compiled script of `script_id` at any revision, or None."""
+        script_id = str(script_id)
+        with self._lock:
+            for key, compiled in self._entries.items():
+                if key[0] == script_id:
+                    return compiled
+        return None
+
+    def invalidate(self, script_id):
+        with self._lock:
+            self._discard(str(script_id))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def _discard(self, script_id):
+        for key in [k for k in self._entries if k[0] == script_id]:
+            self.total_bytes -= self._entries.pop(key).size
+
+    def _evict(self):
+        # Always keep the most recently added entry, even if it is oversized
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes
+        ):
+            _, compiled = self._entries.popitem(last=False)
+            self.total_bytes -= compiled.size
+
+
+script_cache = ScriptCache(
+    max_entries=getattr(settings, "SCRIPT_CACHE_MAX_ENTRIES", 16),
+    max_bytes=getattr(settings, "SCRIPT_CACHE_MAX_BYTES", 32 * 1024 * 1024),
+)
+
+
+def compile_script(script: ConsentScript) -> CompiledScript:
+    """
+    Compile a ConsentScript instance and store it in this worker's cache.
+
+    Sequences are reused from a cached revision of the script or, failing
+    that, of the version it was derived from.
+    """
+    base = script_cache.find(script.script_id)
+    if base is None and script.derived_from_id is not None:
+        base = script_cache.find(script.derived_from_id)
+    return script_cache.put(CompiledScript(script.script_id, script.revision, script.script, base=base))
+
+
+def cache_edited_script(compiled: CompiledScript, revision, changes) -> CompiledScript:
+    """
+    Cache the compiled script of the revision a node-level edit wrote.
+
+    It is built with `CompiledScript.from_edit` from the compiled script the
+    edit was computed against, so the next edit or chat turn in this worker
+    does not reload the script JSON, and only the changed nodes and the
+    sequences that read them are recomputed.
+    """
+    return script_cache.put(CompiledScript.from_edit(compiled, revision, changes))
+
+
+def get_compiled_script(script_id, revision=None) -> CompiledScript:
+    """
+    Return the compiled script for `script_id`, loading it on a cache miss.
+
+    Args:
+        script_id (UUID | str): The ConsentScript primary key.
+        revision (int, optional): The revision the caller expects. When omitted
+            the current revision is read from the database.
+
+    Raises:
+        ConsentScript.DoesNotExist: If the script does not exist.
+    """
+    if revision is None:
+        revision = ConsentScript.objects.values_list("revision", flat=True).get(script_id=script_id)
+
+    compiled = script_cache.get(script_id, revision)
+    if compiled is None:
+        compiled = compile_script(ConsentScript.objects.get(script_id=script_id))
+    return compiled
+
+
+def get_runtime_script(script_id, revision=None):
+    """
+    Return the script a chat request walks: the compiled script, or with
+    SCRIPT_GRAPH_LOADING = "lazy" a LazyScript unless a compiled copy is
+    already cached. Scripts without node rows are always compiled.
+
+    Raises:
+        ConsentScript.DoesNotExist: If the script does not exist.
+    """
+    if getattr(settings, "SCRIPT_GRAPH_LOADING", "compiled") == "lazy":
+        if revision is None:
+            revision = ConsentScript.objects.values_list("revision", flat=True).get(script_id=script_id)
+        compiled = script_cache.get(script_id, revision)
+        if compiled is not None:
+            return compiled
+        script = LazyScript(script_id, revision)
+        if script.start_node_id is not None:
+            return script
+    return get_compiled_script(script_id, revision)
+
+
+def invalidate_script(script_id):
+    """Drop every cached revision of a script from this worker."""
+    script_cache.invalidate(script_id)
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# utils/script_edits.py
+
+"""
+Node-level edits of a stored consent script.
+
+Creating, changing, moving or deleting one node touches a handful of nodes:
+the node itself and the nodes that link to it. Edits are computed against an
+EditedGraph, the compiled script graph with the changed nodes laid over it,
+so the script is neither reloaded nor copied. `write_script_nodes` then
+writes just the changed nodes in one UPDATE that only succeeds if the script
+is still at the revision the edit was computed from (an optimistic version
+check): jsonb_set on PostgreSQL, json_set on SQLite, and a read-modify-write
+of the whole script on other databases.
+
+Writes made here bypass `ConsentScript.save()`: they bump the revision and
+clear `content_hash`, which is filled in again the next time the script's
+integrity report is requested.
+"""
+
+import copy
+import json
+from collections.abc import Mapping
+from django.db import connection
+from django.db.models import F
+from consentbot.models import ConsentScript, script_content_hash
+
+# Links are kept mirrored by the create, move and delete edits, not patched directly
+LINK_FIELDS = ("child_ids", "parent_ids")
+
+
+class EditedGraph(Mapping):
+    """A read-only view of `base` with `changes` laid over it; a None change deletes the node."""
+
+    def __init__(self, base, changes):
+        self.base = base
+        self.changes = changes
+
+    def __getitem__(self, node_id):
+        if node_id in self.changes:
+            node = self.changes[node_id]
+            if node is None:
+                raise KeyError(node_id)
+            return node
+        return self.base[node_id]
+
+    def __contains__(self, node_id):
+        if node_id in self.changes:
+            return self.changes[node_id] is not None
+        return node_id in self.base
+
+    def __iter__(self):
+        for node_id in self.base:
+            if self.changes.get(node_id, True) is not None:
+                yield node_id
+        for node_id, node in self.changes.items():
+            if node is not None and node_id not in self.base:
+                yield node_id
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+def _parse_pointer(path):
+    """Split a JSON pointer ("/metadata/workflow") into unescaped parts."""
+    if not isinstance(path, str) or not path.startswith("/"):
+        raise ValueError(f"Invalid path: {path!r}")
+    return [part.replace("~1", "/").replace("~0", "~") for part in path[1:].split("/")]
+
+
+def _list_index(container, part, allow_end=False):
+    if allow_end and part == "-":
+        return len(container)
+    if not part.isdigit():
+        raise ValueError(f"Invalid list index: {part!r}")
+    index = int(part)
+    if index > len(container) or (index == len(container) and not allow_end):
+        raise ValueError(f"List index out of range: {part!r}")
+    return index
+
+
+def apply_node_patch(node, operations):
+    """
+    Apply JSON-Patch-style operations to a copy of a node and return it.
+
+    Supports the "add", "replace", "remove" and "test" operations of RFC 6902,
+    with paths relative to the node ("/messages/0", "/metadata/end_sequence").
+    `child_ids` and `parent_ids` cannot be patched.
+
+    Raises:
+        ValueError: If an operation is malformed, does not apply, or a test fails.
+    """
+    node = copy.deepcopy(node)
+    for operation in operations:
+        op = operation.get("op")
+        parts = _parse_pointer(operation.get("path"))
+        if parts[0] in LINK_FIELDS:
+            raise ValueError(f"'{parts[0]}' cannot be patched; move the node instead.")
+        if op in ("add", "replace", "test") and "value" not in operation:
+            raise ValueError(f"'{op}' needs a value.")
+
+        container = node
+        for part in parts[:-1]:
+            try:
+                container = container[_list_index(container, part) if isinstance(container, list) else part]
+            except (KeyError, TypeError):
+                raise ValueError(f"Path not found: {operation['path']}")
+        if not isinstance(container, (dict, list)):
+            raise ValueError(f"Path not found: {operation['path']}")
+        key = parts[-1]
+
+        if op == "add":
+            if isinstance(container, list):
+                container.insert(_list_index(container, key, allow_end=True), operation["value"])
+            else:
+                container[key] = operation["value"]
+            continue
+
+        if isinstance(container, list):
+            key = _list_index(container, key)
+        elif key not in container:
+            raise ValueError(f"Path not found: {operation['path']}")
+        if op == "replace":
+            container[key] = operation["value"]
+        elif op == "remove":
+            del container[key]
+        elif op == "test":
+            if container[key] != operation["value"]:
+                raise ValueError(f"Test failed: {operation['path']}")
+        else:
+            raise ValueError(f"Unsupported op: {op!r}")
+    return node
+
+
+def write_script_nodes(script_id, revision, changes):
+    """
+    Write changed nodes into a stored script if it is still at `revision`.
+
+    Args:
+        script_id (UUID | str): The ConsentScript primary key.
+        revision (int): The revision the changes were computed from.
+        changes (dict): node_id -> the node's new dict, or None to delete the node.
+
+    Raises:
+        ValueError: If a node ID contains a double quote or a backslash,
+            which cannot be written into the JSON path used on SQLite.
+
+    Returns:
+        int | None: The new revision, or None if the script is no longer at
+            `revision` (or no longer exists).
+    """
+    for node_id in changes:
+        if '"' in node_id or "\\" in node_id:
+            raise ValueError(f"'{node_id}' is not a valid node ID.")
+
+    vendor = connection.vendor
+    if vendor not in ("postgresql", "sqlite"):
+        script = ConsentScript.objects.filter(pk=script_id, revision=revision).values_list("script", flat=True).first()
+        if script is None:
+            return None
+        for node_id, node in changes.items():
+            if node is None:
+                script.pop(node_id, None)
+            else:
+                script[node_id] = node
+        updated = ConsentScript.objects.filter(pk=script_id, revision=revision).update(
+            script=script, revision=F("revision") + 1, content_hash=script_content_hash(script)
+        )
+        return revision + 1 if updated else None
+
+    quote = connection.ops.quote_name
+    table = quote(ConsentScript._meta.db_table)
+    script_col, revision_col, hash_col, pk_col = (
+        quote(ConsentScript._meta.get_field(name).column)
+        for name in ("script", "revision", "content_hash", "script_id")
+    )
+
+    # One nested set/remove per changed node, applied in a single statement
+    expression, params = script_col, []
+    for node_id, node in changes.items():
+        if vendor == "postgresql":
+            if node is None:
+                expression = f"({expression} - %s)"
+                params.append(node_id)
+            else:
+                expression = f"jsonb_set({expression}, %s, %s::jsonb)"
+                params += [[node_id], json.dumps(node)]
+        else:
+            path = '$."' + node_id + '"'
+            if node is None:
+                expression = f"json_remove({expression}, %s)"
+                params.append(path)
+            else:
+                expression = f"json_set({expression}, %s, json(%s))"
+                params += [path, json.dumps(node)]
+
+    sql = (
+        f"UPDATE {table} SET {script_col} = {expression}, {revision_col} = {revision_col} + 1, {hash_col} = '' "
+        f"WHERE {pk_col} = %s AND {revision_col} = %s "
+        f"RETURNING {revision_col}"
+    )
+    params += [ConsentScript._meta.pk.get_db_prep_value(script_id, connection), revision]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+    return row[0] if row else None
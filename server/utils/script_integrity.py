@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# utils/script_integrity.py
+
+"""
+Integrity state of consent scripts, kept between edits.
+
+Validating an edit with a full `check_graph_integrity` pass costs time linear
+in the size of the script. Instead, the `utils.graph_integrity.IntegrityIndex`
+of each script revision is kept in Django's default cache. An edit loads the
+index for the revision it starts from, validates and applies the change to
+it, and stores it under the revision the save produces. A missing index (the
+first edit, an evicted entry, or a save made elsewhere in between) is
+rebuilt with one full pass.
+
+The default cache is the per-process LocMemCache, so each worker builds its
+own index on its first edit of a revision. Workers only share the index
+when the cache `BACKEND` points at a shared cache such as Redis.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from consentbot.models import ConsentScript
+from utils.graph_integrity import IntegrityIndex
+
+
+def _index_key(script_id, revision):
+    return f"script-integrity:{script_id}:{revision}"
+
+
+def get_integrity_index(script: ConsentScript, graph=None) -> IntegrityIndex:
+    """
+    Return the IntegrityIndex of the script's current revision.
+
+    On a cache miss the index is built from `graph` (by default
+    `script.script`), so call it before changing the graph.
+    """
+    index = cache.get(_index_key(script.script_id, script.revision))
+    if index is None:
+        index = IntegrityIndex(script.script if graph is None else graph)
+    return index
+
+
+def store_integrity_index(script: ConsentScript, index: IntegrityIndex):
+    """Store the index for the revision `script` was just saved as."""
+    cache.set(
+        _index_key(script.script_id, script.revision),
+        index,
+        timeout=getattr(settings, "SCRIPT_INTEGRITY_CACHE_TIMEOUT", 24 * 60 * 60),
+    )
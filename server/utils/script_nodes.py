@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+# utils/script_nodes.py
+
+"""
+Normalized storage of consent script nodes.
+
+Besides the `ConsentScript.script` JSON, each script's nodes are stored as
+ConsentScriptNode rows and its links as ConsentScriptLink rows. A node row
+points to a ScriptNodeContent row keyed by `node_content_hash`, the hash of
+the node's canonical JSON without its links, so script versions (and
+revisions) store the content of their unchanged nodes only once:
+
+- `store_script_nodes` rewrites all rows of a script after its JSON is saved,
+- `update_script_nodes` rewrites the rows a node-level edit touched,
+- `export_script` rebuilds the script JSON from the rows.
+
+LazyScriptGraph reads a script graph from the rows as it is walked, so a
+chat that only passes through a few nodes never loads the rest.
+"""
+
+import hashlib
+import json
+from collections.abc import Mapping
+from itertools import zip_longest
+from django.db import transaction
+from django.db.models import Max, Q
+from consentbot.models import ConsentScriptLink, ConsentScriptNode, ScriptNodeContent
+
+# Node keys with a ScriptNodeContent column; other keys, except the links, go to `extra`
+COLUMN_KEYS = ("type", "messages", "attachment", "render_type", "render_content", "metadata")
+LINK_KEYS = ("child_ids", "parent_ids")
+
+_canonical = json.JSONEncoder(sort_keys=True, separators=(",", ":"))
+
+
+def node_content(node):
+    """The canonical JSON of a node without its links."""
+    return _canonical.encode({key: value for key, value in node.items() if key not in LINK_KEYS})
+
+
+def node_content_hash(node, content=None):
+    """The sha256 of `node_content(node)`; pass `content` if it is already encoded."""
+    if content is None:
+        content = node_content(node)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def content_row(node, content_hash):
+    """An unsaved ScriptNodeContent for a node dict."""
+    return ScriptNodeContent(
+        content_hash=content_hash,
+        extra={key: value for key, value in node.items() if key not in COLUMN_KEYS and key not in LINK_KEYS},
+        **{key: node.get(key) for key in COLUMN_KEYS},
+    )
+
+
+def _store_contents(nodes):
+    """
+    Store the content of the given nodes that is not stored yet.
+
+    Returns:
+        dict: node_id -> content hash
+    """
+    hashes = {node_id: node_content_hash(node) for node_id, node in nodes.items()}
+    stored = set(
+        ScriptNodeContent.objects.filter(content_hash__in=set(hashes.values())).values_list("content_hash", flat=True)
+    )
+    missing = {}
+    for node_id, content_hash in hashes.items():
+        if content_hash not in stored:
+            missing.setdefault(content_hash, content_row(nodes[node_id], content_hash))
+    # A concurrent save may store the same content first
+    ScriptNodeContent.objects.bulk_create(missing.values(), batch_size=500, ignore_conflicts=True)
+    return hashes
+
+
+def prune_node_contents():
+    """Delete content rows no node points to any more; returns how many."""
+    deleted, _ = ScriptNodeContent.objects.filter(nodes__isnull=True).delete()
+    return deleted
+
+
+def node_from_row(row, child_ids, parent_ids):
+    """Rebuild a node dict, with its keys in their stored order, from its row (with content) and links."""
+    content = row.content
+    values = {key: getattr(content, key) for key in COLUMN_KEYS}
+    values.update(content.extra)
+    values["child_ids"] = child_ids
+    values["parent_ids"] = parent_ids
+    return {key: values.get(key) for key in row.keys}
+
+
+def link_pairs(graph, node_ids):
+    """The (parent_id, child_id) pairs that the nodes in `node_ids` list, in order."""
+    pairs = {}
+    for node_id in node_ids:
+        node = graph.get(node_id)
+        if not isinstance(node, Mapping):
+            continue
+        for child_id in node.get("child_ids") or ():
+            pairs[(node_id, child_id)] = None
+        for parent_id in node.get("parent_ids") or ():
+            pairs[(parent_id, node_id)] = None
+    return list(pairs)
+
+
+def link_row_values(graph, pairs):
+    """
+    ConsentScriptLink field values for the given links, one row per occurrence.
+
+    A link listed by only one of its ends gets a null position on the other.
+    """
+    rows = []
+    for parent_id, child_id in pairs:
+        parent, child = graph.get(parent_id), graph.get(child_id)
+        child_positions = [
+            i for i, node_id in enumerate(parent.get("child_ids") or ()) if node_id == child_id
+        ] if isinstance(parent, Mapping) else []
+        parent_positions = [
+            i for i, node_id in enumerate(child.get("parent_ids") or ()) if node_id == parent_id
+        ] if isinstance(child, Mapping) else []
+        for child_position, parent_position in zip_longest(child_positions, parent_positions):
+            rows.append({
+                "parent_id": parent_id,
+                "child_id": child_id,
+                "child_position": child_position,
+                "parent_position": parent_position,
+            })
+    return rows
+
+
+def link_lists(links):
+    """
+    Group (parent_id, child_id, child_position, parent_position) rows into
+    each node's ordered child_ids and parent_ids.
+
+    Returns:
+        tuple: (dict of child_ids, dict of parent_ids), keyed by node_id
+    """
+    children, parents = {}, {}
+    for parent_id, child_id, child_position, parent_position in links:
+        if child_position is not None:
+            children.setdefault(parent_id, []).append((child_position, child_id))
+        if parent_position is not None:
+            parents.setdefault(child_id, []).append((parent_position, parent_id))
+    return (
+        {node_id: [child_id for _, child_id in sorted(ids)] for node_id, ids in children.items()},
+        {node_id: [parent_id for _, parent_id in sorted(ids)] for node_id, ids in parents.items()},
+    )
+
+
+def _link_values(queryset):
+    return queryset.values_list("parent_id", "child_id", "child_position", "parent_position")
+
+
+def store_script_nodes(script):
+    """Rewrite every node and link row of a script from its JSON."""
+    graph = script.script if isinstance(script.script, dict) else {}
+    graph = {node_id: node for node_id, node in graph.items() if isinstance(node, Mapping)}
+    links = [
+        ConsentScriptLink(script_id=script.pk, **row)
+        for row in link_row_values(graph, link_pairs(graph, graph))
+    ]
+    with transaction.atomic():
+        hashes = _store_contents(graph)
+        nodes = [
+            ConsentScriptNode(
+                script_id=script.pk, node_id=node_id, position=position, content_id=hashes[node_id], keys=list(node)
+            )
+            for position, (node_id, node) in enumerate(graph.items())
+        ]
+        ConsentScriptNode.objects.filter(script_id=script.pk).delete()
+        ConsentScriptLink.objects.filter(script_id=script.pk).delete()
+        ConsentScriptNode.objects.bulk_create(nodes, batch_size=500)
+        ConsentScriptLink.objects.bulk_create(links, batch_size=500)
+
+
+def update_script_nodes(script_id, graph, node_ids):
+    """
+    Rewrite the rows of nodes that an edit changed, added or deleted.
+
+    Args:
+        script_id (UUID | str): The ConsentScript primary key.
+        graph (Mapping): The script graph after the edit.
+        node_ids (iterable[str]): The changed nodes; those not in `graph` are deleted.
+    """
+    node_ids = list(dict.fromkeys(node_ids))
+    nodes = ConsentScriptNode.objects.filter(script_id=script_id)
+    if not nodes.exists():
+        # Never stored (e.g. loaded with loaddata); sync_script_nodes writes all its rows
+        return
+    links = ConsentScriptLink.objects.filter(script_id=script_id).filter(
+        Q(parent_id__in=node_ids) | Q(child_id__in=node_ids)
+    )
+    positions = dict(nodes.filter(node_id__in=node_ids).values_list("node_id", "position"))
+    # Links listed only by an unchanged node are rewritten too
+    pairs = dict.fromkeys(links.values_list("parent_id", "child_id"))
+    pairs.update(dict.fromkeys(link_pairs(graph, node_ids)))
+
+    changed = {node_id: graph.get(node_id) for node_id in node_ids}
+    changed = {node_id: node for node_id, node in changed.items() if isinstance(node, Mapping)}
+
+    with transaction.atomic():
+        hashes = _store_contents(changed)
+        next_position = None
+        rows = []
+        for node_id, node in changed.items():
+            position = positions.get(node_id)
+            if position is None:
+                if next_position is None:
+                    last = nodes.aggregate(last=Max("position"))["last"]
+                    next_position = 0 if last is None else last + 1
+                position = next_position
+                next_position += 1
+            rows.append(ConsentScriptNode(
+                script_id=script_id, node_id=node_id, position=position, content_id=hashes[node_id], keys=list(node)
+            ))
+        nodes.filter(node_id__in=node_ids).delete()
+        links.delete()
+        ConsentScriptNode.objects.bulk_create(rows)
+        ConsentScriptLink.objects.bulk_create(
+            ConsentScriptLink(script_id=script_id, **row) for row in link_row_values(graph, pairs)
+        )
+
+
+def export_script(script_id):
+    """Rebuild a script's JSON, nodes in their stored order, from its rows."""
+    children, parents = link_lists(_link_values(ConsentScriptLink.objects.filter(script_id=script_id)))
+    return {
+        row.node_id: node_from_row(row, children.get(row.node_id, []), parents.get(row.node_id, []))
+        for row in ConsentScriptNode.objects.filter(script_id=script_id).select_related("content").order_by("position")
+    }
+
+
+class LazyScriptGraph(Mapping):
+    """
+    A consent script graph that loads nodes from the node table as they are used.
+
+    Looking up a node that is not loaded yet loads it together with its
+    children, in two queries, so walking a chat sequence mostly hits nodes
+    that are already loaded. Iterating, or asking for the length, loads
+    every node.
+    """
+
+    def __init__(self, script_id):
+        self.script_id = script_id
+        # node_id -> node dict, or None for IDs known not to exist
+        self._nodes = {}
+        self._order = None
+
+    def load(self, node_ids):
+        """Load the given nodes that are not loaded yet, and their children."""
+        wanted = [node_id for node_id in node_ids if node_id not in self._nodes]
+        if not wanted:
+            return
+        links = ConsentScriptLink.objects.filter(script_id=self.script_id)
+        child_ids = links.filter(parent_id__in=wanted, child_position__isnull=False).values("child_id")
+        rows = list(
+            ConsentScriptNode.objects
+            .filter(script_id=self.script_id)
+            .filter(Q(node_id__in=wanted) | Q(node_id__in=child_ids))
+            .select_related("content")
+        )
+        rows = [row for row in rows if row.node_id not in self._nodes]
+        loaded_ids = [row.node_id for row in rows]
+        children, parents = link_lists(_link_values(
+            links.filter(Q(parent_id__in=loaded_ids) | Q(child_id__in=loaded_ids))
+        ))
+        for row in rows:
+            self._nodes[row.node_id] = node_from_row(
+                row, children.get(row.node_id, []), parents.get(row.node_id, [])
+            )
+        for node_id in wanted:
+            self._nodes.setdefault(node_id, None)
+
+    def load_reachable(self, start_id):
+        """Load every node reachable from `start_id`, a level of the graph at a time."""
+        seen = {start_id}
+        frontier = [start_id]
+        while frontier:
+            self.load(frontier)
+            next_frontier = []
+            for node_id in frontier:
+                for child_id in (self._nodes.get(node_id) or {}).get("child_ids") or ():
+                    if child_id not in seen:
+                        seen.add(child_id)
+                        next_frontier.append(child_id)
+            frontier = next_frontier
+
+    @property
+    def start_node_id(self):
+        """The first node, in stored order, whose first parent is "start"; None if there is none."""
+        first_nodes = ConsentScriptLink.objects.filter(
+            script_id=self.script_id, parent_id="start", parent_position=0
+        ).values("child_id")
+        return (
+            ConsentScriptNode.objects
+            .filter(script_id=self.script_id, node_id__in=first_nodes)
+            .order_by("position")
+            .values_list("node_id", flat=True)
+            .first()
+        )
+
+    def _load_all(self):
+        if self._order is None:
+            graph = export_script(self.script_id)
+            self._nodes.update(graph)
+            self._order = list(graph)
+
+    def __getitem__(self, node_id):
+        if node_id not in self._nodes:
+            self.load([node_id])
+        node = self._nodes[node_id]
+        if node is None:
+            raise KeyError(node_id)
+        return node
+
+    def __contains__(self, node_id):
+        try:
+            self[node_id]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        self._load_all()
+        return iter(self._order)
+
+    def __len__(self):
+        self._load_all()
+        return len(self._order)
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# utils/session_backends.py
+
+"""
+Storage backends for per-invite chat session state.
+
+`utils.cache` reads and writes session keys through the backend named by
+`settings.CONSENT_SESSION_BACKEND`:
+
+- DatabaseSessionBackend: the `ConsentCache` table (default).
+- DjangoCacheSessionBackend: Django's cache framework. With the default
+  local-memory cache this is per-process; configure a shared cache such as
+  Redis or Memcached in `CACHES` when running several workers.
+- WriteBehindSessionBackend: the Django cache in front of the database.
+  Writes land in the cache immediately and are persisted to the database by
+  a background thread, or synchronously when a session ends.
+
+Every write carries the invite's expiry; once it passes, backends treat the
+keys as missing.
+"""
+
+import atexit
+import logging
+import threading
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections, connection
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from consentbot.models import ConsentCache
+
+logger = logging.getLogger(__name__)
+
+# Seconds a cache backed session key lives at most: two weeks, an invite's default lifetime
+DEFAULT_CACHE_TIMEOUT = 14 * 24 * 60 * 60
+
+
+class BaseSessionBackend:
+    """Interface for session key/value storage. Values are strings."""
+
+    def get_many(self, keys):
+        """Return a dict of the given keys that have unexpired stored values."""
+        raise NotImplementedError
+
+    def set_many(self, mapping, expires_at=None):
+        """Store every key/value pair in `mapping`, expiring at `expires_at` if given."""
+        raise NotImplementedError
+
+    def touch(self, keys, expires_at):
+        """Move the expiry of existing keys to `expires_at`."""
+        raise NotImplementedError
+
+    def delete_many(self, keys):
+        """Remove the given keys."""
+        raise NotImplementedError
+
+    def persist(self, keys=None):
+        """Make pending writes durable. A no-op for write-through backends."""
+
+
+class DatabaseSessionBackend(BaseSessionBackend):
+    """Session state stored in the ConsentCache table."""
+
+    def get_many(self, keys):
+        return {key: value for key, (value, _) in self.get_many_with_expiry(keys).items()}
+
+    def get_many_with_expiry(self, keys):
+        """Like `get_many`, with each value's expiry: {key: (value, expires_at)}."""
+        unexpired = Q(expires_at__isnull=True) | Q(expires_at__gt=timezone.now())
+        return {
+            key: (value, expires_at)
+            for key, value, expires_at in (
+                ConsentCache.objects
+                .filter(unexpired, pk__in=list(keys))
+                .values_list("key", "value", "expires_at")
+            )
+        }
+
+    def set_many(self, mapping, expires_at=None):
+        if not mapping:
+            return
+        if connection.vendor not in ("postgresql", "sqlite"):
+            ConsentCache.objects.bulk_create(
+                [ConsentCache(key=key, value=value, expires_at=expires_at) for key, value in mapping.items()],
+                update_conflicts=True,
+                unique_fields=["key"],
+                update_fields=["value", "expires_at"],
+            )
+            return
+
+        # One INSERT ... ON CONFLICT statement, without the transaction
+        # bulk_create would wrap around it
+        quote = connection.ops.quote_name
+        table = quote(ConsentCache._meta.db_table)
+        key, value, expires = quote("key"), quote("value"), quote("expires_at")
+        rows = ", ".join(["(%s, %s, %s)"] * len(mapping))
+        sql = (
+            f"INSERT INTO {table} ({key}, {value}, {expires}) VALUES {rows} "
+            f"ON CONFLICT ({key}) DO UPDATE SET {value} = EXCLUDED.{value}, {expires} = EXCLUDED.{expires}"
+        )
+        expires_param = connection.ops.adapt_datetimefield_value(expires_at)
+        params = []
+        for pair in mapping.items():
+            params.extend((*pair, expires_param))
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+    def touch(self, keys, expires_at):
+        ConsentCache.objects.filter(pk__in=list(keys)).update(expires_at=expires_at)
+
+    def delete_many(self, keys):
+        ConsentCache.objects.filter(pk__in=list(keys)).delete()
+
+
+class DjangoCacheSessionBackend(BaseSessionBackend):
+    """Session state stored in one of Django's configured caches."""
+
+    def __init__(self, alias=None, timeout=None):
+        self.alias = alias or getattr(settings, "CONSENT_SESSION_CACHE_ALIAS", "default")
+        # Longest time a key is kept, also for keys written without an expiry
+        self.timeout = timeout if timeout is not None else getattr(
+            settings, "CONSENT_SESSION_CACHE_TIMEOUT", DEFAULT_CACHE_TIMEOUT
+        )
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _timeout(self, expires_at):
+        if expires_at is None:
+            return self.timeout
+        remaining = max(int((expires_at - timezone.now()).total_seconds()), 1)
+        return min(remaining, self.timeout)
+
+    def get_many(self, keys):
+        return self.cache.get_many(list(keys))
+
+    def set_many(self, mapping, expires_at=None):
+        if mapping:
+            self.cache.set_many(mapping, timeout=self._timeout(expires_at))
+
+    def touch(self, keys, expires_at):
+        timeout = self._timeout(expires_at)
+        for key in keys:
+            self.cache.touch(key, timeout)
+
+    def delete_many(self, keys):
+        self.cache.delete_many(list(keys))
+
+
+class WriteBehindSessionBackend(BaseSessionBackend):
+    """
+    A Django cache in front of the database.
+
+    Reads are served from the cache and fall back to the database on a miss.
+    `back` must provide `get_many_with_expiry`, as DatabaseSessionBackend does.
+    Writes go to the cache and are queued; a daemon thread persists the queue
+    to the database every `CONSENT_SESSION_WRITE_BEHIND_INTERVAL` seconds.
+    `persist` writes queued keys synchronously, and the queue is also drained
+    when the process exits.
+    """
+
+    def __init__(self, front=None, back=None, interval=None):
+        self.front = front or DjangoCacheSessionBackend()
+        self.back = back or DatabaseSessionBackend()
+        self.interval = interval if interval is not None else getattr(
+            settings, "CONSENT_SESSION_WRITE_BEHIND_INTERVAL", 2.0
+        )
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        atexit.register(self.persist)
+
+    def get_many(self, keys):
+        keys = list(keys)
+        found = self.front.get_many(keys)
+        missing = [key for key in keys if key not in found]
+        if missing:
+            now = timezone.now()
+            with self._lock:
+                for key in missing:
+                    value, expires_at = self._pending.get(key, (None, None))
+                    if value is not None and (expires_at is None or expires_at > now):
+                        found[key] = value
+            missing = [key for key in missing if key not in found]
+        if missing:
+            # Refill the front cache with each row's own expiry, so that it
+            # turns into a miss there when it does in the database
+            by_expiry = {}
+            for key, (value, expires_at) in self.back.get_many_with_expiry(missing).items():
+                by_expiry.setdefault(expires_at, {})[key] = value
+                found[key] = value
+            for expires_at, mapping in by_expiry.items():
+                self.front.set_many(mapping, expires_at)
+        return found
+
+    def set_many(self, mapping, expires_at=None):
+        if not mapping:
+            return
+        self.front.set_many(mapping, expires_at)
+        with self._lock:
+            self._pending.update({key: (value, expires_at) for key, value in mapping.items()})
+        self._ensure_writer()
+        self._wakeup.set()
+
+    def touch(self, keys, expires_at):
+        keys = list(keys)
+        with self._lock:
+            for key in keys:
+                if key in self._pending:
+                    self._pending[key] = (self._pending[key][0], expires_at)
+        self.front.touch(keys, expires_at)
+        self.back.touch(keys, expires_at)
+
+    def delete_many(self, keys):
+        keys = list(keys)
+        with self._lock:
+            for key in keys:
+                self._pending.pop(key, None)
+        self.front.delete_many(keys)
+        self.back.delete_many(keys)
+
+    def persist(self, keys=None):
+        with self._lock:
+            if keys is None:
+                batch, self._pending = self._pending, {}
+            else:
+                batch = {key: self._pending.pop(key) for key in list(keys) if key in self._pending}
+        if not batch:
+            return
+        by_expiry = {}
+        for key, (value, expires_at) in batch.items():
+            by_expiry.setdefault(expires_at, {})[key] = value
+        try:
+            for expires_at, mapping in by_expiry.items():
+                self.back.set_many(mapping, expires_at)
+        except Exception:
+            # Re-queue anything that was not overwritten in the meantime
+            with self._lock:
+                for key, value in batch.items():
+                    self._pending.setdefault(key, value)
+            raise
+
+    def _ensure_writer(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run_writer, name="consent-session-writer", daemon=True
+                )
+                self._thread.start()
+
+    def _run_writer(self):
+        while True:
+            self._wakeup.wait()
+            # Coalesce bursts of writes into one database round trip
+            time.sleep(self.interval)
+            self._wakeup.clear()
+            try:
+                self.persist()
+            except Exception:
+                logger.exception("Write-behind session flush failed; will retry")
+                self._wakeup.set()
+            finally:
+                close_old_connections()
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_session_backend():
+    """Return the process-wide backend configured by CONSENT_SESSION_BACKEND."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                path = getattr(
+                    settings, "CONSENT_SESSION_BACKEND", "utils.session_backends.DatabaseSessionBackend"
+                )
+                _backend = import_string(path)()
+    return _backend
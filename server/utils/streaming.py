@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# utils/streaming.py
+
+"""
+Helpers for responses that are written while they are sent.
+
+Large payloads are serialized piece by piece (JSON, CSV or JSON Lines) and
+handed to a StreamingHttpResponse, or written to a file, in buffered chunks.
+This keeps memory flat and avoids temporary files.
+"""
+
+import csv
+import datetime
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+
+# Bytes handed to the server per chunk
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def buffer_chunks(pieces, chunk_size=STREAM_CHUNK_SIZE):
+    """Join small string pieces into encoded chunks of about `chunk_size` bytes."""
+    buffer, size = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield "".join(buffer).encode("utf-8")
+            buffer, size = [], 0
+    if buffer:
+        yield "".join(buffer).encode("utf-8")
+
+
+def json_chunks(value, indent=None, chunk_size=STREAM_CHUNK_SIZE):
+    """Serialize `value` as JSON incrementally, in encoded chunks."""
+    return buffer_chunks(json.JSONEncoder(indent=indent).iterencode(value), chunk_size)
+
+
+class _Echo:
+    """A file-like object whose write returns what it was given, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def _csv_value(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, cls=DjangoJSONEncoder)
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+
+def csv_chunks(columns, rows, chunk_size=STREAM_CHUNK_SIZE):
+    """Write a header and rows (sequences) as CSV, in encoded chunks; nested values as JSON."""
+    writer = csv.writer(_Echo())
+
+    def lines():
+        yield writer.writerow(columns)
+        for row in rows:
+            yield writer.writerow([_csv_value(value) for value in row])
+
+    return buffer_chunks(lines(), chunk_size)
+
+
+def jsonl_chunks(columns, rows, chunk_size=STREAM_CHUNK_SIZE):
+    """Write rows (sequences) as JSON Lines objects keyed by `columns`, in encoded chunks."""
+    encoder = DjangoJSONEncoder()
+    return buffer_chunks(
+        (encoder.encode(dict(zip(columns, row))) + "\n" for row in rows),
+        chunk_size,
+    )
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# utils/workflow_queue.py
+
+"""
+The per-invite queue of workflow segments.
+
+When a participant enrolls several people, `generate_workflow` queues one
+segment of node IDs per enrollment option. Each chat turn inside the front
+segment removes the nodes it visited, and the segment is dropped once it is
+exhausted or its sequence ends.
+
+Segments are insertion-ordered sets (dicts with None values), so membership
+tests and removals are O(1). The queue tracks whether the front segment or
+the segments behind it changed since it was read, so only the changed part
+is written back. Both parts serialize to comma/semicolon separated node IDs,
+falling back to JSON for IDs or segments that the compact form cannot carry.
+"""
+
+import json
+
+NODE_SEPARATOR = ","
+SEGMENT_SEPARATOR = ";"
+
+
+def _is_compact(segments):
+    """Whether the segments survive a round trip through the compact form."""
+    for segment in segments:
+        if not segment:
+            return False
+        for node_id in segment:
+            if (
+                not isinstance(node_id, str)
+                or not node_id
+                or node_id.startswith("[")
+                or NODE_SEPARATOR in node_id
+                or SEGMENT_SEPARATOR in node_id
+            ):
+                return False
+    return True
+
+
+class WorkflowQueue:
+    """A queue of workflow segments with O(1) membership and removal in each."""
+
+    def __init__(self, segments=()):
+        self._segments = [dict.fromkeys(segment) for segment in segments]
+        self.front_changed = True
+        self.rest_changed = True
+        # Set when the queue was read from the older single-list format
+        self.replaces_legacy = False
+
+    @classmethod
+    def from_legacy(cls, workflow):
+        """Build a queue from the older stored form, a list of node ID lists."""
+        queue = cls(workflow)
+        queue.replaces_legacy = True
+        return queue
+
+    @classmethod
+    def parse(cls, front, rest):
+        """Build a queue from its stored front and rest values; the queue starts unchanged."""
+        segments = []
+        if front:
+            segments.append(json.loads(front) if front.startswith("[") else front.split(NODE_SEPARATOR))
+            if rest:
+                if rest.startswith("["):
+                    segments.extend(json.loads(rest))
+                else:
+                    segments.extend(segment.split(NODE_SEPARATOR) for segment in rest.split(SEGMENT_SEPARATOR))
+        queue = cls(segments)
+        queue.front_changed = queue.rest_changed = False
+        return queue
+
+    def __bool__(self):
+        return bool(self._segments)
+
+    def __len__(self):
+        return len(self._segments)
+
+    @property
+    def front(self):
+        """The node IDs of the front segment (a read-only view)."""
+        return self._segments[0].keys() if self._segments else {}.keys()
+
+    def front_contains(self, node_id):
+        return bool(self._segments) and node_id in self._segments[0]
+
+    def discard_from_front(self, node_ids):
+        """Remove `node_ids` from the front segment, ignoring IDs that are not in it."""
+        front = self._segments[0]
+        for node_id in node_ids:
+            if front.pop(node_id, False) is None:
+                self.front_changed = True
+
+    def pop_front(self):
+        """Drop the front segment; the next segment, if any, moves to the front."""
+        self._segments.pop(0)
+        self.front_changed = True
+        if self._segments:
+            self.rest_changed = True
+
+    def append(self, node_ids):
+        """Queue a new segment at the back."""
+        self._segments.append(dict.fromkeys(node_ids))
+        if len(self._segments) == 1:
+            self.front_changed = True
+        else:
+            self.rest_changed = True
+
+    def to_list(self):
+        """The queue as a list of node ID lists."""
+        return [list(segment) for segment in self._segments]
+
+    def dump_front(self):
+        """Serialize the front segment; an empty queue dumps as ""."""
+        if not self._segments:
+            return ""
+        front = list(self._segments[0])
+        return NODE_SEPARATOR.join(front) if _is_compact([front]) else json.dumps(front)
+
+    def dump_rest(self):
+        """Serialize the segments behind the front."""
+        rest = [list(segment) for segment in self._segments[1:]]
+        if _is_compact(rest):
+            return SEGMENT_SEPARATOR.join(NODE_SEPARATOR.join(segment) for segment in rest)
+        return json.dumps(rest)
+
+    def mark_saved(self):
+        self.front_changed = self.rest_changed = self.replaces_legacy = False